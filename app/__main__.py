@@ -0,0 +1,62 @@
+# app/__main__.py
+
+import argparse
+import importlib.util
+import os
+from typing import List, Optional
+from app.core.config import settings
+
+# Package each event loop and HTTP parser choice needs; uvicorn[standard] installs them
+LOOPS = {"auto": None, "uvloop": "uvloop", "asyncio": None}
+HTTP_PARSERS = {"auto": None, "httptools": "httptools", "h11": "h11"}
+
+def _check_choice(parser: argparse.ArgumentParser, option: str, value: str, choices: dict) -> None:
+    # Defaults come from settings, which argparse does not check against choices
+    if value not in choices:
+        parser.error(f"{option} must be one of {', '.join(choices)}, not {value!r}")
+    if choices[value] and importlib.util.find_spec(choices[value]) is None:
+        parser.error(f"{option} {value} needs the {choices[value]} package; install uvicorn[standard]")
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Serve the API with uvicorn, configured from settings and the command line"""
+    parser = argparse.ArgumentParser(prog="python -m app", description="Run the Korzina Cart API")
+    parser.add_argument("--host", default=settings.server_host)
+    parser.add_argument("--port", type=int, default=settings.server_port)
+    parser.add_argument(
+        "--workers", type=int, default=settings.server_workers, help="worker processes; 0 for one per CPU"
+    )
+    parser.add_argument("--loop", default=settings.server_loop, help=f"one of {', '.join(LOOPS)}")
+    parser.add_argument("--http", default=settings.server_http, help=f"one of {', '.join(HTTP_PARSERS)}")
+    parser.add_argument(
+        "--graceful-shutdown",
+        type=float,
+        default=settings.server_graceful_shutdown_seconds,
+        help="seconds open requests get to finish after SIGTERM"
+    )
+    parser.add_argument("--reload", action="store_true", help="restart on code changes; development only, one worker")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args(argv)
+    _check_choice(parser, "--loop", args.loop, LOOPS)
+    _check_choice(parser, "--http", args.http, HTTP_PARSERS)
+    workers = None if args.reload else args.workers or os.cpu_count() or 1
+    if settings.cart_write_buffer_enabled and (workers or 1) > 1:
+        # Another worker's direct write can reach the version a buffered cart reports, with other contents
+        parser.error("CART_WRITE_BUFFER_ENABLED needs a single worker; use --workers 1")
+
+    # Imported here so --help and argument errors do not wait for it
+    import uvicorn
+    uvicorn.run(
+        # An import string, so each worker imports and warms up the app itself and the supervisor stays small
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=args.loop,
+        http=args.http,
+        reload=args.reload,
+        timeout_graceful_shutdown=args.graceful_shutdown,
+        log_level=args.log_level
+    )
+
+if __name__ == "__main__":
+    main()
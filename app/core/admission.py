@@ -0,0 +1,254 @@
+# app/core/admission.py
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import orjson
+from app.core.config import settings
+
+# Admission priorities, most urgent first
+PRIORITY_CHECKOUT = 0
+PRIORITY_WRITE = 1
+PRIORITY_READ = 2
+PRIORITY_NAMES = ("checkout", "write", "read")
+
+CART_PATH_PREFIX = "/api/v1/carts"
+_MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+class RejectedError(Exception):
+    """A request was turned away; retry_after is the suggested wait in seconds"""
+
+    def __init__(self, status_code: int, reason: str, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    """Token buckets per key, refilled at rate tokens per second up to burst.
+
+    Only the max_keys most recently used buckets are kept; a dropped bucket
+    comes back full, so forgetting errs on the side of admitting.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_keys = max_keys
+        # key -> [tokens, last refill time]
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def take(self, key: str) -> float:
+        """Take a token for key; returns 0 if one was taken, else seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        self.rejected += 1
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+class AdmissionController:
+    """Bounds concurrent requests, queueing the rest by priority.
+
+    Once max_concurrency requests are in flight, others wait in a queue of
+    at most max_waiting, most urgent first, and a finishing request hands
+    its slot straight to the next one. A full queue turns the newcomer
+    away, unless a less urgent request is waiting, which is turned away in
+    its place. Waiting longer than wait_timeout_seconds turns a request away.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_waiting: int,
+        wait_timeout_seconds: float,
+        retry_after: float = 1.0
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.wait_timeout_seconds = wait_timeout_seconds
+        self.retry_after = retry_after
+        self.in_flight = 0
+        # Heap of (priority, arrival, future); the future resolves when a slot is handed over
+        self._waiting: List[Tuple[int, int, asyncio.Future]] = []
+        self._arrivals = itertools.count()
+        self.admitted = [0] * len(PRIORITY_NAMES)
+        self.rejected: Dict[str, int] = dict.fromkeys(("queue_full", "evicted", "wait_timeout"), 0)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    def _reject(self, reason: str, detail: str) -> RejectedError:
+        self.rejected[reason] += 1
+        return RejectedError(503, reason, detail, self.retry_after)
+
+    def _dequeue(self, entry: Tuple[int, int, asyncio.Future]) -> None:
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+
+    async def acquire(self, priority: int) -> None:
+        """Wait for a slot; raises RejectedError if the request is turned away"""
+        if self.in_flight < self.max_concurrency and not self._waiting:
+            self.in_flight += 1
+            self.admitted[priority] += 1
+            return
+        if len(self._waiting) >= self.max_waiting:
+            least_urgent = max(self._waiting, default=None)
+            if least_urgent is None or least_urgent[0] <= priority:
+                raise self._reject("queue_full", "Server is busy; retry later")
+            self._dequeue(least_urgent)
+            least_urgent[2].set_exception(
+                self._reject("evicted", "Server is busy with more urgent requests; retry later")
+            )
+        entry = (priority, next(self._arrivals), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiting, entry)
+        future = entry[2]
+        try:
+            await asyncio.wait({future}, timeout=self.wait_timeout_seconds)
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        if not future.done():
+            self._abandon(entry)
+            raise self._reject("wait_timeout", "Server is busy; retry later")
+        # Raises RejectedError if a more urgent request took this one's place
+        future.result()
+        self.admitted[priority] += 1
+
+    def _abandon(self, entry: Tuple[int, int, asyncio.Future]) -> None:
+        future = entry[2]
+        if future.done():
+            if future.exception() is None:
+                # The slot was handed over just before the caller gave up
+                self.release()
+            return
+        future.cancel()
+        self._dequeue(entry)
+
+    def release(self) -> None:
+        """Free a slot, handing it to the most urgent waiting request"""
+        if self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            future.set_result(None)
+            return
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiting),
+            "admitted": dict(zip(PRIORITY_NAMES, self.admitted)),
+            "rejected": dict(self.rejected),
+        }
+
+def classify(method: str, path: str) -> Tuple[Optional[int], Optional[str]]:
+    """Admission priority of a request (None if exempt) and, for cart mutations, the key of the cart's rate limit"""
+    # Health checks, metrics and docs stay reachable, and event streams would hold a slot for hours
+    if not path.startswith("/api/") or path.endswith("/events"):
+        return None, None
+    mutating = method in _MUTATING_METHODS
+    if path == CART_PATH_PREFIX or path.startswith(CART_PATH_PREFIX + "/"):
+        segments = path[len(CART_PATH_PREFIX):].strip("/").split("/")
+        if not mutating:
+            return PRIORITY_READ, None
+        if method == "POST" and len(segments) == 2 and segments[1] == "checkout":
+            return PRIORITY_CHECKOUT, segments[0]
+        if segments[0] == "users" and len(segments) > 1:
+            # User carts are limited per user, whose cart ID is not in the path
+            return PRIORITY_WRITE, "user:" + segments[1]
+        return PRIORITY_WRITE, segments[0]
+    return (PRIORITY_WRITE if mutating else PRIORITY_READ), None
+
+# Shared per worker, like the product cache
+client_rate_limiter = TokenBucketLimiter(
+    settings.rate_limit_client_per_second, settings.rate_limit_client_burst, settings.rate_limit_max_keys
+)
+cart_rate_limiter = TokenBucketLimiter(
+    settings.rate_limit_cart_per_second, settings.rate_limit_cart_burst, settings.rate_limit_max_keys
+)
+admission_controller = AdmissionController(
+    settings.admission_max_concurrency,
+    settings.admission_max_waiting,
+    settings.admission_wait_timeout_seconds,
+    settings.admission_retry_after_seconds
+)
+
+def _client_key(scope) -> str:
+    if settings.trust_forwarded_for:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+def _check_rate_limits(scope, cart_id: str) -> None:
+    for name, limiter, key in (
+        ("client", client_rate_limiter, _client_key(scope)),
+        ("cart", cart_rate_limiter, cart_id)
+    ):
+        if not limiter.enabled or not key:
+            continue
+        retry_after = limiter.take(key)
+        if retry_after:
+            raise RejectedError(429, f"{name}_rate", f"Too many cart changes per {name}; slow down", retry_after)
+
+async def _send_rejection(send, error: RejectedError) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": error.status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"retry-after", str(max(1, math.ceil(error.retry_after))).encode())
+        ]
+    })
+    await send({"type": "http.response.body", "body": orjson.dumps({"detail": str(error)})})
+
+class AdmissionMiddleware:
+    """ASGI middleware rate limiting cart changes and bounding concurrent API requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        priority, cart_id = classify(scope["method"], scope["path"])
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            if cart_id is not None:
+                _check_rate_limits(scope, cart_id)
+            if admission_controller.enabled:
+                await admission_controller.acquire(priority)
+        except RejectedError as e:
+            await _send_rejection(send, e)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if admission_controller.enabled:
+                admission_controller.release()
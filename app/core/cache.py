@@ -0,0 +1,160 @@
+# app/core/cache.py
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Tuple
+
+_MISSING = object()
+# Cached in place of a value for keys known to have none
+_ABSENT = object()
+
+class AsyncLRUCache:
+    """Bounded LRU cache with per-entry TTL and single-flight loading.
+
+    With negative_ttl_seconds set, keys the loader did not return are
+    remembered as absent for that long, so repeated lookups of them are
+    answered without loading.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float, negative_ttl_seconds: float = 0.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+        # Bumped on invalidation so loads started before it are not cached
+        self._generation = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def _lookup(self, key: Hashable) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            # Expired entries are dropped lazily on access
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return a cached value without loading it"""
+        value = self._lookup(key)
+        return default if value is _MISSING or value is _ABSENT else value
+
+    def _store(self, key: Hashable, value: Any, ttl_seconds: float) -> None:
+        if not self.enabled:
+            return
+        self._entries[key] = (time.monotonic() + ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._store(key, value, self.ttl_seconds)
+
+    def set_absent(self, key: Hashable) -> None:
+        """Remember that key has no value, if negative caching is enabled"""
+        self._generation += 1
+        self._entries.pop(key, None)
+        if self.negative_ttl_seconds > 0:
+            self._store(key, _ABSENT, self.negative_ttl_seconds)
+
+    def invalidate(self, key: Hashable) -> None:
+        self._generation += 1
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._generation += 1
+        self._entries.clear()
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """Return the cached value for key, loading it once for all concurrent callers"""
+        results = await self.get_many_or_load([key], lambda keys: _load_single(key, loader))
+        return results.get(key)
+
+    async def get_many_or_load(
+        self,
+        keys: Iterable[Hashable],
+        loader: Callable[[list], Awaitable[Dict[Hashable, Any]]],
+    ) -> Dict[Hashable, Any]:
+        """Return cached values for keys, loading all misses with one loader call.
+
+        Keys already being loaded by another caller are awaited instead of
+        loaded again. Keys the loader does not return are reported as None.
+        """
+        results: Dict[Hashable, Any] = {}
+        waiting: Dict[Hashable, asyncio.Future] = {}
+        to_load = []
+        for key in dict.fromkeys(keys):
+            value = self._lookup(key)
+            if value is _ABSENT:
+                self.negative_hits += 1
+                results[key] = None
+            elif value is not _MISSING:
+                self.hits += 1
+                results[key] = value
+            elif key in self._inflight:
+                self.hits += 1
+                waiting[key] = self._inflight[key]
+            else:
+                self.misses += 1
+                to_load.append(key)
+
+        if to_load:
+            loop = asyncio.get_running_loop()
+            futures = {key: loop.create_future() for key in to_load}
+            self._inflight.update(futures)
+            generation = self._generation
+            try:
+                loaded = await loader(to_load)
+            except BaseException as e:
+                for future in futures.values():
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+                        # Mark the exception as retrieved for futures nobody awaits
+                        future.exception()
+                raise
+            finally:
+                for key in to_load:
+                    self._inflight.pop(key, None)
+            for key, future in futures.items():
+                value = loaded.get(key)
+                if generation == self._generation:
+                    if value is not None:
+                        self.set(key, value)
+                    elif self.negative_ttl_seconds > 0:
+                        self._store(key, _ABSENT, self.negative_ttl_seconds)
+                future.set_result(value)
+                results[key] = value
+
+        for key, future in waiting.items():
+            results[key] = await asyncio.shield(future)
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+            "evictions": self.evictions,
+            "inflight": len(self._inflight),
+        }
+
+async def _load_single(key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Dict[Hashable, Any]:
+    return {key: await loader()}
@@ -1,14 +1,134 @@
 # app/core/config.py
 
 from pydantic_settings import BaseSettings
+from typing import Optional
 from dotenv import load_dotenv
 import os
 
 load_dotenv()
 
 class Settings(BaseSettings):
+    # Storage engine: "mongo", or "memory" for a process-local store without persistence
+    storage_backend: str = "mongo"
+
     mongo_uri: str = os.getenv("MONGO_URI", "mongodb://localhost:27017")
     mongo_db: str = os.getenv("MONGO_DB", "cartdb")
+
+    # Motor connection pool and driver options
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: Optional[int] = None
+    mongo_wait_queue_timeout_ms: Optional[int] = None
+    mongo_server_selection_timeout_ms: int = 30000
+    # Comma-separated wire compressors, e.g. "zstd,snappy"
+    mongo_compressors: str = ""
+    mongo_read_preference: str = "primary"
+
+    # Launcher (python -m app); 0 workers means one per CPU
+    server_host: str = "0.0.0.0"
+    server_port: int = 8000
+    server_workers: int = 1
+    # Event loop ("auto", "uvloop" or "asyncio") and HTTP parser ("auto", "httptools" or "h11")
+    server_loop: str = "auto"
+    server_http: str = "auto"
+    server_graceful_shutdown_seconds: float = 30.0
+
+    # Per-worker warmup on startup: open MONGO_MIN_POOL_SIZE connections and
+    # cache the products found most often in the latest orders (0 products disables)
+    warmup_pool_timeout_seconds: float = 5.0
+    warmup_product_cache_size: int = 500
+    warmup_recent_orders: int = 1000
+
+    # Admission control: token buckets limiting cart changes per client and per cart, and a cap on
+    # concurrent API requests with a bounded wait queue where checkout goes before writes and reads.
+    # A rate or concurrency of 0 disables that part.
+    admission_control_enabled: bool = False
+    rate_limit_client_per_second: float = 10.0
+    rate_limit_client_burst: int = 30
+    rate_limit_cart_per_second: float = 5.0
+    rate_limit_cart_burst: int = 15
+    rate_limit_max_keys: int = 100000
+    admission_max_concurrency: int = 64
+    admission_max_waiting: int = 256
+    admission_wait_timeout_seconds: float = 2.0
+    admission_retry_after_seconds: float = 1.0
+    # Key clients by the first X-Forwarded-For address; only behind a proxy that sets it
+    trust_forwarded_for: bool = False
+
+    # Cart analytics under /api/v1/admin/analytics: age buckets by hours since a cart last changed
+    # (comma-separated upper bounds), and how often the reports are materialized into summary
+    # collections to be served from there (0 computes them on every request)
+    analytics_cart_age_hours: str = "1,24,72,168,720"
+    analytics_refresh_interval_seconds: float = 0.0
+    # Longest a worker may take to materialize them before another worker takes over
+    analytics_refresh_lease_seconds: float = 600.0
+    analytics_top_products_limit: int = 20
+
+    # Prometheus metrics at /metrics
+    metrics_enabled: bool = True
+
+    # Readiness probe
+    health_ping_timeout_seconds: float = 2.0
+
+    # Product cache (set max size to 0 to disable)
+    product_cache_max_size: int = 10000
+    product_cache_ttl_seconds: float = 60.0
+    # How long IDs without a product (deleted or never created) are remembered as such (0 disables)
+    product_cache_negative_ttl_seconds: float = 600.0
+
+    # Deleting a product removes its lines from every cart. The reconciliation job removes lines
+    # of products that no longer exist, e.g. added while the product was being deleted (0 disables)
+    cart_cascade_product_deletes: bool = True
+    cart_reconcile_interval_seconds: float = 0.0
+    cart_reconcile_batch_size: int = 1000
+
+    # Index management on startup (see app/db/indexes.py)
+    ensure_indexes_on_startup: bool = True
+    index_dry_run: bool = False
+    # Expire carts not updated for this many seconds (0 keeps them forever)
+    cart_ttl_seconds: int = 0
+
+    # Only create carts for users (PUT /api/v1/carts/users/{user_id}); anonymous carts and
+    # adding items to an unknown cart ID, which used to create a new cart, are refused
+    cart_require_user: bool = False
+
+    # Run checkout as a multi-document transaction (requires a replica set)
+    checkout_use_transactions: bool = False
+
+    # List endpoints: page size limits and cursor batch size for streaming
+    list_default_limit: int = 100
+    list_max_limit: int = 1000
+    cursor_batch_size: int = 500
+
+    # Store product name/price snapshots and a running total on carts
+    cart_price_snapshots: bool = False
+    cart_price_staleness_seconds: float = 300.0
+
+    # Return plain dicts from repositories and serialize them with orjson
+    fast_serialization: bool = False
+
+    # Coalesce rapid item quantity updates per cart and write them behind; needs a single worker
+    cart_write_buffer_enabled: bool = False
+    cart_write_buffer_window_ms: int = 250
+    cart_write_buffer_max_carts: int = 10000
+
+    # Serve active carts from Redis ("fakeredis://" for an in-process stand-in) and persist them behind
+    cart_hot_tier_enabled: bool = False
+    redis_url: str = "redis://localhost:6379/0"
+    redis_key_prefix: str = "korzina:"
+    cart_hot_tier_ttl_seconds: int = 1800
+    cart_hot_tier_persist_interval_seconds: float = 1.0
+    # How long a cart being checked out or deleted is kept from loading into Redis again
+    cart_hot_tier_take_hold_seconds: int = 60
+
+    # Cart change events over server-sent events
+    cart_events_queue_size: int = 100
+    cart_events_max_subscribers: int = 10000
+    cart_events_heartbeat_seconds: float = 15.0
+
+    # Bulk product import: rows validated and written per batch, and rejected rows listed in the report
+    product_import_batch_size: int = 1000
+    product_import_max_errors: int = 100
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,39 @@
+# app/core/etag.py
+
+from typing import List, Optional
+
+def etag(version: int) -> str:
+    """Strong entity tag for a document version"""
+    return f'"{version}"'
+
+def parse_etags(header: str, weak: bool = False) -> Optional[List[int]]:
+    """Versions listed in an If-Match or If-None-Match header, or None for "*".
+
+    If-Match uses strong comparison, so weak tags only count when weak is
+    set (If-None-Match). Tags this API never issues are skipped, so they
+    match no version.
+    """
+    if header.strip() == "*":
+        return None
+    versions = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        tag = tag.strip('"')
+        if tag.isdigit():
+            versions.append(int(tag))
+    return versions
+
+def expected_versions(if_match: Optional[str]) -> Optional[List[int]]:
+    """Versions a conditional write may apply to, or None when it is unconditional"""
+    if not if_match:
+        return None
+    return parse_etags(if_match)
+
+def etag_matches(header: str, version: int) -> bool:
+    """Check an If-None-Match header against the current version"""
+    versions = parse_etags(header, weak=True)
+    return versions is None or version in versions
@@ -0,0 +1,175 @@
+# app/core/events.py
+
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Sent to a subscriber whose buffer overflowed, right before its stream ends
+OVERFLOW_EVENT = {"operation": "overflow"}
+
+class TooManySubscribersError(Exception):
+    """The hub already serves its maximum number of subscribers"""
+
+class Subscription:
+    """Buffered events for one subscriber, either to one cart or (cart_id None) to all carts"""
+    __slots__ = ("cart_id", "queue", "closed")
+
+    def __init__(self, cart_id: Optional[str], queue_size: int):
+        self.cart_id = cart_id
+        # Room for a final event and the end marker
+        self.queue: "asyncio.Queue[Optional[dict]]" = asyncio.Queue(max(queue_size, 2))
+        self.closed = False
+
+    async def get(self) -> Optional[dict]:
+        """The next event, or None once the subscription has ended"""
+        if self.closed and self.queue.empty():
+            return None
+        return await self.queue.get()
+
+    def _end(self, last_event: Optional[dict] = None) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if last_event is not None:
+            # Make room: a subscriber that fell behind must refetch anyway
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(last_event)
+        elif self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+class CartEventHub:
+    """Fans cart change events from one shared source out to many subscribers.
+
+    The source is consumed by a single task, started with the first
+    subscription, stopped when the last one ends and restarted with backoff
+    if it fails. Publishing never waits: every subscriber has a queue of
+    queue_size events, and one that falls behind receives OVERFLOW_EVENT and
+    is dropped, so a slow client cannot hold up the others.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], AsyncIterator[dict]],
+        queue_size: int,
+        max_subscribers: int,
+        retry_seconds: float = 1.0
+    ):
+        self._source = source
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.retry_seconds = retry_seconds
+        self._by_cart: Dict[str, Set[Subscription]] = {}
+        self._firehose: Set[Subscription] = set()
+        self._count = 0
+        self._watcher: Optional[asyncio.Task] = None
+        self.published = 0
+        self.overflows = 0
+
+    def subscribe(self, cart_id: Optional[str] = None) -> Subscription:
+        """Start receiving events of one cart, or of all carts when cart_id is None"""
+        if self._count >= self.max_subscribers:
+            raise TooManySubscribersError(f"At most {self.max_subscribers} event subscribers are allowed")
+        subscription = Subscription(cart_id, self.queue_size)
+        if cart_id is None:
+            self._firehose.add(subscription)
+        else:
+            self._by_cart.setdefault(cart_id, set()).add(subscription)
+        self._count += 1
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.ensure_future(self._watch())
+        return subscription
+
+    def _remove(self, subscription: Subscription) -> bool:
+        if subscription.cart_id is None:
+            subscribers = self._firehose
+        else:
+            subscribers = self._by_cart.get(subscription.cart_id, set())
+        if subscription not in subscribers:
+            return False
+        subscribers.discard(subscription)
+        if subscription.cart_id is not None and not subscribers:
+            del self._by_cart[subscription.cart_id]
+        self._count -= 1
+        if not self._count and self._watcher is not None:
+            # Nobody is listening; the next subscription starts a new watcher
+            self._watcher.cancel()
+            self._watcher = None
+        return True
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        if self._remove(subscription):
+            subscription._end()
+
+    def publish(self, event: dict) -> None:
+        """Queue an event for the cart's subscribers and the firehose"""
+        self.published += 1
+        for subscription in (*self._by_cart.get(event["cart_id"], ()), *self._firehose):
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.overflows += 1
+                self._remove(subscription)
+                subscription._end(OVERFLOW_EVENT)
+
+    async def events(
+        self,
+        subscription: Subscription,
+        heartbeat_seconds: float,
+        first: Optional[dict] = None
+    ) -> AsyncIterator[Optional[dict]]:
+        """Yield a subscription's events, and None after heartbeat_seconds without one.
+
+        Ends after the subscription ends, or after the deletion of the
+        subscribed cart; unsubscribes when the consumer stops.
+        """
+        try:
+            if first is not None:
+                yield first
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event is None:
+                    return
+                yield event
+                if subscription.cart_id is not None and event["operation"] == "delete":
+                    return
+        finally:
+            self.unsubscribe(subscription)
+
+    async def _watch(self) -> None:
+        delay = self.retry_seconds
+        while True:
+            try:
+                async for event in self._source():
+                    delay = self.retry_seconds
+                    self.publish(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cart change source failed; retrying in %.1fs", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    async def close(self) -> None:
+        """Stop watching and end every subscription, e.g. on shutdown"""
+        if self._watcher is not None:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        for subscription in [*self._firehose, *(s for subs in self._by_cart.values() for s in subs)]:
+            self.unsubscribe(subscription)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribers": self._count,
+            "carts_watched": len(self._by_cart),
+            "published": self.published,
+            "overflows": self.overflows,
+        }
@@ -0,0 +1,63 @@
+# app/core/readers.py
+
+import csv
+from typing import AsyncIterator, Tuple, Union
+import orjson
+
+# A parsed row, or the reason it could not be parsed, with its 1-based line number
+Row = Tuple[int, Union[dict, str]]
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Split a byte stream into decoded lines as the chunks arrive"""
+    pending = b""
+    number = 0
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            number += 1
+            yield number, line.rstrip(b"\r").decode("utf-8-sig" if number == 1 else "utf-8", errors="replace")
+    if pending:
+        yield number + 1, pending.rstrip(b"\r").decode("utf-8-sig" if number == 0 else "utf-8", errors="replace")
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """Parse newline-delimited JSON objects, skipping blank lines"""
+    async for number, line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            yield number, f"Invalid JSON: {e}"
+            continue
+        if isinstance(row, dict):
+            yield number, row
+        else:
+            yield number, "Expected a JSON object"
+
+async def iter_csv(chunks: AsyncIterator[bytes]) -> AsyncIterator[Row]:
+    """Parse CSV with a header row into dicts; empty cells are left out"""
+    header = None
+    record = ""
+    start = 0
+    async for number, line in iter_lines(chunks):
+        if not record:
+            if not line.strip():
+                continue
+            start = number
+            record = line
+        else:
+            record += "\n" + line
+        # Doubled quotes are escapes, so an odd count means a quoted field continues on the next line
+        if record.count('"') % 2:
+            continue
+        cells = next(csv.reader([record]))
+        record = ""
+        if header is None:
+            header = [name.strip() for name in cells]
+        elif len(cells) != len(header):
+            yield start, f"Expected {len(header)} fields, got {len(cells)}"
+        else:
+            yield start, {name: value for name, value in zip(header, cells) if value != ""}
+    if record:
+        yield start, "Unterminated quoted field"
@@ -0,0 +1,103 @@
+# app/core/responses.py
+
+import csv
+import io
+from typing import Any, AsyncIterator, Optional, Sequence, Union
+import orjson
+from fastapi import Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
+from app.core.config import settings
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+CSV_MEDIA_TYPE = "text/csv"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# OpenAPI description of list endpoints that can also stream NDJSON
+NDJSON_RESPONSES = {200: {"content": {NDJSON_MEDIA_TYPE: {}}}}
+
+# Bytes of CSV collected before they are sent
+_CSV_CHUNK_SIZE = 64 * 1024
+
+# OpenAPI description of server-sent event endpoints
+SSE_RESPONSES = {200: {"content": {SSE_MEDIA_TYPE: {}}, "description": "Server-sent events"}}
+
+def _is_plain(content: Any) -> bool:
+    if isinstance(content, list):
+        return bool(content) and isinstance(content[0], dict)
+    return isinstance(content, dict)
+
+def fast_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> Any:
+    """Serialize plain repository dicts with orjson, bypassing response_model validation.
+
+    Outside fast serialization mode, and for models, the content is returned
+    unchanged for FastAPI to validate and serialize; the route's
+    response_model documents the payload either way. Headers already set on
+    the injected response are carried over.
+    """
+    if not settings.fast_serialization or not _is_plain(content):
+        return content
+    return plain_response(content, response, status_code)
+
+def plain_response(content: Any, response: Optional[Response] = None, status_code: int = 200) -> ORJSONResponse:
+    """Serialize plain dicts with orjson as they are, e.g. partial documents the response_model does not describe"""
+    headers = None
+    if response is not None:
+        headers = {k: v for k, v in response.headers.items() if k != "content-length"}
+    return ORJSONResponse(content, status_code=status_code, headers=headers)
+
+def document_id(document: Union[BaseModel, dict]) -> str:
+    """ID of a model or of its plain-dict form"""
+    if isinstance(document, dict):
+        return document["_id"]
+    return document.id
+
+def document_version(document: Union[BaseModel, dict]) -> int:
+    """Version of a model or of its plain-dict form"""
+    if isinstance(document, dict):
+        return document["version"]
+    return document.version
+
+def ndjson_response(documents: AsyncIterator[Union[BaseModel, dict]]) -> StreamingResponse:
+    """Stream models or plain dicts as newline-delimited JSON as they are produced"""
+    async def lines():
+        async for document in documents:
+            if isinstance(document, dict):
+                yield orjson.dumps(document) + b"\n"
+            else:
+                yield document.model_dump_json(by_alias=True) + "\n"
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
+
+def csv_response(
+    documents: AsyncIterator[Union[BaseModel, dict]],
+    fields: Sequence[str],
+    filename: Optional[str] = None
+) -> StreamingResponse:
+    """Stream models or plain dicts as CSV rows of the given fields, after a header row"""
+    async def chunks():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        async for document in documents:
+            if not isinstance(document, dict):
+                document = document.model_dump(by_alias=True)
+            writer.writerow([document.get(field) for field in fields])
+            if buffer.tell() >= _CSV_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'} if filename else None
+    return StreamingResponse(chunks(), media_type=CSV_MEDIA_TYPE, headers=headers)
+
+def sse_response(events: AsyncIterator[Optional[dict]]) -> StreamingResponse:
+    """Stream events as server-sent events named after their "operation"; None sends a keep-alive comment"""
+    async def messages():
+        async for event in events:
+            if event is None:
+                yield b": keep-alive\n\n"
+            else:
+                yield b"event: " + event["operation"].encode() + b"\ndata: " + orjson.dumps(event) + b"\n\n"
+    # Disable proxy buffering so events are delivered as they happen
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(messages(), media_type=SSE_MEDIA_TYPE, headers=headers)
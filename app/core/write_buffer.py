@@ -0,0 +1,172 @@
+# app/core/write_buffer.py
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class _PendingCart:
+    __slots__ = ("load", "quantities", "changes", "timer")
+
+    def __init__(self, load: "asyncio.Future[Optional[dict]]"):
+        # Resolves to the stored cart document with pending changes applied in place
+        self.load = load
+        self.quantities: Dict[str, int] = {}
+        self.changes = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+def _copy_cart(cart: dict) -> dict:
+    return {**cart, "items": [dict(item) for item in cart.get("items", [])]}
+
+class CartWriteBuffer:
+    """Coalesces item quantity changes per cart and writes them behind in one update.
+
+    The first change to a cart loads its document once; later changes within
+    the window are applied to that copy, which also answers reads. After
+    window_ms the net quantities are written with a single call to write().
+    At most max_carts carts are buffered; the oldest is flushed to make room.
+    """
+
+    def __init__(
+        self,
+        window_ms: int,
+        max_carts: int,
+        load: Callable[[str], Awaitable[Optional[dict]]],
+        write: Callable[[str, Dict[str, int], int], Awaitable[None]],
+        recompute: Optional[Callable[[dict], None]] = None
+    ):
+        self.window_ms = window_ms
+        self.max_carts = max_carts
+        self._load = load
+        self._write = write
+        self._recompute = recompute
+        self._pending: "OrderedDict[str, _PendingCart]" = OrderedDict()
+        self._flushing: Dict[str, asyncio.Future] = {}
+        self._timers: Set[asyncio.Future] = set()
+        self.coalesced = 0
+        self.flushes = 0
+        self.failures = 0
+
+    async def _settled(self, cart_id: str) -> None:
+        """Wait for an in-flight flush of the cart, so reads and loads see its result"""
+        flushing = self._flushing.get(cart_id)
+        if flushing is not None:
+            await asyncio.shield(flushing)
+
+    async def _entry(self, cart_id: str) -> _PendingCart:
+        entry = self._pending.get(cart_id)
+        while entry is None:
+            await self._settled(cart_id)
+            if len(self._pending) >= self.max_carts:
+                # Entries still loading are skipped, so concurrent loads can briefly exceed the bound
+                oldest = next((key for key, pending in self._pending.items() if pending.changes), None)
+                if oldest is not None:
+                    await self.flush(oldest)
+            entry = self._pending.get(cart_id)
+            if entry is None and cart_id not in self._flushing:
+                entry = _PendingCart(asyncio.ensure_future(self._load(cart_id)))
+                self._pending[cart_id] = entry
+        return entry
+
+    async def _loaded(self, cart_id: str, entry: _PendingCart) -> Optional[dict]:
+        try:
+            return await entry.load
+        except Exception:
+            # Let the next call retry the load
+            if self._pending.get(cart_id) is entry:
+                del self._pending[cart_id]
+            raise
+
+    async def set_quantity(self, cart_id: str, product_id: str, quantity: int) -> Optional[dict]:
+        """Buffer a quantity change; returns the merged cart, or None if it or the line does not exist"""
+        while True:
+            entry = await self._entry(cart_id)
+            cart = await self._loaded(cart_id, entry)
+            if self._pending.get(cart_id) is entry:
+                break
+            # Flushed while loading; start over from the written state
+        if cart is None:
+            del self._pending[cart_id]
+            return None
+
+        item = next((item for item in cart.get("items", []) if item["product_id"] == product_id), None)
+        if item is None or item["quantity"] == quantity:
+            # Like an unbuffered update, a missing line is left alone and an unchanged one keeps the version
+            if not entry.changes:
+                del self._pending[cart_id]
+            return _copy_cart(cart) if item is not None else None
+
+        item["quantity"] = quantity
+        if self._recompute:
+            self._recompute(cart)
+        cart["version"] = cart.get("version", 0) + 1
+        entry.quantities[product_id] = quantity
+        entry.changes += 1
+        if entry.changes == 1:
+            entry.timer = asyncio.get_running_loop().call_later(
+                self.window_ms / 1000, self._flush_later, cart_id, entry
+            )
+        else:
+            self.coalesced += 1
+        return _copy_cart(cart)
+
+    async def get(self, cart_id: str) -> Optional[dict]:
+        """Return the merged cart if it has buffered changes"""
+        entry = self._pending.get(cart_id)
+        if entry is None:
+            await self._settled(cart_id)
+            return None
+        cart = await self._loaded(cart_id, entry)
+        if cart is None or not entry.changes:
+            return None
+        return _copy_cart(cart)
+
+    def _flush_later(self, cart_id: str, entry: _PendingCart) -> None:
+        if self._pending.get(cart_id) is not entry:
+            return
+        task = asyncio.ensure_future(self.flush(cart_id))
+        self._timers.add(task)
+        task.add_done_callback(self._timers.discard)
+
+    async def flush(self, cart_id: str) -> None:
+        """Write a cart's buffered changes now; waits for a flush already in flight"""
+        entry = self._pending.pop(cart_id, None)
+        if entry is None:
+            await self._settled(cart_id)
+            return
+        if entry.timer is not None:
+            entry.timer.cancel()
+        if not entry.changes:
+            return
+        flushing = asyncio.ensure_future(self._write_entry(cart_id, entry))
+        self._flushing[cart_id] = flushing
+        await asyncio.shield(flushing)
+
+    async def _write_entry(self, cart_id: str, entry: _PendingCart) -> None:
+        try:
+            await self._write(cart_id, entry.quantities, entry.changes)
+            self.flushes += 1
+        except Exception:
+            self.failures += 1
+            logger.exception("Failed to write buffered quantities of cart %s", cart_id)
+        finally:
+            del self._flushing[cart_id]
+
+    async def close(self) -> None:
+        """Flush every buffered cart, e.g. on shutdown"""
+        while self._pending:
+            await self.flush(next(iter(self._pending)))
+        if self._timers:
+            await asyncio.gather(*self._timers, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending_carts": len(self._pending),
+            "max_carts": self.max_carts,
+            "window_ms": self.window_ms,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "failures": self.failures,
+        }
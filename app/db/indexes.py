@@ -0,0 +1,162 @@
+# app/db/indexes.py
+
+import argparse
+import asyncio
+import json
+import logging
+from typing import Dict, List
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from app.core.config import settings
+from app.db.mongo import close_mongo_connection, connect_to_mongo, get_db
+
+CART_COLLECTION = "carts"
+PRODUCT_COLLECTION = "products"
+ORDER_COLLECTION = "orders"
+# Materialized cart analytics (see AnalyticsStore)
+CART_PRODUCT_STATS_COLLECTION = "cart_product_stats"
+CART_AGE_STATS_COLLECTION = "cart_age_stats"
+ANALYTICS_RUNS_COLLECTION = "analytics_runs"
+
+# Index options compared against the live index to detect changes
+_COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression", "default_language")
+
+# Case-insensitive order of product names; queries must pass it to use the name index
+NAME_COLLATION = {"locale": "en", "strength": 2}
+
+def index_registry() -> Dict[str, List[IndexModel]]:
+    """Indexes every collection is expected to have, keyed by collection name"""
+    updated_at_options = {}
+    if settings.cart_ttl_seconds > 0:
+        # Abandoned carts are removed by MongoDB once updated_at is older than the TTL
+        updated_at_options["expireAfterSeconds"] = settings.cart_ttl_seconds
+    return {
+        CART_COLLECTION: [
+            # Multikey index behind the {"_id", "items.product_id"} cart filters
+            IndexModel([("items.product_id", ASCENDING)], name="items_product_id"),
+            IndexModel([("updated_at", ASCENDING)], name="updated_at", **updated_at_options),
+            # One cart per user, found without knowing its ID; anonymous carts are left out
+            IndexModel(
+                [("user_id", ASCENDING)],
+                name="user_id",
+                unique=True,
+                partialFilterExpression={"user_id": {"$type": "string"}}
+            ),
+        ],
+        PRODUCT_COLLECTION: [
+            # Imports match products on their SKU; products without one are left out
+            IndexModel(
+                [("sku", ASCENDING)],
+                name="sku",
+                unique=True,
+                partialFilterExpression={"sku": {"$type": "string"}}
+            ),
+            # Name prefix search and name/price order, with _id breaking ties for keyset pagination
+            IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name", collation=NAME_COLLATION),
+            IndexModel([("price", ASCENDING), ("_id", ASCENDING)], name="price"),
+            # Word search without language-specific stemming or stop words
+            IndexModel(
+                [("name", TEXT), ("description", TEXT)],
+                name="name_description_text",
+                weights={"name": 10, "description": 1},
+                default_language="none"
+            ),
+        ],
+        ORDER_COLLECTION: [
+            # Checkout retries with the same key must find the original order
+            IndexModel(
+                [("idempotency_key", ASCENDING)],
+                name="idempotency_key",
+                unique=True,
+                partialFilterExpression={"idempotency_key": {"$type": "string"}}
+            ),
+        ],
+        # Top products of the current run by each report sort, read back from the materialized report
+        CART_PRODUCT_STATS_COLLECTION: [
+            IndexModel([("run", ASCENDING), (field, DESCENDING), ("_id.key", ASCENDING)], name=field)
+            for field in ("units", "carts", "value")
+        ],
+        CART_AGE_STATS_COLLECTION: [
+            IndexModel([("run", ASCENDING)], name="run"),
+        ],
+    }
+
+def _index_key(index: dict) -> list:
+    """Index key as declared; live text indexes report their fields as weights"""
+    key = list(index["key"].items()) if isinstance(index["key"], dict) else list(index["key"])
+    if ("_fts", TEXT) in key or any(kind == TEXT for _, kind in key):
+        weights = {field: 1 for field, kind in key if kind == TEXT and field != "_fts"}
+        weights.update(index.get("weights", {}))
+        return [(TEXT, sorted(weights.items()))]
+    return key
+
+def _collation_differs(current: dict, wanted: dict) -> bool:
+    # The server fills in every collation option it was not given
+    current_collation = current.get("collation", {})
+    wanted_collation = wanted.get("collation", {})
+    return any(current_collation.get(option) != value for option, value in wanted_collation.items()) or (
+        bool(current_collation) != bool(wanted_collation)
+    )
+
+def _index_differs(current: dict, wanted: dict) -> bool:
+    if _index_key(current) != _index_key(wanted):
+        return True
+    if _collation_differs(current, wanted):
+        return True
+    return any(current.get(option) != wanted.get(option) for option in _COMPARED_OPTIONS)
+
+def _only_ttl_differs(current: dict, wanted: dict) -> bool:
+    if "expireAfterSeconds" not in current or "expireAfterSeconds" not in wanted:
+        return False
+    return not _index_differs({**current, "expireAfterSeconds": wanted["expireAfterSeconds"]}, wanted)
+
+async def ensure_indexes(dry_run: bool = False) -> Dict[str, Dict[str, List[str]]]:
+    """Create or update registry indexes and report what was (or would be) done.
+
+    Indexes present in the database but not in the registry are reported
+    as unmanaged and left untouched.
+    """
+    db = get_db()
+    report = {}
+    for collection_name, indexes in index_registry().items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        result = {"created": [], "updated": [], "unchanged": [], "unmanaged": []}
+        for index in indexes:
+            wanted = index.document
+            name = wanted["name"]
+            current = existing.get(name)
+            if current is None:
+                result["created"].append(name)
+                if not dry_run:
+                    await collection.create_indexes([index])
+            elif not _index_differs(current, wanted):
+                result["unchanged"].append(name)
+            else:
+                result["updated"].append(name)
+                if dry_run:
+                    continue
+                if _only_ttl_differs(current, wanted):
+                    await db.command(
+                        "collMod", collection_name,
+                        index={"name": name, "expireAfterSeconds": wanted["expireAfterSeconds"]}
+                    )
+                else:
+                    await collection.drop_index(name)
+                    await collection.create_indexes([index])
+        managed = {index.document["name"] for index in indexes}
+        result["unmanaged"] = [name for name in existing if name != "_id_" and name not in managed]
+        report[collection_name] = result
+    logging.info(f"Index report{' (dry run)' if dry_run else ''}: {report}")
+    return report
+
+async def _main(dry_run: bool) -> None:
+    await connect_to_mongo()
+    try:
+        print(json.dumps(await ensure_indexes(dry_run=dry_run), indent=2))
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the index registry to MongoDB")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would change")
+    asyncio.run(_main(parser.parse_args().dry_run))
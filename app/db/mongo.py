@@ -1,16 +1,40 @@
 # app/db/mongo.py
 
-from motor.motor_asyncio import AsyncIOMotorClient
 from app.core.config import settings
+import asyncio
 import logging
+import time
 
 mongo_client = None
 _db = None  # use underscore to indicate internal
 
+def _client_options() -> dict:
+    """Motor client options built from settings"""
+    from app.db.monitoring import command_metrics, pool_monitor
+    options = {
+        "maxPoolSize": settings.mongo_max_pool_size,
+        "minPoolSize": settings.mongo_min_pool_size,
+        "serverSelectionTimeoutMS": settings.mongo_server_selection_timeout_ms,
+        "readPreference": settings.mongo_read_preference,
+        "event_listeners": [pool_monitor],
+    }
+    if settings.metrics_enabled:
+        options["event_listeners"].append(command_metrics)
+    if settings.mongo_max_idle_time_ms is not None:
+        options["maxIdleTimeMS"] = settings.mongo_max_idle_time_ms
+    if settings.mongo_wait_queue_timeout_ms is not None:
+        options["waitQueueTimeoutMS"] = settings.mongo_wait_queue_timeout_ms
+    if settings.mongo_compressors:
+        # zstd needs the zstandard package and snappy needs python-snappy
+        options["compressors"] = settings.mongo_compressors
+    return options
+
 async def connect_to_mongo():
     global mongo_client, _db
+    # Imported here so processes on another storage engine never load the driver
+    from motor.motor_asyncio import AsyncIOMotorClient
     try:
-        mongo_client = AsyncIOMotorClient(settings.mongo_uri)
+        mongo_client = AsyncIOMotorClient(settings.mongo_uri, **_client_options())
         _db = mongo_client[settings.mongo_db]
         # Test the connection
         await _db.command("ping")
@@ -24,9 +48,41 @@ def get_db():
         raise Exception("Database not connected. Call connect_to_mongo() first.")
     return _db
 
+def get_client():
+    if mongo_client is None:
+        raise Exception("Database not connected. Call connect_to_mongo() first.")
+    return mongo_client
+
+async def ping() -> float:
+    """Ping the database and return the round-trip latency in milliseconds"""
+    started = time.perf_counter()
+    await get_db().command("ping")
+    return (time.perf_counter() - started) * 1000
+
+async def warm_pool(connections: int, timeout_seconds: float) -> int:
+    """Open up to the given number of pooled connections ahead of traffic; returns how many are open"""
+    if connections <= 0:
+        return pool_stats()["open"]
+    deadline = time.monotonic() + timeout_seconds
+    try:
+        # Concurrent commands each check out a connection, so the pool grows to match
+        await asyncio.wait_for(
+            asyncio.gather(*(get_db().command("ping") for _ in range(connections))), timeout_seconds
+        )
+    except asyncio.TimeoutError:
+        pass
+    # The driver also fills the pool up to minPoolSize in the background
+    while pool_stats()["open"] < connections and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return pool_stats()["open"]
+
+def pool_stats() -> dict:
+    from app.db.monitoring import pool_monitor
+    return pool_monitor.stats(settings.mongo_max_pool_size)
+
 async def close_mongo_connection():
     global mongo_client, _db
     if mongo_client:
         mongo_client.close()
         _db = None
-        logging.info("Disconnected from MongoDB")
\ No newline at end of file
+        logging.info("Disconnected from MongoDB")
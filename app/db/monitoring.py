@@ -0,0 +1,116 @@
+# app/db/monitoring.py
+
+import threading
+from collections import defaultdict
+from pymongo import monitoring
+from app.core.metrics import mongo_command_duration_seconds, mongo_commands_total, request_mongo_commands
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Track connection pool usage per server from driver pool events.
+
+    Events are delivered on driver threads, so counters are guarded by a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = defaultdict(int)
+        self._in_use = defaultdict(int)
+        self._waiting = defaultdict(int)
+        self.checkout_failures = 0
+        self.checkout_timeouts = 0
+
+    def _add(self, counter: dict, address, delta: int) -> None:
+        with self._lock:
+            counter[address] += delta
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        with self._lock:
+            for counter in (self._open, self._in_use, self._waiting):
+                counter.pop(event.address, None)
+
+    def connection_created(self, event):
+        self._add(self._open, event.address, 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(self._open, event.address, -1)
+
+    def connection_check_out_started(self, event):
+        self._add(self._waiting, event.address, 1)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self._waiting[event.address] -= 1
+            self.checkout_failures += 1
+            if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+                self.checkout_timeouts += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self._waiting[event.address] -= 1
+            self._in_use[event.address] += 1
+
+    def connection_checked_in(self, event):
+        self._add(self._in_use, event.address, -1)
+
+    def stats(self, max_pool_size: int) -> dict:
+        """Pool usage summed over servers; saturation is the busiest server's in-use share"""
+        with self._lock:
+            in_use = dict(self._in_use)
+            open_connections = sum(self._open.values())
+            waiting = sum(self._waiting.values())
+        busiest = max(in_use.values(), default=0)
+        return {
+            "max_pool_size": max_pool_size,
+            "open": open_connections,
+            "in_use": sum(in_use.values()),
+            "waiting": waiting,
+            "saturation": busiest / max_pool_size if max_pool_size else 0.0,
+            "checkout_failures": self.checkout_failures,
+            "checkout_timeouts": self.checkout_timeouts,
+        }
+
+pool_monitor = PoolMonitor()
+
+class CommandMetrics(monitoring.CommandListener):
+    """Record MongoDB command counts and latencies per collection and command"""
+
+    def __init__(self):
+        # (connection_id, request_id) -> (collection, command) for commands in flight
+        self._started = {}
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        collection = target if isinstance(target, str) else ""
+        self._started[(event.connection_id, event.request_id)] = (collection, event.command_name)
+        commands = request_mongo_commands.get()
+        if commands is not None:
+            commands[0] += 1
+
+    def _finish(self, event, outcome: str):
+        labels = self._started.pop((event.connection_id, event.request_id), None)
+        if labels is None:
+            return
+        mongo_commands_total.inc(*labels, outcome)
+        mongo_command_duration_seconds.observe(event.duration_micros / 1_000_000, *labels)
+
+    def succeeded(self, event):
+        self._finish(event, "success")
+
+    def failed(self, event):
+        self._finish(event, "failure")
+
+command_metrics = CommandMetrics()
@@ -0,0 +1,48 @@
+# app/db/pagination.py
+
+import base64
+from typing import Any, Optional, Tuple
+import orjson
+from bson import ObjectId
+
+def check_cursor(after: Optional[str]) -> None:
+    """Reject a cursor that is not a document ID"""
+    if after is not None and not ObjectId.is_valid(after):
+        raise ValueError(f"Invalid cursor: {after}")
+
+def keyset_filter(after: Optional[str], descending: bool = False) -> dict:
+    """Filter for documents following the given _id in _id order"""
+    check_cursor(after)
+    if after is None:
+        return {}
+    return {"_id": {"$lt" if descending else "$gt": ObjectId(after)}}
+
+def encode_cursor(value: Any, document_id: str) -> str:
+    """Opaque cursor for the position after a document in (value, _id) order"""
+    return base64.urlsafe_b64encode(orjson.dumps([value, document_id])).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    """The sort value and document ID an encode_cursor cursor points after"""
+    try:
+        value, document_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    check_cursor(document_id)
+    return value, document_id
+
+def check_sorted_cursor(field: str, after: Optional[str]) -> None:
+    """Reject a cursor that does not fit (field, _id) order"""
+    if field == "_id":
+        check_cursor(after)
+    elif after is not None:
+        decode_cursor(after)
+
+def sorted_keyset_filter(field: str, after: Optional[str], descending: bool = False) -> dict:
+    """Filter for documents following an encode_cursor cursor in (field, _id) order"""
+    if field == "_id":
+        return keyset_filter(after, descending)
+    if after is None:
+        return {}
+    value, document_id = decode_cursor(after)
+    operator = "$lt" if descending else "$gt"
+    return {"$or": [{field: {operator: value}}, {field: value, "_id": {operator: ObjectId(document_id)}}]}
@@ -0,0 +1,27 @@
+# app/db/versioning.py
+
+from typing import List, Optional
+
+# Every mutation increments "version"; documents written before it existed count as version 0
+VERSION_FIELD = "version"
+
+class PreconditionFailedError(ValueError):
+    """The document exists, but not in the version the client expected"""
+
+def version_filter(versions: Optional[List[int]]) -> dict:
+    """Filter restricting an update to the expected versions (None means any)"""
+    if versions is None:
+        return {}
+    versions = list(versions)
+    if 0 in versions:
+        versions.append(None)
+    return {VERSION_FIELD: {"$in": versions}}
+
+def next_version_expression(increment: int = 1) -> dict:
+    """Aggregation expression for the incremented version in pipeline updates"""
+    return {"$add": [{"$ifNull": [f"${VERSION_FIELD}", 0]}, increment]}
+
+async def raise_if_exists(collection, document_id, session=None) -> None:
+    """Report a failed conditional write as a version mismatch when the document still exists"""
+    if await collection.find_one({"_id": document_id}, {"_id": 1}, session=session):
+        raise PreconditionFailedError("Document was modified; refetch it and retry")
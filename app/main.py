@@ -1,18 +1,41 @@
 # app/main.py
 
-from fastapi import FastAPI
+import asyncio
+import logging
+from fastapi import FastAPI, status
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
+from app.core.admission import AdmissionMiddleware, admission_controller, cart_rate_limiter, client_rate_limiter
 from app.core.config import settings
-from app.db.mongo import connect_to_mongo, close_mongo_connection
-from app.routers import cart, product
+from app.core.metrics import MetricsMiddleware, registry as metrics_registry
+from app.db.mongo import pool_stats
+from app.repositories.analytics import start_analytics_refresh, stop_analytics_refresh
+from app.repositories.cart import cart_events, cart_write_buffer
+from app.repositories.product import (
+    prime_product_cache, product_cache, start_cart_reconciliation, stop_cart_reconciliation
+)
+from app.routers import analytics, cart, product
+from app.storage import get_storage
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    await connect_to_mongo()
+    await get_storage().connect()
+    try:
+        # Every worker has its own cache, so each one primes it before taking traffic
+        primed = await prime_product_cache(settings.warmup_product_cache_size, settings.warmup_recent_orders)
+        logging.info(f"Primed the product cache with {primed} products")
+    except Exception as e:
+        logging.warning(f"Product cache warmup failed: {e}")
+    start_analytics_refresh()
+    start_cart_reconciliation()
     yield
-    # Shutdown
-    await close_mongo_connection()
+    # Shutdown: end event streams and write buffered cart changes before the client goes away
+    await stop_analytics_refresh()
+    await stop_cart_reconciliation()
+    await cart_events.close()
+    await cart_write_buffer.close()
+    await get_storage().close()
 
 app = FastAPI(
     title="Korzina Cart API", 
@@ -20,8 +43,74 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+if settings.admission_control_enabled:
+    app.add_middleware(AdmissionMiddleware)
+
+# Added last so it wraps admission control and counts the requests it turns away
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+def _collect_runtime_metrics():
+    cache = product_cache.stats()
+    yield "product_cache_hits_total", "counter", "Product cache hits", [({}, cache["hits"])]
+    yield "product_cache_misses_total", "counter", "Product cache misses", [({}, cache["misses"])]
+    yield "product_cache_negative_hits_total", "counter", "Lookups answered by a cached missing product", [
+        ({}, cache["negative_hits"])
+    ]
+    yield "product_cache_evictions_total", "counter", "Product cache LRU evictions", [({}, cache["evictions"])]
+    yield "product_cache_size", "gauge", "Products currently cached", [({}, cache["size"])]
+    pool = pool_stats()
+    yield "mongo_pool_connections", "gauge", "MongoDB pool connections by state", [
+        ({"state": "open"}, pool["open"]),
+        ({"state": "in_use"}, pool["in_use"]),
+        ({"state": "waiting"}, pool["waiting"]),
+    ]
+    yield "mongo_pool_saturation", "gauge", "In-use share of the busiest server's pool", [({}, pool["saturation"])]
+    yield "mongo_pool_checkout_failures_total", "counter", "Failed pool checkouts", [({}, pool["checkout_failures"])]
+    buffer = cart_write_buffer.stats()
+    yield "cart_write_buffer_pending_carts", "gauge", "Carts with buffered quantity changes", [
+        ({}, buffer["pending_carts"])
+    ]
+    yield "cart_write_buffer_coalesced_total", "counter", "Quantity changes merged into an already buffered cart", [
+        ({}, buffer["coalesced"])
+    ]
+    yield "cart_write_buffer_flushes_total", "counter", "Buffered carts written to MongoDB", [({}, buffer["flushes"])]
+    yield "cart_write_buffer_failures_total", "counter", "Buffered cart writes that failed", [({}, buffer["failures"])]
+    events = cart_events.stats()
+    yield "cart_event_subscribers", "gauge", "Open cart event streams", [({}, events["subscribers"])]
+    yield "cart_events_published_total", "counter", "Cart change events received from storage", [
+        ({}, events["published"])
+    ]
+    yield "cart_event_overflows_total", "counter", "Event streams dropped because the client fell behind", [
+        ({}, events["overflows"])
+    ]
+    if settings.admission_control_enabled:
+        admission = admission_controller.stats()
+        yield "admission_in_flight", "gauge", "API requests holding an admission slot", [({}, admission["in_flight"])]
+        yield "admission_waiting", "gauge", "API requests queued for an admission slot", [({}, admission["waiting"])]
+        yield "admission_admitted_total", "counter", "API requests admitted, by priority", [
+            ({"priority": priority}, count) for priority, count in admission["admitted"].items()
+        ]
+        yield "admission_rejected_total", "counter", "API requests turned away with 503, by reason", [
+            ({"reason": reason}, count) for reason, count in admission["rejected"].items()
+        ]
+        yield "rate_limited_total", "counter", "Cart changes turned away with 429, by limiter", [
+            ({"limiter": "client"}, client_rate_limiter.rejected),
+            ({"limiter": "cart"}, cart_rate_limiter.rejected),
+        ]
+    if settings.cart_hot_tier_enabled:
+        hot = get_storage().carts.stats()
+        yield "cart_hot_tier_loads_total", "counter", "Carts loaded into Redis from MongoDB", [({}, hot["loads"])]
+        yield "cart_hot_tier_persisted_total", "counter", "Hot carts written back to MongoDB", [({}, hot["persisted"])]
+        yield "cart_hot_tier_persist_failures_total", "counter", "Failed rounds of writing hot carts back", [
+            ({}, hot["persist_failures"])
+        ]
+
+metrics_registry.register_collector(_collect_runtime_metrics)
+
 app.include_router(cart.router, prefix="/api/v1/carts", tags=["Cart"])
 app.include_router(product.router, prefix="/api/v1/products", tags=["Products"])
+app.include_router(analytics.router, prefix="/api/v1/admin/analytics", tags=["Analytics"])
 
 @app.get("/")
 async def root():
@@ -29,4 +118,33 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+@app.get("/health/live")
+async def liveness_check():
+    """Process is up; does not touch the database"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Storage is reachable; reports ping latency and connection pool usage"""
+    try:
+        ping_ms = await asyncio.wait_for(get_storage().ping(), timeout=settings.health_ping_timeout_seconds)
+    except Exception as e:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "unavailable", "error": str(e) or type(e).__name__, "pool": pool_stats()}
+        )
+    return {"status": "ready", "ping_ms": round(ping_ms, 3), "pool": pool_stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus text exposition of request, MongoDB, cache and pool metrics"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    stats = {"products": product_cache.stats(), "cart_write_buffer": cart_write_buffer.stats()}
+    if settings.cart_hot_tier_enabled:
+        stats["cart_hot_tier"] = get_storage().carts.stats()
+    return stats
\ No newline at end of file
@@ -1,14 +1,35 @@
 # app/models/cart.py
 
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional, TypedDict, Union
 from app.schemas.cart import CartItemWithDetails
 
 class CartModel(BaseModel):
     id: str = Field(..., alias="_id", description="Cart ID as string")
+    user_id: Optional[str] = Field(None, description="Owning user, for carts kept per user")
     items: List[CartItemWithDetails] = []
     total_amount: float = Field(..., description="Total cart value")
+    version: int = Field(0, description="Incremented on every change; sent as the ETag")
 
     class Config:
         populate_by_name = True
-        allow_population_by_field_name = True
\ No newline at end of file
+        allow_population_by_field_name = True
+
+class CartItemDict(TypedDict):
+    """Plain-dict form of CartItemWithDetails used by fast serialization"""
+    product_id: str
+    product_name: str
+    quantity: int
+    price: float
+    total_price: float
+
+class CartDict(TypedDict):
+    """Plain-dict form of CartModel, already shaped like CartResponse"""
+    _id: str
+    user_id: Optional[str]
+    items: List[CartItemDict]
+    total_amount: float
+    version: int
+
+# What cart repositories return, depending on settings.fast_serialization
+Cart = Union[CartModel, CartDict]
@@ -1,15 +1,30 @@
 # app/models/product.py
 
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, TypedDict, Union
 
 class ProductModel(BaseModel):
     id: str = Field(..., alias="_id", description="Product ID as string")
+    sku: Optional[str] = None
     name: str
     description: Optional[str] = None
     price: float
     in_stock: int
+    version: int = Field(0, description="Incremented on every change; sent as the ETag")
 
     class Config:
         populate_by_name = True
-        allow_population_by_field_name = True
\ No newline at end of file
+        allow_population_by_field_name = True
+
+class ProductDict(TypedDict):
+    """Plain-dict form of ProductModel, already shaped like ProductResponse"""
+    _id: str
+    sku: Optional[str]
+    name: str
+    description: Optional[str]
+    price: float
+    in_stock: int
+    version: int
+
+# What product repositories return, depending on settings.fast_serialization
+Product = Union[ProductModel, ProductDict]
@@ -0,0 +1,110 @@
+# app/repositories/analytics.py
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from app.core.config import settings
+from app.storage import get_storage
+from app.storage.base import UNKNOWN_AGE, AgeBuckets, RefreshInProgressError, age_buckets
+
+logger = logging.getLogger(__name__)
+
+# Fields the per-product cart report can be sorted by, descending
+CART_PRODUCT_SORTS = ("units", "carts", "value")
+
+_refresher: Optional[asyncio.Task] = None
+
+def configured_age_buckets() -> AgeBuckets:
+    """Cart age buckets from the comma-separated bounds in settings"""
+    bounds = sorted({float(hours) for hours in settings.analytics_cart_age_hours.split(",") if hours.strip()})
+    return age_buckets(bounds)
+
+async def _source(live: bool) -> Tuple[bool, datetime]:
+    """Whether to read the materialized reports, and when the figures are from"""
+    if not live and settings.analytics_refresh_interval_seconds > 0:
+        computed_at = await get_storage().analytics.materialized_at()
+        if computed_at is not None:
+            return True, computed_at
+    return False, datetime.now(timezone.utc)
+
+async def get_cart_ages(live: bool = False) -> dict:
+    """Carts, units and value per age bucket, oldest last"""
+    materialized, computed_at = await _source(live)
+    buckets = configured_age_buckets()
+    stats = {bucket["_id"]: bucket for bucket in await get_storage().analytics.cart_ages(buckets, materialized)}
+    rows = []
+    for label, lower, upper in [*buckets, (UNKNOWN_AGE, None, None)]:
+        bucket = stats.get(label)
+        if bucket is None and label == UNKNOWN_AGE:
+            continue
+        bucket = bucket or {}
+        rows.append({
+            "bucket": label,
+            "min_hours": lower,
+            "max_hours": upper,
+            "carts": bucket.get("carts", 0),
+            "empty_carts": bucket.get("empty_carts", 0),
+            "units": bucket.get("units", 0),
+            "value": bucket.get("value", 0.0)
+        })
+    return {"buckets": rows, "computed_at": computed_at}
+
+async def get_cart_overview(live: bool = False) -> dict:
+    """Cart count and total units and value of all carts"""
+    ages = await get_cart_ages(live)
+    totals = {
+        field: sum(bucket[field] for bucket in ages["buckets"]) for field in ("carts", "empty_carts", "units", "value")
+    }
+    filled = totals["carts"] - totals["empty_carts"]
+    totals["average_value"] = totals["value"] / filled if filled else 0.0
+    totals["computed_at"] = ages["computed_at"]
+    return totals
+
+async def get_cart_products(limit: int, sort: str = "units", live: bool = False) -> dict:
+    """The products in carts with the highest units, carts or value"""
+    if sort not in CART_PRODUCT_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(CART_PRODUCT_SORTS)}")
+    materialized, computed_at = await _source(live)
+    products = await get_storage().analytics.cart_products(limit, sort, materialized)
+    return {"products": products, "computed_at": computed_at}
+
+async def refresh_cart_analytics() -> dict:
+    """Materialize the cart reports now; raises RefreshInProgressError if another worker is at it"""
+    started = time.perf_counter()
+    computed_at = await get_storage().analytics.materialize(configured_age_buckets())
+    seconds = round(time.perf_counter() - started, 3)
+    logger.info("Materialized cart analytics in %.3f s", seconds)
+    return {"computed_at": computed_at, "seconds": seconds}
+
+async def _refresh_forever(interval: float) -> None:
+    while True:
+        wait = interval
+        try:
+            latest = await get_storage().analytics.materialized_at()
+            age = (datetime.now(timezone.utc) - latest).total_seconds() if latest is not None else None
+            # Workers share MongoDB's summary collections, so one that refreshed recently covers the others
+            if age is None or age >= interval:
+                await refresh_cart_analytics()
+            else:
+                wait = interval - age
+        except RefreshInProgressError:
+            # Another worker holds the lease; its run covers this one
+            pass
+        except Exception:
+            logger.exception("Failed to materialize cart analytics")
+        await asyncio.sleep(wait)
+
+def start_analytics_refresh() -> None:
+    """Materialize the cart reports every configured interval in the background"""
+    global _refresher
+    if settings.analytics_refresh_interval_seconds > 0 and _refresher is None:
+        _refresher = asyncio.create_task(_refresh_forever(settings.analytics_refresh_interval_seconds))
+
+async def stop_analytics_refresh() -> None:
+    global _refresher
+    if _refresher is not None:
+        _refresher.cancel()
+        await asyncio.gather(_refresher, return_exceptions=True)
+        _refresher = None
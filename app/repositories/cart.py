@@ -1,273 +1,538 @@
 # app/repositories/cart.py
 
-from typing import List, Optional
-from app.db.mongo import get_db
-from app.models.cart import CartModel
-from app.schemas.cart import CartCreate, CartItem, CartItemWithDetails
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.core.events import CartEventHub, Subscription
+from app.core.write_buffer import CartWriteBuffer
+from app.db.pagination import check_cursor
+from app.db.versioning import VERSION_FIELD, PreconditionFailedError
+from app.models.cart import Cart, CartDict, CartItemDict, CartModel
+from app.repositories.product import get_cached_products, load_products, product_cache
+from app.schemas.cart import CartCreate, CartItem, CartItemOperation, CartItemWithDetails
+from app.storage import get_storage
+from app.storage.base import ORDER_PENDING, ORDER_PROCESSED, CheckoutConflictError, InsufficientStockError
 from bson import ObjectId
 
-CART_COLLECTION = "carts"
-PRODUCT_COLLECTION = "products"
+PRODUCT_NOT_FOUND = "Product Not Found"
 
 async def get_product_details(product_id: str) -> Optional[dict]:
     """Get product details by ID"""
-    if not ObjectId.is_valid(product_id):
-        return None
-    db = get_db()
-    product = await db[PRODUCT_COLLECTION].find_one({"_id": ObjectId(product_id)})
-    if product:
-        product["_id"] = str(product["_id"])
-    return product
+    products = await get_cached_products([product_id])
+    return products.get(product_id)
 
-async def enrich_cart_items(items: List[dict]) -> tuple[List[CartItemWithDetails], float]:
-    """Enrich cart items with product details and calculate total"""
+async def get_products_details(product_ids: Iterable[str]) -> Dict[str, dict]:
+    """Get details for many products at once, keyed by product ID"""
+    return await get_cached_products(product_ids)
+
+def _item_details(product_id: str, product_name: str, quantity: int, price: float) -> CartItemDict:
+    return {
+        "product_id": product_id,
+        "product_name": product_name,
+        "quantity": quantity,
+        "price": price,
+        "total_price": price * quantity
+    }
+
+async def _enrich_items(
+    items: List[dict],
+    products: Optional[Dict[str, dict]] = None
+) -> tuple[List[CartItemDict], float]:
+    """Build plain item details from current product data and calculate total"""
+    if products is None:
+        products = await get_products_details(item["product_id"] for item in items)
     enriched_items = []
     total_amount = 0.0
-    
+
     for item in items:
-        product = await get_product_details(item["product_id"])
+        product = products.get(item["product_id"])
         if product:
-            item_total = product["price"] * item["quantity"]
-            enriched_item = CartItemWithDetails(
-                product_id=item["product_id"],
-                product_name=product["name"],
-                quantity=item["quantity"],
-                price=product["price"],
-                total_price=item_total
-            )
-            enriched_items.append(enriched_item)
-            total_amount += item_total
+            enriched_item = _item_details(item["product_id"], product["name"], item["quantity"], product["price"])
+            total_amount += enriched_item["total_price"]
         else:
             # Product not found, include item with minimal info
-            enriched_item = CartItemWithDetails(
-                product_id=item["product_id"],
-                product_name="Product Not Found",
-                quantity=item["quantity"],
-                price=0.0,
-                total_price=0.0
-            )
-            enriched_items.append(enriched_item)
-    
+            enriched_item = _item_details(item["product_id"], PRODUCT_NOT_FOUND, item["quantity"], 0.0)
+        enriched_items.append(enriched_item)
+
     return enriched_items, total_amount
 
-async def create_cart(cart_data: CartCreate) -> CartModel:
-    db = get_db()
-    cart_dict = cart_data.model_dump()
-    result = await db[CART_COLLECTION].insert_one(cart_dict)
-    cart = await db[CART_COLLECTION].find_one({"_id": result.inserted_id})
-    
-    # Convert ObjectId to string for Pydantic model
-    cart["_id"] = str(cart["_id"])
-    
-    # Enrich items with product details and calculate total
-    enriched_items, total_amount = await enrich_cart_items(cart.get("items", []))
-    
-    return CartModel(
-        id=cart["_id"],
-        items=enriched_items,
-        total_amount=total_amount
+async def enrich_cart_items(
+    items: List[dict],
+    products: Optional[Dict[str, dict]] = None
+) -> tuple[List[CartItemWithDetails], float]:
+    """Enrich cart items with product details and calculate total"""
+    enriched_items, total_amount = await _enrich_items(items, products)
+    return [CartItemWithDetails(**item) for item in enriched_items], total_amount
+
+def _snapshot_item(product_id: str, quantity: int, product: Optional[dict], priced_at: float) -> dict:
+    """Build a stored cart line carrying the product name and unit price"""
+    return {
+        "product_id": product_id,
+        "quantity": quantity,
+        "product_name": product["name"] if product else PRODUCT_NOT_FOUND,
+        "price": product["price"] if product else 0.0,
+        "priced_at": priced_at
+    }
+
+def _needs_repricing(cart: dict) -> bool:
+    """Check whether the price snapshots stored on a cart are missing or stale"""
+    priced_at = cart.get("priced_at")
+    if priced_at is None or any("price" not in item for item in cart.get("items", [])):
+        return True
+    return time.time() - priced_at > settings.cart_price_staleness_seconds
+
+async def _reprice_cart(cart: dict) -> dict:
+    """Refresh the price snapshots and stored total of a cart"""
+    items = cart.get("items", [])
+    products = await get_products_details(item["product_id"] for item in items)
+    now = time.time()
+    repriced_items = [
+        _snapshot_item(item["product_id"], item["quantity"], products.get(item["product_id"]), now)
+        for item in items
+    ]
+    total_amount = sum(item["price"] * item["quantity"] for item in repriced_items)
+    # Refreshing unchanged prices only moves priced_at and keeps the ETag
+    changed = [(i["product_name"], i["price"]) for i in repriced_items] != [
+        (i.get("product_name"), i.get("price")) for i in items
+    ]
+
+    written = await get_storage().carts.update_price_snapshots(
+        str(cart["_id"]), items, repriced_items, total_amount, now, changed
+    )
+    version = cart.get(VERSION_FIELD, 0) + (1 if changed and written else 0)
+    return {
+        **cart, "items": repriced_items, "total_amount": total_amount, "priced_at": now, VERSION_FIELD: version
+    }
+
+def _snapshot_cart_items(cart: dict) -> tuple[List[CartItemDict], float]:
+    """Build cart items from stored price snapshots without touching products"""
+    enriched_items = [
+        _item_details(item["product_id"], item["product_name"], item["quantity"], item["price"])
+        for item in cart.get("items", [])
+    ]
+    return enriched_items, cart.get("total_amount", 0.0)
+
+def _to_cart(cart_dict: CartDict) -> Cart:
+    """Return the cart as is in fast serialization mode, otherwise as a validated CartModel"""
+    if settings.fast_serialization:
+        return cart_dict
+    return CartModel(**cart_dict)
+
+async def _to_cart_model(cart: dict, products: Optional[Dict[str, dict]] = None) -> Cart:
+    """Convert a stored cart document to a cart with item details and total"""
+    cart_id = str(cart["_id"])
+
+    if settings.cart_price_snapshots:
+        if _needs_repricing(cart):
+            cart = await _reprice_cart(cart)
+        enriched_items, total_amount = _snapshot_cart_items(cart)
+    else:
+        # Enrich items with product details and calculate total
+        enriched_items, total_amount = await _enrich_items(cart.get("items", []), products)
+
+    return _to_cart({
+        "_id": cart_id,
+        "user_id": cart.get("user_id"),
+        "items": enriched_items,
+        "total_amount": total_amount,
+        "version": cart.get(VERSION_FIELD, 0)
+    })
+
+def _cart_line(product_id: str, quantity: int, product: Optional[dict]) -> dict:
+    """Build the stored cart line for a product in the current storage mode"""
+    if settings.cart_price_snapshots:
+        return _snapshot_item(product_id, quantity, product, time.time())
+    return {"product_id": product_id, "quantity": quantity}
+
+async def _apply_item_ops(
+    cart_id: str,
+    ops: List[dict],
+    versions: Optional[List[int]] = None,
+    require_lines: bool = False
+) -> Optional[Cart]:
+    """Apply item operations and read back the cart in a single round trip"""
+    await cart_write_buffer.flush(cart_id)
+    updated_cart = await get_storage().carts.apply_item_ops(cart_id, ops, versions, require_lines=require_lines)
+    if updated_cart:
+        return await _to_cart_model(updated_cart)
+    return None
+
+async def _load_cart_document(cart_id: str) -> Optional[dict]:
+    return await get_storage().carts.get(cart_id)
+
+async def _write_item_quantities(cart_id: str, quantities: Dict[str, int], changes: int) -> None:
+    """Persist coalesced quantity changes, counting each one towards the version.
+
+    Changes that cancel out still move the version past the ones the buffer
+    reported, so none of those ETags is reused for other items.
+    """
+    ops = [{"product_id": pid, "op": "set", "quantity": quantity} for pid, quantity in quantities.items()]
+    await get_storage().carts.apply_item_ops(
+        cart_id, ops, version_increment=changes, return_document=False, bump_unchanged=True
     )
 
-async def get_cart(cart_id: str) -> Optional[CartModel]:
+def _recompute_total(cart: dict) -> None:
+    if settings.cart_price_snapshots:
+        cart["total_amount"] = sum(item.get("price", 0.0) * item["quantity"] for item in cart.get("items", []))
+
+# Write-behind buffer for quantity updates, used when cart_write_buffer_enabled is set
+cart_write_buffer = CartWriteBuffer(
+    window_ms=settings.cart_write_buffer_window_ms,
+    max_carts=settings.cart_write_buffer_max_carts,
+    load=_load_cart_document,
+    write=_write_item_quantities,
+    recompute=_recompute_total
+)
+
+# One shared watcher on cart changes, fanned out to event stream subscribers
+cart_events = CartEventHub(
+    source=lambda: get_storage().carts.watch(),
+    queue_size=settings.cart_events_queue_size,
+    max_subscribers=settings.cart_events_max_subscribers
+)
+
+async def create_cart(cart_data: CartCreate) -> Cart:
+    if settings.cart_require_user:
+        raise ValueError("Carts belong to users; use PUT /api/v1/carts/users/{user_id}")
+    cart_dict = cart_data.model_dump()
+    if settings.cart_price_snapshots:
+        items = cart_dict["items"]
+        products = await get_products_details(item["product_id"] for item in items)
+        now = time.time()
+        cart_dict["items"] = [
+            _snapshot_item(item["product_id"], item["quantity"], products.get(item["product_id"]), now)
+            for item in items
+        ]
+        cart_dict["total_amount"] = sum(item["price"] * item["quantity"] for item in cart_dict["items"])
+        cart_dict["priced_at"] = now
+    cart_dict["updated_at"] = datetime.now(timezone.utc)
+    cart_dict[VERSION_FIELD] = 1
+    cart_dict = await get_storage().carts.insert(cart_dict)
+    return await _to_cart_model(cart_dict)
+
+async def get_cart(cart_id: str) -> Optional[Cart]:
     if not ObjectId.is_valid(cart_id):
         return None
-    db = get_db()
-    cart = await db[CART_COLLECTION].find_one({"_id": ObjectId(cart_id)})
+    # Buffered quantity changes are not written yet, so answer from the merged state
+    cart = await cart_write_buffer.get(cart_id)
     if cart:
-        # Convert ObjectId to string for Pydantic model
-        cart["_id"] = str(cart["_id"])
-        
-        # Enrich items with product details and calculate total
-        enriched_items, total_amount = await enrich_cart_items(cart.get("items", []))
-        
-        return CartModel(
-            id=cart["_id"],
-            items=enriched_items,
-            total_amount=total_amount
-        )
+        return await _to_cart_model(cart)
+    cart = await get_storage().carts.get(cart_id)
+    if cart:
+        return await _to_cart_model(cart)
     return None
 
-async def get_all_carts() -> List[CartModel]:
-    db = get_db()
-    carts_cursor = db[CART_COLLECTION].find()
-    carts = []
-    async for cart in carts_cursor:
-        # Convert ObjectId to string for Pydantic model
-        cart["_id"] = str(cart["_id"])
-        
-        # Enrich items with product details and calculate total
-        enriched_items, total_amount = await enrich_cart_items(cart.get("items", []))
-        
-        cart_model = CartModel(
-            id=cart["_id"],
-            items=enriched_items,
-            total_amount=total_amount
+async def get_cart_version(cart_id: str) -> Optional[int]:
+    """Get the current version of a cart without loading or enriching its items"""
+    if not ObjectId.is_valid(cart_id):
+        return None
+    buffered = await cart_write_buffer.get(cart_id)
+    if buffered:
+        return buffered[VERSION_FIELD]
+    return await get_storage().carts.get_version(cart_id)
+
+async def subscribe_to_cart(cart_id: str) -> Optional[tuple[Subscription, dict]]:
+    """Subscribe to a cart's changes; returns the subscription and an event with the current version"""
+    if not ObjectId.is_valid(cart_id):
+        return None
+    # Subscribe before reading the version so no change in between is missed
+    subscription = cart_events.subscribe(cart_id)
+    version = await get_cart_version(cart_id)
+    if version is None:
+        cart_events.unsubscribe(subscription)
+        return None
+    return subscription, {"cart_id": cart_id, "operation": "current", "version": version}
+
+async def _to_cart_models(carts: List[dict]) -> List[Cart]:
+    """Convert a batch of cart documents, resolving all their products in one lookup"""
+    products = None
+    if not settings.cart_price_snapshots:
+        products = await get_products_details(
+            item["product_id"] for cart in carts for item in cart.get("items", [])
         )
-        carts.append(cart_model)
-    return carts
+    return [await _to_cart_model(cart, products) for cart in carts]
 
-async def add_item_to_cart(cart_id: str, item: CartItem) -> Optional[CartModel]:
+async def get_all_carts(limit: int, after: Optional[str] = None) -> List[Cart]:
+    """Get a page of carts ordered by ID, starting after the given cart ID"""
+    carts = await get_storage().carts.page(limit, after)
+    return await _to_cart_models(carts)
+
+def iter_carts(after: Optional[str] = None, limit: Optional[int] = None) -> AsyncIterator[Cart]:
+    """Stream carts ordered by ID, converting them one cursor batch at a time"""
+    # Validate the cursor before streaming starts
+    check_cursor(after)
+    return _iter_carts(after, limit)
+
+async def _iter_carts(after: Optional[str], limit: Optional[int]) -> AsyncIterator[Cart]:
+    batch_size = settings.cursor_batch_size
+    batch = []
+    async for cart in get_storage().carts.stream(after, limit):
+        batch.append(cart)
+        if len(batch) >= batch_size:
+            for cart_model in await _to_cart_models(batch):
+                yield cart_model
+            batch = []
+    for cart_model in await _to_cart_models(batch):
+        yield cart_model
+
+async def add_item_to_cart(cart_id: str, item: CartItem, versions: Optional[List[int]] = None) -> Optional[Cart]:
     if not ObjectId.is_valid(cart_id):
         return None
-    
+
     # Verify product exists
     product = await get_product_details(item.product_id)
     if not product:
         return None
-        
-    db = get_db()
+
     # Convert product_id to string for comparison
     product_id_str = str(item.product_id)
-    
-    # Upsert item quantity if product_id exists else push new item
-    update_result = await db[CART_COLLECTION].update_one(
-        {"_id": ObjectId(cart_id), "items.product_id": product_id_str},
-        {"$inc": {"items.$.quantity": item.quantity}}
-    )
-    if update_result.modified_count == 0:
-        # item not found, add new
-        item_dict = item.model_dump()
-        item_dict["product_id"] = product_id_str  # Ensure it's stored as string
-        await db[CART_COLLECTION].update_one(
-            {"_id": ObjectId(cart_id)},
-            {"$push": {"items": item_dict}}
-        )
-    updated_cart = await db[CART_COLLECTION].find_one({"_id": ObjectId(cart_id)})
-    if updated_cart:
-        # Convert ObjectId to string for Pydantic model
-        updated_cart["_id"] = str(updated_cart["_id"])
-        
-        # Enrich items with product details and calculate total
-        enriched_items, total_amount = await enrich_cart_items(updated_cart.get("items", []))
-        
-        return CartModel(
-            id=updated_cart["_id"],
-            items=enriched_items,
-            total_amount=total_amount
-        )
-    return None
 
-async def add_item_to_cart_or_create(cart_id: str, item: CartItem) -> CartModel:
-    """Add item to cart, create cart if it doesn't exist"""
-    db = get_db()
-    
+    # Increment the existing line or append a new one in one atomic update
+    return await _apply_item_ops(cart_id, [{
+        "product_id": product_id_str,
+        "op": "add",
+        "quantity": item.quantity,
+        "line": _cart_line(product_id_str, item.quantity, product)
+    }], versions)
+
+async def add_item_to_cart_or_create(
+    cart_id: str,
+    item: CartItem,
+    versions: Optional[List[int]] = None
+) -> Optional[Cart]:
+    """Add item to cart, create cart if it doesn't exist (unless a version was expected)"""
     # Verify product exists
     product = await get_product_details(item.product_id)
     if not product:
         raise ValueError(f"Product {item.product_id} not found")
-    
+
     if ObjectId.is_valid(cart_id):
         # Try to add to existing cart
-        existing_cart = await add_item_to_cart(cart_id, item)
+        existing_cart = await add_item_to_cart(cart_id, item, versions)
         if existing_cart:
             return existing_cart
-    
+    if versions is not None:
+        raise PreconditionFailedError("Cart does not exist")
+    if settings.cart_require_user:
+        # Creating a cart nobody can find again would leave an orphan
+        return None
+
     # Cart doesn't exist, create new one
     cart_data = CartCreate(items=[item])
     return await create_cart(cart_data)
 
-async def update_item_quantity(cart_id: str, item_id: str, quantity: int) -> Optional[CartModel]:
+async def _upsert_user_cart(user_id: str, ops: List[dict]) -> dict:
+    if ops and settings.cart_write_buffer_enabled:
+        # Buffered quantities must land before the operations, as for carts addressed by ID
+        cart = await get_storage().carts.get_by_user(user_id)
+        if cart is not None:
+            await cart_write_buffer.flush(str(cart["_id"]))
+    return await get_storage().carts.upsert_user_cart(user_id, ops)
+
+async def get_user_cart(user_id: str) -> Optional[Cart]:
+    """Get the user's cart"""
+    cart = await get_storage().carts.get_by_user(user_id)
+    if cart is None:
+        return None
+    buffered = await cart_write_buffer.get(str(cart["_id"]))
+    return await _to_cart_model(buffered or cart)
+
+async def get_or_create_user_cart(user_id: str) -> Cart:
+    """Get the user's cart, creating an empty one if the user has none"""
+    return await _to_cart_model(await _upsert_user_cart(user_id, []))
+
+async def add_item_to_user_cart(user_id: str, item: CartItem) -> Cart:
+    """Add an item to the user's cart, creating the cart if the user has none"""
+    product = await get_product_details(item.product_id)
+    if not product:
+        raise ValueError(f"Product {item.product_id} not found")
+    cart = await _upsert_user_cart(user_id, [{
+        "product_id": item.product_id,
+        "op": "add",
+        "quantity": item.quantity,
+        "line": _cart_line(item.product_id, item.quantity, product)
+    }])
+    return await _to_cart_model(cart)
+
+async def update_item_quantity(
+    cart_id: str,
+    item_id: str,
+    quantity: int,
+    versions: Optional[List[int]] = None
+) -> Optional[Cart]:
     if not ObjectId.is_valid(cart_id):
         return None
-    db = get_db()
-    
-    # Update the quantity of specific item
-    await db[CART_COLLECTION].update_one(
-        {"_id": ObjectId(cart_id), "items.product_id": item_id},
-        {"$set": {"items.$.quantity": quantity}}
+    if settings.cart_write_buffer_enabled and versions is None:
+        cart = await cart_write_buffer.set_quantity(cart_id, item_id, quantity)
+        if cart:
+            return await _to_cart_model(cart)
+        return None
+    # Update the quantity of specific item; None when the cart has no such item
+    return await _apply_item_ops(
+        cart_id, [{"product_id": item_id, "op": "set", "quantity": quantity}], versions, require_lines=True
     )
-    
-    updated_cart = await db[CART_COLLECTION].find_one({"_id": ObjectId(cart_id)})
-    if updated_cart:
-        # Convert ObjectId to string for Pydantic model
-        updated_cart["_id"] = str(updated_cart["_id"])
-        
-        # Enrich items with product details and calculate total
-        enriched_items, total_amount = await enrich_cart_items(updated_cart.get("items", []))
-        
-        return CartModel(
-            id=updated_cart["_id"],
-            items=enriched_items,
-            total_amount=total_amount
-        )
-    return None
 
-async def remove_item_from_cart(cart_id: str, item_id: str) -> Optional[CartModel]:
+async def remove_item_from_cart(cart_id: str, item_id: str, versions: Optional[List[int]] = None) -> Optional[Cart]:
     if not ObjectId.is_valid(cart_id):
         return None
-    db = get_db()
-    await db[CART_COLLECTION].update_one(
-        {"_id": ObjectId(cart_id)},
-        {"$pull": {"items": {"product_id": item_id}}}
+    return await _apply_item_ops(
+        cart_id, [{"product_id": item_id, "op": "remove", "quantity": 0}], versions, require_lines=True
     )
-    updated_cart = await db[CART_COLLECTION].find_one({"_id": ObjectId(cart_id)})
-    if updated_cart:
-        # Convert ObjectId to string for Pydantic model
-        updated_cart["_id"] = str(updated_cart["_id"])
-        
-        # Enrich items with product details and calculate total
-        enriched_items, total_amount = await enrich_cart_items(updated_cart.get("items", []))
-        
-        return CartModel(
-            id=updated_cart["_id"],
-            items=enriched_items,
-            total_amount=total_amount
-        )
-    return None
 
-async def clear_cart(cart_id: str) -> Optional[CartModel]:
-    """Clear all items from cart but keep the cart"""
+def _fold_item_operations(operations: List[CartItemOperation]) -> Dict[str, dict]:
+    """Reduce a sequence of item operations to one net operation per product"""
+    net: Dict[str, dict] = {}
+    for operation in operations:
+        current = net.get(operation.product_id)
+        if operation.op != "add" or current is None:
+            net[operation.product_id] = {"op": operation.op, "quantity": operation.quantity or 0}
+        elif current["op"] == "remove":
+            # Removing and re-adding leaves exactly the added quantity
+            net[operation.product_id] = {"op": "set", "quantity": operation.quantity}
+        else:
+            current["quantity"] += operation.quantity
+    return net
+
+async def apply_item_operations(
+    cart_id: str,
+    operations: List[CartItemOperation],
+    versions: Optional[List[int]] = None
+) -> Optional[Cart]:
+    """Apply many add/set/remove item operations to a cart in one update"""
     if not ObjectId.is_valid(cart_id):
         return None
-    db = get_db()
-    result = await db[CART_COLLECTION].update_one(
-        {"_id": ObjectId(cart_id)},
-        {"$set": {"items": []}}
-    )
-    if result.matched_count == 0:
+
+    net = _fold_item_operations(operations)
+
+    # Verify all added or set products exist with a single lookup
+    product_ids = [pid for pid, op in net.items() if op["op"] != "remove"]
+    products = await get_products_details(product_ids)
+    missing = [pid for pid in product_ids if pid not in products]
+    if missing:
+        raise ValueError(f"Products not found: {', '.join(missing)}")
+
+    ops = []
+    for product_id, op in net.items():
+        op["product_id"] = product_id
+        if op["op"] != "remove":
+            op["line"] = _cart_line(product_id, op["quantity"], products[product_id])
+        ops.append(op)
+    return await _apply_item_ops(cart_id, ops, versions)
+
+async def clear_cart(cart_id: str, versions: Optional[List[int]] = None) -> Optional[Cart]:
+    """Clear all items from cart but keep the cart"""
+    if not ObjectId.is_valid(cart_id):
         return None
-    
-    updated_cart = await db[CART_COLLECTION].find_one({"_id": ObjectId(cart_id)})
+    await cart_write_buffer.flush(cart_id)
+    updated_cart = await get_storage().carts.clear(cart_id, versions)
     if updated_cart:
-        # Convert ObjectId to string for Pydantic model
-        updated_cart["_id"] = str(updated_cart["_id"])
-        
-        return CartModel(
-            id=updated_cart["_id"],
-            items=[],
-            total_amount=0.0
-        )
+        return _to_cart({
+            "_id": str(updated_cart["_id"]),
+            "items": [],
+            "total_amount": 0.0,
+            "version": updated_cart[VERSION_FIELD]
+        })
     return None
 
-async def delete_cart(cart_id: str) -> bool:
+async def delete_cart(cart_id: str, versions: Optional[List[int]] = None) -> bool:
     """Delete cart completely"""
     if not ObjectId.is_valid(cart_id):
         return False
-    db = get_db()
-    result = await db[CART_COLLECTION].delete_one({"_id": ObjectId(cart_id)})
-    return result.deleted_count > 0
+    await cart_write_buffer.flush(cart_id)
+    return await get_storage().carts.delete(cart_id, versions)
 
-async def checkout_cart(cart_id: str) -> Optional[dict]:
-    """Process cart checkout - returns order summary and deletes the cart"""
-    if not ObjectId.is_valid(cart_id):
-        return None
-    db = get_db()
-    cart = await db[CART_COLLECTION].find_one({"_id": ObjectId(cart_id)})
-    if not cart:
+def _order_summary(order: dict) -> dict:
+    return {
+        "order_id": str(order["_id"]),
+        "cart_id": order["cart_id"],
+        "items": order["items"],
+        "total_amount": order["total_amount"],
+        "status": order["status"]
+    }
+
+async def _claim_idempotency_key(cart_id: str, idempotency_key: str, order_id: ObjectId) -> Optional[dict]:
+    """Reserve the key with a pending order, or return the order that already holds it"""
+    orders = get_storage().orders
+    claimed = await orders.insert_pending({
+        "_id": order_id,
+        "idempotency_key": idempotency_key,
+        "cart_id": cart_id,
+        "status": ORDER_PENDING,
+        "created_at": datetime.now(timezone.utc)
+    })
+    if claimed:
         return None
-    
-    # Enrich items and calculate total
-    enriched_items, total_amount = await enrich_cart_items(cart.get("items", []))
-    
-    # Create order summary
-    order_summary = {
+    existing = await orders.find_by_idempotency_key(idempotency_key)
+    if existing is None:
+        # The holder gave the key up in the meantime; let the client retry
+        raise CheckoutConflictError("Checkout with this idempotency key is in progress")
+    return existing
+
+async def _build_order(cart: dict, order_id: ObjectId, idempotency_key: Optional[str], session=None) -> dict:
+    """Price the cart at current, uncached product prices"""
+    products = await load_products((item["product_id"] for item in cart.get("items", [])), session=session)
+    enriched_items, total_amount = await _enrich_items(cart.get("items", []), products)
+    order = {
+        "_id": order_id,
         "cart_id": str(cart["_id"]),
-        "items": [item.model_dump() for item in enriched_items],
+        "items": enriched_items,
         "total_amount": total_amount,
-        "status": "processed"
+        "status": ORDER_PROCESSED,
+        "created_at": datetime.now(timezone.utc)
     }
-    
-    # Delete cart after checkout
-    await delete_cart(cart_id)
-    
-    return order_summary
\ No newline at end of file
+    if idempotency_key:
+        order["idempotency_key"] = idempotency_key
+    return order
+
+async def checkout_cart(
+    cart_id: str,
+    idempotency_key: Optional[str] = None,
+    versions: Optional[List[int]] = None
+) -> Optional[dict]:
+    """Process cart checkout - reserves stock, stores the order and deletes the cart.
+
+    Retrying with the same idempotency key returns the original order
+    summary instead of processing the checkout again.
+    """
+    if not ObjectId.is_valid(cart_id):
+        return None
+    await cart_write_buffer.flush(cart_id)
+
+    order_id = ObjectId()
+    if idempotency_key:
+        existing = await _claim_idempotency_key(cart_id, idempotency_key, order_id)
+        if existing:
+            if existing["cart_id"] != cart_id:
+                raise CheckoutConflictError("Idempotency key was already used for another cart")
+            if existing["status"] != ORDER_PROCESSED:
+                raise CheckoutConflictError("Checkout with this idempotency key is in progress")
+            return _order_summary(existing)
+
+    async def build_order(cart: dict, session) -> dict:
+        return await _build_order(cart, order_id, idempotency_key, session=session)
+
+    storage = get_storage()
+    try:
+        order = await storage.checkout(cart_id, order_id, build_order, versions)
+    except InsufficientStockError as e:
+        if idempotency_key:
+            await storage.orders.delete_pending(order_id)
+        # Compensated products kept their stock but not their version
+        for pid in e.product_ids:
+            product_cache.invalidate(pid)
+        raise
+    except BaseException:
+        if idempotency_key:
+            await storage.orders.delete_pending(order_id)
+        raise
+
+    if order is None:
+        if idempotency_key:
+            await storage.orders.delete_pending(order_id)
+        return None
+
+    # Stock levels changed, so cached product documents are stale
+    for item in order["items"]:
+        product_cache.invalidate(item["product_id"])
+    return _order_summary(order)
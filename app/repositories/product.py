@@ -1,52 +1,250 @@
 # app/repositories/product.py
 
-from typing import List, Optional
-from app.db.mongo import get_db
-from app.schemas.product import ProductCreate
-from app.models.product import ProductModel
+import asyncio
+import logging
+import time
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+from pydantic import ValidationError
+from app.core.cache import AsyncLRUCache
+from app.core.config import settings
+from app.core.readers import Row
+from app.db.pagination import check_sorted_cursor, encode_cursor
+from app.db.versioning import VERSION_FIELD
+from app.schemas.product import ProductCreate, ProductImport, ProductQuery
+from app.models.product import Product, ProductDict, ProductModel
+from app.storage import get_storage
 from bson import ObjectId
 
-PRODUCT_COLLECTION = "products"
+logger = logging.getLogger(__name__)
 
-async def create_product(product_data: ProductCreate) -> ProductModel:
+# Columns of a CSV product export; sku through in_stock can be imported again
+PRODUCT_EXPORT_FIELDS = ("sku", "name", "description", "price", "in_stock", "_id", "version")
+
+# Shared product document cache, keyed by product ID string
+product_cache = AsyncLRUCache(
+    max_size=settings.product_cache_max_size,
+    ttl_seconds=settings.product_cache_ttl_seconds,
+    negative_ttl_seconds=settings.product_cache_negative_ttl_seconds
+)
+
+_reconciler: Optional[asyncio.Task] = None
+
+async def load_products(product_ids: Iterable[str], session=None) -> Dict[str, dict]:
+    """Load product documents from storage keyed by product ID, bypassing the cache"""
+    return await get_storage().products.get_many(list(product_ids), session=session)
+
+async def get_cached_products(product_ids: Iterable[str]) -> Dict[str, dict]:
+    """Get product documents for many IDs through the cache, keyed by product ID"""
+    valid_ids = [pid for pid in product_ids if ObjectId.is_valid(pid)]
+    if not valid_ids:
+        return {}
+    products = await product_cache.get_many_or_load(valid_ids, load_products)
+    # Hand out copies so callers cannot mutate cached documents
+    return {pid: dict(product) for pid, product in products.items() if product is not None}
+
+async def prime_product_cache(limit: int, recent_orders: int) -> int:
+    """Cache the products found in most of the latest orders; returns how many were cached"""
+    if limit <= 0 or not product_cache.enabled:
+        return 0
+    product_ids = await get_storage().orders.top_products(min(limit, product_cache.max_size), recent_orders)
+    return len(await get_cached_products(product_ids))
+
+def _to_product(product: dict) -> Product:
+    """Shape a product document for the API in the configured serialization mode"""
+    product_dict: ProductDict = {
+        "_id": product["_id"],
+        "sku": product.get("sku"),
+        "name": product["name"],
+        "description": product.get("description"),
+        "price": product["price"],
+        "in_stock": product["in_stock"],
+        "version": product.get(VERSION_FIELD, 0)
+    }
+    if settings.fast_serialization:
+        return product_dict
+    return ProductModel(**product_dict)
+
+async def create_product(product_data: ProductCreate) -> Product:
     """Create a new product"""
-    db = get_db()
     product_dict = product_data.model_dump()
-    result = await db[PRODUCT_COLLECTION].insert_one(product_dict)
-    product = await db[PRODUCT_COLLECTION].find_one({"_id": result.inserted_id})
+    if product_dict["sku"] is None:
+        # Products without a SKU stay out of the sku index
+        del product_dict["sku"]
+    product_dict[VERSION_FIELD] = 1
+    product = await get_storage().products.insert(product_dict)
+    product_cache.invalidate(product["_id"])
     
-    # Convert ObjectId to string for Pydantic model
-    product["_id"] = str(product["_id"])
-    
-    return ProductModel(**product)
+    return _to_product(product)
 
-async def get_product_by_id(product_id: str) -> Optional[ProductModel]:
+async def get_product_by_id(product_id: str) -> Optional[Product]:
     """Get product by ID"""
-    if not ObjectId.is_valid(product_id):
-        return None
-    db = get_db()
-    product = await db[PRODUCT_COLLECTION].find_one({"_id": ObjectId(product_id)})
+    products = await get_cached_products([product_id])
+    product = products.get(product_id)
     if product:
-        # Convert ObjectId to string for Pydantic model
-        product["_id"] = str(product["_id"])
-        return ProductModel(**product)
+        return _to_product(product)
     return None
 
-async def get_all_products() -> List[ProductModel]:
-    """Get all products"""
-    db = get_db()
-    products_cursor = db[PRODUCT_COLLECTION].find()
-    products = []
-    async for product in products_cursor:
-        # Convert ObjectId to string for Pydantic model
-        product["_id"] = str(product["_id"])
-        products.append(ProductModel(**product))
-    return products
-
-async def delete_product(product_id: str) -> bool:
-    """Delete product by ID"""
+async def get_product_version(product_id: str) -> Optional[int]:
+    """Get the current version of a product without building a response"""
+    products = await get_cached_products([product_id])
+    product = products.get(product_id)
+    if product:
+        return product.get(VERSION_FIELD, 0)
+    return None
+
+def _to_listed_product(product: dict, query: ProductQuery) -> Union[Product, dict]:
+    """Shape a listed product, as a plain dict of the ID and requested fields if the query names any"""
+    if query.fields is None:
+        return _to_product(product)
+    return {"_id": product["_id"], **{field: product.get(field) for field in query.fields}}
+
+def _next_cursor(product: dict, query: ProductQuery) -> str:
+    if query.sort_field == "_id":
+        return product["_id"]
+    return encode_cursor(product[query.sort_field], product["_id"])
+
+async def get_all_products(
+    limit: int,
+    after: Optional[str] = None,
+    query: Optional[ProductQuery] = None
+) -> Tuple[List[Union[Product, dict]], Optional[str]]:
+    """Get a page of products matching the query in its order, and the cursor of the next page if it is full"""
+    query = query or ProductQuery()
+    products = await get_storage().products.page(limit, after, query)
+    next_cursor = _next_cursor(products[-1], query) if len(products) == limit else None
+    return [_to_listed_product(product, query) for product in products], next_cursor
+
+def iter_products(
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    query: Optional[ProductQuery] = None
+) -> AsyncIterator[Union[Product, dict]]:
+    """Stream products matching the query in its order as the cursor produces them"""
+    query = query or ProductQuery()
+    # Validate the cursor before streaming starts
+    check_sorted_cursor(query.sort_field, after)
+    return _iter_products(after, limit, query)
+
+async def _iter_products(
+    after: Optional[str],
+    limit: Optional[int],
+    query: ProductQuery
+) -> AsyncIterator[Union[Product, dict]]:
+    async for product in get_storage().products.stream(after, limit, query):
+        yield _to_listed_product(product, query)
+
+async def delete_product(product_id: str, versions: Optional[List[int]] = None) -> bool:
+    """Delete product by ID, optionally only if it is at one of the expected versions"""
     if not ObjectId.is_valid(product_id):
         return False
-    db = get_db()
-    result = await db[PRODUCT_COLLECTION].delete_one({"_id": ObjectId(product_id)})
-    return result.deleted_count > 0
\ No newline at end of file
+    storage = get_storage()
+    try:
+        deleted = await storage.products.delete(product_id, versions)
+    finally:
+        product_cache.invalidate(product_id)
+    if not deleted:
+        return False
+    # Product IDs are never reused, so lookups of this one can be answered from the cache from now on
+    product_cache.set_absent(product_id)
+    if settings.cart_cascade_product_deletes:
+        await storage.carts.remove_products([product_id])
+    else:
+        # Carts holding the product now render it differently, so their ETags must change
+        await storage.carts.bump_versions_with_products([product_id])
+    return True
+
+async def reconcile_cart_products() -> int:
+    """Remove cart lines of products that do not exist; returns how many products they referred to"""
+    storage = get_storage()
+    product_ids = await storage.dangling_product_ids()
+    for start in range(0, len(product_ids), settings.cart_reconcile_batch_size):
+        batch = product_ids[start:start + settings.cart_reconcile_batch_size]
+        for product_id in batch:
+            product_cache.set_absent(product_id)
+        await storage.carts.remove_products(batch)
+    if product_ids:
+        logger.info("Removed cart lines of %d missing products", len(product_ids))
+    return len(product_ids)
+
+async def _reconcile_forever(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reconcile_cart_products()
+        except Exception:
+            logger.exception("Failed to reconcile cart lines with products")
+
+def start_cart_reconciliation() -> None:
+    """Reconcile cart lines with products every configured interval in the background"""
+    global _reconciler
+    if settings.cart_reconcile_interval_seconds > 0 and _reconciler is None:
+        _reconciler = asyncio.create_task(_reconcile_forever(settings.cart_reconcile_interval_seconds))
+
+async def stop_cart_reconciliation() -> None:
+    global _reconciler
+    if _reconciler is not None:
+        _reconciler.cancel()
+        await asyncio.gather(_reconciler, return_exceptions=True)
+        _reconciler = None
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}" for detail in error.errors()
+    )
+
+async def import_products(rows: AsyncIterator[Row]) -> dict:
+    """Validate rows as products and upsert them by SKU in batches; returns an import report.
+
+    Rows are read as they arrive, so the body is never held in memory as a
+    whole. A later row with a SKU already in the batch writes the batch
+    first, so rows apply in order.
+    """
+    started = time.perf_counter()
+    storage = get_storage()
+    report = {"rows": 0, "inserted": 0, "updated": 0, "unchanged": 0, "invalid": 0, "failed": 0, "errors": []}
+    # Validated products of the current batch by SKU, with their line numbers
+    batch: Dict[str, Tuple[int, dict]] = {}
+
+    def reject(line: int, error: str, outcome: str) -> None:
+        report[outcome] += 1
+        if len(report["errors"]) < settings.product_import_max_errors:
+            report["errors"].append({"line": line, "error": error})
+
+    async def flush() -> None:
+        lines = [line for line, _ in batch.values()]
+        products = [product for _, product in batch.values()]
+        batch.clear()
+        result = await storage.products.upsert_by_sku(products)
+        report["inserted"] += len(result["inserted"])
+        report["updated"] += len(result["updated"])
+        report["unchanged"] += result["unchanged"]
+        for position, error in sorted(result["failed"].items()):
+            reject(lines[position], error, "failed")
+        for product_id in result["inserted"] + result["updated"]:
+            product_cache.invalidate(product_id)
+        if result["updated"]:
+            # Carts holding changed products now render differently, so their ETags must change
+            await storage.carts.bump_versions_with_products(result["updated"])
+        logger.info(
+            "Product import: %d rows, %d inserted, %d updated, %d unchanged, %d rejected",
+            report["rows"], report["inserted"], report["updated"], report["unchanged"],
+            report["invalid"] + report["failed"]
+        )
+
+    async for line, row in rows:
+        report["rows"] += 1
+        if isinstance(row, str):
+            reject(line, row, "invalid")
+            continue
+        try:
+            product = ProductImport.model_validate(row).model_dump()
+        except ValidationError as e:
+            reject(line, _validation_message(e), "invalid")
+            continue
+        if product["sku"] in batch or len(batch) >= settings.product_import_batch_size:
+            await flush()
+        batch[product["sku"]] = (line, product)
+    if batch:
+        await flush()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
@@ -0,0 +1,45 @@
+# app/routers/analytics.py
+
+from fastapi import APIRouter, HTTPException, Query
+from app.core.config import settings
+from app.schemas.analytics import AnalyticsRefresh, CartAgesReport, CartOverview, CartProductsReport
+from app.repositories.analytics import (
+    get_cart_ages, get_cart_overview, get_cart_products, refresh_cart_analytics
+)
+from app.storage.base import RefreshInProgressError
+from typing import Optional
+
+router = APIRouter()
+
+LIVE_DESCRIPTION = "Compute from the carts now instead of reading the last materialized reports"
+
+@router.get("/carts", response_model=CartOverview)
+async def get_cart_overview_endpoint(live: bool = Query(False, description=LIVE_DESCRIPTION)):
+    """GET /api/v1/admin/analytics/carts - Сводка по корзинам: количество, единицы товара и общая стоимость"""
+    return await get_cart_overview(live)
+
+@router.get("/carts/products", response_model=CartProductsReport)
+async def get_cart_products_endpoint(
+    limit: Optional[int] = Query(None, ge=1, description="Number of products"),
+    sort: str = Query("units", pattern="^(units|carts|value)$", description="units, carts or value, descending"),
+    live: bool = Query(False, description=LIVE_DESCRIPTION)
+):
+    """GET /api/v1/admin/analytics/carts/products - Товары в корзинах: количество корзин, единиц и стоимость"""
+    limit = min(limit or settings.analytics_top_products_limit, settings.list_max_limit)
+    try:
+        return await get_cart_products(limit, sort, live)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/carts/ages", response_model=CartAgesReport)
+async def get_cart_ages_endpoint(live: bool = Query(False, description=LIVE_DESCRIPTION)):
+    """GET /api/v1/admin/analytics/carts/ages - Брошенные корзины по времени с последнего изменения"""
+    return await get_cart_ages(live)
+
+@router.post("/refresh", response_model=AnalyticsRefresh)
+async def refresh_analytics_endpoint():
+    """POST /api/v1/admin/analytics/refresh - Пересчитать сохранённые отчёты сейчас"""
+    try:
+        return await refresh_cart_analytics()
+    except RefreshInProgressError as e:
+        raise HTTPException(status_code=409, detail=str(e))
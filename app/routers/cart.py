@@ -1,16 +1,28 @@
 # app/routers/cart.py
 
-from fastapi import APIRouter, HTTPException, Response, status
-from fastapi.responses import JSONResponse
-from app.schemas.cart import CartCreate, CartResponse, CartItem, ItemUpdate, CheckoutResponse
+from fastapi import APIRouter, Header, HTTPException, Path, Query, Response, status
+from fastapi.responses import JSONResponse, StreamingResponse
+from app.core.config import settings
+from app.core.etag import etag, etag_matches, expected_versions
+from app.core.events import TooManySubscribersError
+from app.core.responses import (
+    NDJSON_RESPONSES, SSE_RESPONSES, document_id, document_version, fast_response, ndjson_response, sse_response
+)
+from app.db.versioning import PreconditionFailedError
+from app.schemas.cart import CartCreate, CartResponse, CartItem, CartItemsBulkUpdate, ItemUpdate, CheckoutResponse
 from app.repositories.cart import (
-    create_cart, get_cart, get_all_carts, add_item_to_cart_or_create,
-    update_item_quantity, remove_item_from_cart, clear_cart, checkout_cart, delete_cart
+    create_cart, get_cart, get_cart_version, get_all_carts, iter_carts, add_item_to_cart_or_create,
+    update_item_quantity, remove_item_from_cart, clear_cart, checkout_cart, delete_cart,
+    apply_item_operations, CheckoutConflictError, cart_events, subscribe_to_cart,
+    get_user_cart, get_or_create_user_cart, add_item_to_user_cart
 )
-from typing import List
+from typing import List, Optional
 
 router = APIRouter()
 
+IF_MATCH_DESCRIPTION = "Only apply the change if the cart still has this ETag"
+USER_ID_PATH = Path(..., pattern=r"^[\w.:@-]{1,128}$", description="User or session ID owning the cart")
+
 @router.post("/", response_model=CartResponse, status_code=status.HTTP_201_CREATED)
 async def create_new_cart(cart: CartCreate, response: Response):
     """POST /api/v1/carts - Создать новую корзину"""
@@ -20,72 +32,216 @@ async def create_new_cart(cart: CartCreate, response: Response):
             raise HTTPException(status_code=400, detail="Failed to create cart")
         
         # Add Location header with cart URL
-        response.headers["Location"] = f"/api/v1/carts/{new_cart.id}"
-        return new_cart
+        response.headers["Location"] = f"/api/v1/carts/{document_id(new_cart)}"
+        response.headers["ETag"] = etag(document_version(new_cart))
+        return fast_response(new_cart, response, status.HTTP_201_CREATED)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/", response_model=List[CartResponse])
-async def get_all_carts_endpoint():
+@router.get("/", response_model=List[CartResponse], responses=NDJSON_RESPONSES)
+async def get_all_carts_endpoint(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="Page size"),
+    after: Optional[str] = Query(None, description="Return carts after this cart ID"),
+    stream: bool = Query(False, description="Stream carts as NDJSON instead of returning one page")
+):
     """GET /api/v1/carts - Получить список всех корзин (административный)"""
-    carts = await get_all_carts()
-    return carts
+    try:
+        if stream:
+            return ndjson_response(iter_carts(after, limit))
+        limit = min(limit or settings.list_default_limit, settings.list_max_limit)
+        carts = await get_all_carts(limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(carts) == limit:
+        response.headers["X-Next-Cursor"] = document_id(carts[-1])
+    return fast_response(carts, response)
+
+# Declared before /{cart_id} so "events" is not taken for a cart ID
+@router.get("/events", response_class=StreamingResponse, responses=SSE_RESPONSES)
+async def stream_all_cart_events():
+    """GET /api/v1/carts/events - Поток изменений всех корзин (административный)"""
+    try:
+        subscription = cart_events.subscribe()
+    except TooManySubscribersError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return sse_response(cart_events.events(subscription, settings.cart_events_heartbeat_seconds))
+
+# Declared before /{cart_id} so "users" is not taken for a cart ID
+@router.get("/users/{user_id}", response_model=CartResponse)
+async def get_user_cart_endpoint(response: Response, user_id: str = USER_ID_PATH):
+    """GET /api/v1/carts/users/{userId} - Получить корзину пользователя"""
+    cart = await get_user_cart(user_id)
+    if not cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    response.headers["ETag"] = etag(document_version(cart))
+    return fast_response(cart, response)
+
+@router.put("/users/{user_id}", response_model=CartResponse)
+async def get_or_create_user_cart_endpoint(response: Response, user_id: str = USER_ID_PATH):
+    """PUT /api/v1/carts/users/{userId} - Получить корзину пользователя, создав её при необходимости"""
+    cart = await get_or_create_user_cart(user_id)
+    response.headers["Location"] = f"/api/v1/carts/{document_id(cart)}"
+    response.headers["ETag"] = etag(document_version(cart))
+    return fast_response(cart, response)
+
+@router.post("/users/{user_id}/items", response_model=CartResponse)
+async def add_item_to_user_cart_endpoint(item: CartItem, response: Response, user_id: str = USER_ID_PATH):
+    """POST /api/v1/carts/users/{userId}/items - Добавить товар в корзину пользователя"""
+    try:
+        cart = await add_item_to_user_cart(user_id, item)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["Location"] = f"/api/v1/carts/{document_id(cart)}"
+    response.headers["ETag"] = etag(document_version(cart))
+    return fast_response(cart, response)
 
-@router.get("/{cart_id}", response_model=CartResponse)
-async def get_cart_by_id(cart_id: str):
+@router.get("/{cart_id}", response_model=CartResponse, responses={304: {"description": "Cart not modified"}})
+async def get_cart_by_id(
+    cart_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None, description="Return 304 if the cart still has this ETag")
+):
     """GET /api/v1/carts/{cartId} - Получить содержимое конкретной корзины"""
+    if if_none_match:
+        # Only the version is read, so unchanged carts skip loading and enrichment
+        version = await get_cart_version(cart_id)
+        if version is not None and etag_matches(if_none_match, version):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag(version)})
     cart = await get_cart(cart_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-    return cart
+    response.headers["ETag"] = etag(document_version(cart))
+    return fast_response(cart, response)
 
 @router.post("/{cart_id}/items", response_model=CartResponse)
-async def add_item_to_cart_endpoint(cart_id: str, item: CartItem):
+async def add_item_to_cart_endpoint(
+    cart_id: str,
+    item: CartItem,
+    response: Response,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION)
+):
     """POST /api/v1/carts/{cartId}/items - Добавить товар в корзину"""
     try:
-        updated_cart = await add_item_to_cart_or_create(cart_id, item)
+        updated_cart = await add_item_to_cart_or_create(cart_id, item, expected_versions(if_match))
         if not updated_cart:
-            raise HTTPException(status_code=400, detail="Failed to add item to cart")
-        return updated_cart
+            raise HTTPException(status_code=404, detail="Cart not found")
+        response.headers["ETag"] = etag(document_version(updated_cart))
+        return fast_response(updated_cart, response)
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.post("/{cart_id}/items/bulk", response_model=CartResponse)
+async def bulk_update_cart_items(
+    cart_id: str,
+    bulk_update: CartItemsBulkUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION)
+):
+    """POST /api/v1/carts/{cartId}/items/bulk - Добавить, изменить или удалить несколько товаров за один запрос"""
+    try:
+        updated_cart = await apply_item_operations(cart_id, bulk_update.operations, expected_versions(if_match))
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not updated_cart:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    response.headers["ETag"] = etag(document_version(updated_cart))
+    return fast_response(updated_cart, response)
+
 @router.put("/{cart_id}/items/{item_id}", response_model=CartResponse)
-async def update_cart_item(cart_id: str, item_id: str, item_update: ItemUpdate):
+async def update_cart_item(
+    cart_id: str,
+    item_id: str,
+    item_update: ItemUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION)
+):
     """PUT /api/v1/carts/{cartId}/items/{itemId} - Обновить количество товара"""
-    updated_cart = await update_item_quantity(cart_id, item_id, item_update.quantity)
+    try:
+        updated_cart = await update_item_quantity(cart_id, item_id, item_update.quantity, expected_versions(if_match))
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
     if not updated_cart:
         raise HTTPException(status_code=404, detail="Cart or item not found")
-    return updated_cart
+    response.headers["ETag"] = etag(document_version(updated_cart))
+    return fast_response(updated_cart, response)
 
 @router.delete("/{cart_id}/items/{item_id}", response_model=CartResponse)
-async def remove_item_from_cart_endpoint(cart_id: str, item_id: str):
+async def remove_item_from_cart_endpoint(
+    cart_id: str,
+    item_id: str,
+    response: Response,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION)
+):
     """DELETE /api/v1/carts/{cartId}/items/{itemId} - Удалить товар из корзины"""
-    updated_cart = await remove_item_from_cart(cart_id, item_id)
+    try:
+        updated_cart = await remove_item_from_cart(cart_id, item_id, expected_versions(if_match))
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
     if not updated_cart:
         raise HTTPException(status_code=404, detail="Cart or item not found")
-    return updated_cart
+    response.headers["ETag"] = etag(document_version(updated_cart))
+    return fast_response(updated_cart, response)
 
 @router.delete("/{cart_id}/clear", response_model=CartResponse)
-async def clear_cart_endpoint(cart_id: str):
+async def clear_cart_endpoint(
+    cart_id: str,
+    response: Response,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION)
+):
     """DELETE /api/v1/carts/{cartId}/clear - Очистить корзину (оставить корзину, удалить только товары)"""
-    cleared_cart = await clear_cart(cart_id)
+    try:
+        cleared_cart = await clear_cart(cart_id, expected_versions(if_match))
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
     if not cleared_cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-    return cleared_cart
+    response.headers["ETag"] = etag(document_version(cleared_cart))
+    return fast_response(cleared_cart, response)
 
 @router.delete("/{cart_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_cart_endpoint(cart_id: str):
+async def delete_cart_endpoint(
+    cart_id: str,
+    if_match: Optional[str] = Header(None, description=IF_MATCH_DESCRIPTION)
+):
     """DELETE /api/v1/carts/{cartId} - Удалить корзину полностью"""
-    success = await delete_cart(cart_id)
+    try:
+        success = await delete_cart(cart_id, expected_versions(if_match))
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
     if not success:
         raise HTTPException(status_code=404, detail="Cart not found")
     return Response(status_code=status.HTTP_204_NO_CONTENT)
 
 @router.post("/{cart_id}/checkout", response_model=CheckoutResponse)
-async def checkout_cart_endpoint(cart_id: str):
+async def checkout_cart_endpoint(
+    cart_id: str,
+    idempotency_key: Optional[str] = Header(None, description="Retries with the same key return the original order"),
+    if_match: Optional[str] = Header(None, description="Only check out if the cart still has this ETag")
+):
     """POST /api/v1/carts/{cartId}/checkout - Оформить заказ (корзина будет удалена после оформления)"""
-    order_summary = await checkout_cart(cart_id)
+    try:
+        order_summary = await checkout_cart(cart_id, idempotency_key, expected_versions(if_match))
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
+    except CheckoutConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if not order_summary:
         raise HTTPException(status_code=404, detail="Cart not found")
-    return order_summary
\ No newline at end of file
+    return fast_response(order_summary)
+
+@router.get("/{cart_id}/events", response_class=StreamingResponse, responses=SSE_RESPONSES)
+async def stream_cart_events(cart_id: str):
+    """GET /api/v1/carts/{cartId}/events - Поток изменений корзины (server-sent events)"""
+    try:
+        subscribed = await subscribe_to_cart(cart_id)
+    except TooManySubscribersError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if not subscribed:
+        raise HTTPException(status_code=404, detail="Cart not found")
+    subscription, current = subscribed
+    return sse_response(cart_events.events(subscription, settings.cart_events_heartbeat_seconds, first=current))
@@ -1,38 +1,145 @@
 # app/routers/product.py
 
-from fastapi import APIRouter, HTTPException, Response, status
-from app.schemas.product import ProductCreate, ProductResponse
-from app.repositories.product import create_product, get_all_products, get_product_by_id, delete_product
-from typing import List
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
+from app.core.config import settings
+from app.core.etag import etag, etag_matches, expected_versions
+from app.core.readers import iter_csv, iter_ndjson
+from app.core.responses import (
+    CSV_MEDIA_TYPE, NDJSON_MEDIA_TYPE, NDJSON_RESPONSES,
+    csv_response, document_version, fast_response, ndjson_response, plain_response
+)
+from app.db.versioning import PreconditionFailedError
+from app.schemas.product import PRODUCT_FIELDS, ImportReport, ProductCreate, ProductQuery, ProductResponse
+from app.repositories.product import (
+    PRODUCT_EXPORT_FIELDS, create_product, get_all_products, iter_products, get_product_by_id,
+    get_product_version, delete_product, import_products
+)
+from app.storage.base import DuplicateSkuError
+from typing import List, Optional
+
+# Import body parsers by content type; NDJSON is assumed when none is given
+IMPORT_READERS = {
+    NDJSON_MEDIA_TYPE: iter_ndjson,
+    "application/json": iter_ndjson,
+    "": iter_ndjson,
+    CSV_MEDIA_TYPE: iter_csv
+}
+
+# OpenAPI description of the import request body
+IMPORT_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            NDJSON_MEDIA_TYPE: {"schema": {"type": "string"}},
+            CSV_MEDIA_TYPE: {"schema": {"type": "string"}}
+        }
+    }
+}
 
 router = APIRouter()
 
 @router.post("/", response_model=ProductResponse, status_code=status.HTTP_201_CREATED)
-async def create_new_product(product: ProductCreate):
+async def create_new_product(product: ProductCreate, response: Response):
     """POST /api/v1/products - Создать новый продукт"""
-    new_product = await create_product(product)
+    try:
+        new_product = await create_product(product)
+    except DuplicateSkuError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     if not new_product:
         raise HTTPException(status_code=400, detail="Failed to create product")
-    return new_product
+    response.headers["ETag"] = etag(document_version(new_product))
+    return fast_response(new_product, response, status.HTTP_201_CREATED)
+
+@router.get("/", response_model=List[ProductResponse], responses=NDJSON_RESPONSES)
+async def list_all_products(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, description="Page size"),
+    after: Optional[str] = Query(None, description="Return products after this cursor (X-Next-Cursor)"),
+    stream: bool = Query(False, description="Stream products as NDJSON instead of returning one page"),
+    q: Optional[str] = Query(None, min_length=1, description="Words to find in name or description"),
+    name_prefix: Optional[str] = Query(None, min_length=1, description="Names starting with this, ignoring case"),
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock_only: bool = Query(False, description="Only products with stock left"),
+    sort: str = Query("id", pattern="^-?(id|name|price)$", description="id, name or price; prefix - for descending"),
+    fields: Optional[str] = Query(
+        None, description=f"Comma-separated fields to return besides the ID: {', '.join(PRODUCT_FIELDS)}"
+    )
+):
+    """GET /api/v1/products - Получить список продуктов с поиском, фильтрами и сортировкой"""
+    try:
+        query = ProductQuery(
+            q=q,
+            name_prefix=name_prefix,
+            min_price=min_price,
+            max_price=max_price,
+            in_stock_only=in_stock_only,
+            sort=sort,
+            fields=[field.strip() for field in fields.split(",") if field.strip()] if fields else None
+        )
+        if stream:
+            return ndjson_response(iter_products(after, limit, query))
+        limit = min(limit or settings.list_default_limit, settings.list_max_limit)
+        products, next_cursor = await get_all_products(limit, after, query)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail="; ".join(error["msg"] for error in e.errors()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if query.fields is not None:
+        # Partial products do not fit the response model
+        return plain_response(products, response)
+    return fast_response(products, response)
+
+@router.post("/import", response_model=ImportReport, openapi_extra=IMPORT_BODY)
+async def import_product_catalog(request: Request):
+    """POST /api/v1/products/import - Импортировать продукты из NDJSON или CSV по SKU"""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    reader = IMPORT_READERS.get(content_type)
+    if reader is None:
+        raise HTTPException(status_code=415, detail=f"Send {NDJSON_MEDIA_TYPE} or {CSV_MEDIA_TYPE}")
+    return await import_products(reader(request.stream()))
 
-@router.get("/", response_model=List[ProductResponse])
-async def list_all_products():
-    """GET /api/v1/products - Получить список всех продуктов"""
-    products = await get_all_products()
-    return products
+# Declared before /{product_id} so "export" is not taken for a product ID
+@router.get("/export", responses={200: {"content": {NDJSON_MEDIA_TYPE: {}, CSV_MEDIA_TYPE: {}}}})
+async def export_product_catalog(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson or csv")
+):
+    """GET /api/v1/products/export - Выгрузить все продукты в NDJSON или CSV"""
+    products = iter_products()
+    if format == "csv":
+        return csv_response(products, PRODUCT_EXPORT_FIELDS, filename="products.csv")
+    return ndjson_response(products)
 
-@router.get("/{product_id}", response_model=ProductResponse)
-async def get_product(product_id: str):
+@router.get("/{product_id}", response_model=ProductResponse, responses={304: {"description": "Product not modified"}})
+async def get_product(
+    product_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None, description="Return 304 if the product still has this ETag")
+):
     """GET /api/v1/products/{productId} - Получить продукт по ID"""
+    if if_none_match:
+        version = await get_product_version(product_id)
+        if version is not None and etag_matches(if_none_match, version):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag(version)})
     product = await get_product_by_id(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    response.headers["ETag"] = etag(document_version(product))
+    return fast_response(product, response)
 
 @router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def delete_product_endpoint(product_id: str):
+async def delete_product_endpoint(
+    product_id: str,
+    if_match: Optional[str] = Header(None, description="Only delete the product if it still has this ETag")
+):
     """DELETE /api/v1/products/{productId} - Удалить продукт"""
-    success = await delete_product(product_id)
+    try:
+        success = await delete_product(product_id, expected_versions(if_match))
+    except PreconditionFailedError as e:
+        raise HTTPException(status_code=412, detail=str(e))
     if not success:
         raise HTTPException(status_code=404, detail="Product not found")
     return Response(status_code=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
@@ -0,0 +1,45 @@
+# app/schemas/analytics.py
+
+from datetime import datetime
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+class CartOverview(BaseModel):
+    carts: int = Field(..., description="Stored carts")
+    empty_carts: int = Field(..., description="Carts without items")
+    units: int = Field(..., description="Item quantities across all carts")
+    value: float = Field(..., description="Value of all carts at current prices")
+    average_value: float = Field(..., description="Average value of a cart with items")
+    computed_at: datetime = Field(..., description="When the figures were computed")
+
+class CartProductStats(BaseModel):
+    id: str = Field(..., alias="_id", description="Product ID as string")
+    name: Optional[str] = Field(None, description="Product name; null if the product no longer exists")
+    price: float = Field(..., description="Current unit price")
+    carts: int = Field(..., description="Carts holding the product")
+    units: int = Field(..., description="Quantity across those carts")
+    value: float = Field(..., description="Units at the current price")
+
+    class Config:
+        populate_by_name = True
+
+class CartProductsReport(BaseModel):
+    products: List[CartProductStats]
+    computed_at: datetime = Field(..., description="When the figures were computed")
+
+class CartAgeBucket(BaseModel):
+    bucket: str = Field(..., example="1h-24h", description="Time since the last change; unknown for old carts")
+    min_hours: Optional[float] = Field(None, description="Inclusive lower bound")
+    max_hours: Optional[float] = Field(None, description="Exclusive upper bound; null for the oldest bucket")
+    carts: int = Field(..., description="Carts in the bucket")
+    empty_carts: int = Field(..., description="Of those, carts without items")
+    units: int = Field(..., description="Item quantities in the bucket")
+    value: float = Field(..., description="Value of the bucket at current prices")
+
+class CartAgesReport(BaseModel):
+    buckets: List[CartAgeBucket]
+    computed_at: datetime = Field(..., description="When the figures were computed")
+
+class AnalyticsRefresh(BaseModel):
+    computed_at: datetime = Field(..., description="When the materialized reports were computed")
+    seconds: float = Field(..., description="Time taken")
@@ -1,7 +1,7 @@
 # app/schemas/cart.py
 
-from pydantic import BaseModel, Field
-from typing import List
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Literal, Optional
 
 class CartItem(BaseModel):
     product_id: str = Field(..., description="Product ID as string", alias="productId")
@@ -18,13 +18,33 @@ class CartItemWithDetails(BaseModel):
     price: float = Field(..., description="Unit price")
     total_price: float = Field(..., description="Total price for this item")
 
+class CartItemOperation(BaseModel):
+    op: Literal["add", "set", "remove"] = Field(..., description="add to, overwrite or remove the item's quantity")
+    product_id: str = Field(..., description="Product ID as string", alias="productId")
+    quantity: Optional[int] = Field(None, gt=0, example=1, description="Required for add and set")
+
+    class Config:
+        populate_by_name = True
+        allow_population_by_field_name = True
+
+    @model_validator(mode="after")
+    def check_quantity(self):
+        if self.op != "remove" and self.quantity is None:
+            raise ValueError(f"quantity is required for {self.op}")
+        return self
+
+class CartItemsBulkUpdate(BaseModel):
+    operations: List[CartItemOperation] = Field(..., min_length=1, description="Applied in order")
+
 class CartCreate(BaseModel):
     items: List[CartItem] = []
 
 class CartResponse(BaseModel):
     id: str = Field(..., alias="_id", description="Cart ID as string")
+    user_id: Optional[str] = Field(None, description="Owning user, for carts kept per user")
     items: List[CartItemWithDetails] = []
     total_amount: float = Field(..., description="Total cart value")
+    version: int = Field(0, description="Incremented on every change; sent as the ETag")
 
     class Config:
         populate_by_name = True
@@ -34,6 +54,7 @@ class ItemUpdate(BaseModel):
     quantity: int = Field(..., gt=0, example=1)
 
 class CheckoutResponse(BaseModel):
+    order_id: Optional[str] = Field(None, description="ID of the stored order")
     cart_id: str = Field(..., description="Cart ID")
     items: List[CartItemWithDetails] = Field(..., description="Cart items with details")
     total_amount: float = Field(..., description="Total order amount")
@@ -1,21 +1,80 @@
 # app/schemas/product.py
 
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Literal, Optional
+
+# Product fields a listing can be narrowed to; the ID is always returned
+PRODUCT_FIELDS = ("sku", "name", "description", "price", "in_stock", "version")
 
 class ProductCreate(BaseModel):
+    sku: Optional[str] = Field(None, min_length=1, example="APL-IP15-128", description="External catalog key, unique")
     name: str = Field(..., example="iPhone 15")
     description: Optional[str] = Field(None, example="Latest Apple smartphone")
     price: float = Field(..., gt=0, example=1299.99)
     in_stock: int = Field(..., ge=0, example=10)
 
+class ProductImport(ProductCreate):
+    """One row of a bulk import; the SKU decides whether it inserts or updates"""
+    sku: str = Field(..., min_length=1, example="APL-IP15-128", description="External catalog key, unique")
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    rows: int = Field(..., description="Data rows read from the body")
+    inserted: int
+    updated: int
+    unchanged: int
+    invalid: int = Field(..., description="Rows rejected by validation")
+    failed: int = Field(..., description="Valid rows the database rejected")
+    errors: List[ImportRowError] = Field(..., description="The first rejected rows, by body line number")
+    seconds: float
+
 class ProductResponse(BaseModel):
     id: str = Field(..., alias="_id", description="Product ID as string")
+    sku: Optional[str] = None
     name: str
     description: Optional[str] = None
     price: float
     in_stock: int
+    version: int = Field(0, description="Incremented on every change; sent as the ETag")
 
     class Config:
         populate_by_name = True
-        allow_population_by_field_name = True
\ No newline at end of file
+        allow_population_by_field_name = True
+
+class ProductQuery(BaseModel):
+    """Filters, order and fields of a product listing"""
+    q: Optional[str] = Field(None, min_length=1, description="Words to find in name or description")
+    name_prefix: Optional[str] = Field(None, min_length=1, description="Names starting with this, ignoring case")
+    min_price: Optional[float] = Field(None, ge=0)
+    max_price: Optional[float] = Field(None, ge=0)
+    in_stock_only: bool = False
+    sort: Literal["id", "-id", "name", "-name", "price", "-price"] = "id"
+    fields: Optional[List[str]] = Field(None, description="Fields to return besides the ID")
+
+    @field_validator("fields")
+    @classmethod
+    def known_fields(cls, fields: Optional[List[str]]) -> Optional[List[str]]:
+        if fields is None:
+            return None
+        unknown = [field for field in fields if field not in PRODUCT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}; choose from {', '.join(PRODUCT_FIELDS)}")
+        return list(dict.fromkeys(fields))
+
+    @property
+    def sort_field(self) -> str:
+        field = self.sort.lstrip("-")
+        return "_id" if field == "id" else field
+
+    @property
+    def descending(self) -> bool:
+        return self.sort.startswith("-")
+
+    @property
+    def filtered(self) -> bool:
+        return bool(self.q or self.name_prefix or self.in_stock_only) or (
+            self.min_price is not None or self.max_price is not None
+        )
@@ -0,0 +1,25 @@
+# app/storage/__init__.py
+
+from typing import Optional
+from app.core.config import settings
+from app.storage.base import Storage
+
+_storage: Optional[Storage] = None
+
+def get_storage() -> Storage:
+    """Return the storage engine selected by settings, creating it on first use"""
+    global _storage
+    if _storage is None:
+        if settings.storage_backend == "mongo":
+            from app.storage.mongo import MongoStorage
+            _storage = MongoStorage()
+        elif settings.storage_backend == "memory":
+            from app.storage.memory import MemoryStorage
+            _storage = MemoryStorage()
+        else:
+            raise ValueError(f"Unknown storage backend: {settings.storage_backend}")
+        if settings.cart_hot_tier_enabled:
+            # Imported here because redis is only needed with the hot tier
+            from app.storage.hot_tier import TieredStorage
+            _storage = TieredStorage(_storage)
+    return _storage
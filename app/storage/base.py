@@ -0,0 +1,269 @@
+# app/storage/base.py
+
+from datetime import datetime
+from typing import (
+    Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Protocol, Tuple, TypedDict
+)
+from bson import ObjectId
+from app.schemas.product import ProductQuery
+
+ORDER_PENDING = "pending"
+ORDER_PROCESSED = "processed"
+
+class CheckoutConflictError(ValueError):
+    """Checkout cannot proceed: not enough stock, or the idempotency key is in use"""
+
+class InsufficientStockError(CheckoutConflictError):
+    """A product in the cart is missing or short; stock levels were left as they were"""
+
+    def __init__(self, product_ids: Iterable[str], missing: Iterable[str] = ()):
+        # Products the cart holds lines of that no longer exist
+        self.missing = sorted(missing)
+        if self.missing:
+            super().__init__(f"Products no longer exist: {', '.join(self.missing)}; remove them from the cart")
+        else:
+            super().__init__("Insufficient stock for one or more products")
+        # Products whose stock may have been touched and restored
+        self.product_ids = list(product_ids)
+
+class RefreshInProgressError(ValueError):
+    """Another worker is materializing the reports"""
+
+class DuplicateSkuError(ValueError):
+    """Another product already has the SKU"""
+
+    def __init__(self, sku: str):
+        super().__init__(f"A product with SKU {sku!r} already exists")
+        self.sku = sku
+
+class SkuUpsertResult(TypedDict):
+    """Outcome of upserting a batch of products by SKU"""
+    inserted: List[str]
+    updated: List[str]
+    unchanged: int
+    # Batch position -> reason, for products the database rejected
+    failed: Dict[int, str]
+
+def product_changed(current: dict, product: dict) -> bool:
+    """Whether storing product over current would change any of its fields"""
+    return any(current.get(field) != value for field, value in product.items())
+
+def order_lines(cart: dict) -> Dict[str, int]:
+    """Total quantity per product ID in a cart; lines with malformed IDs are left out"""
+    quantities: Dict[str, int] = {}
+    for item in cart.get("items", []):
+        if ObjectId.is_valid(item["product_id"]):
+            quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return quantities
+
+# Cart age bucket label for carts without updated_at
+UNKNOWN_AGE = "unknown"
+
+# Cart age buckets as (label, min_hours, max_hours); the last one has no upper bound
+AgeBuckets = List[Tuple[str, float, Optional[float]]]
+
+def age_buckets(bounds_hours: List[float]) -> AgeBuckets:
+    """Buckets between 0, the given ascending bounds in hours and no bound"""
+    buckets: AgeBuckets = []
+    lower = 0.0
+    for upper in bounds_hours:
+        buckets.append((f"{lower:g}h-{upper:g}h", lower, upper))
+        lower = upper
+    buckets.append((f"{lower:g}h+", lower, None))
+    return buckets
+
+def age_bucket(updated_at: Optional[datetime], now: datetime, buckets: AgeBuckets) -> str:
+    """Label of the bucket holding a cart last changed at updated_at"""
+    if updated_at is None:
+        return UNKNOWN_AGE
+    hours = (now - updated_at).total_seconds() / 3600
+    for label, _, upper in buckets:
+        if upper is None or hours < upper:
+            return label
+    return buckets[-1][0]
+
+# Prices a cart into an order document; called with the cart and the engine's session (or None)
+BuildOrder = Callable[[dict, Any], Awaitable[dict]]
+
+class ProductStore(Protocol):
+    async def get_many(self, product_ids: List[str], session: Any = None) -> Dict[str, dict]:
+        """Product documents with string IDs, keyed by ID; unknown IDs are left out"""
+
+    async def insert(self, product: dict) -> dict:
+        """Store a new product and return it with its string _id; raises DuplicateSkuError"""
+
+    async def upsert_by_sku(self, products: List[dict]) -> SkuUpsertResult:
+        """Insert or update products matched on their distinct SKUs.
+
+        Products whose fields already match are left alone; the others get
+        their version incremented. One failed product does not stop the rest.
+        """
+
+    async def page(self, limit: int, after: Optional[str], query: Optional[ProductQuery] = None) -> List[dict]:
+        """Products matching the query in its order, following the cursor.
+
+        The cursor is a product ID in ID order and an encode_cursor cursor
+        otherwise. Products hold at least the query's fields and sort field.
+        """
+
+    def stream(
+        self,
+        after: Optional[str],
+        limit: Optional[int],
+        query: Optional[ProductQuery] = None
+    ) -> AsyncIterator[dict]:
+        """Like page, as the products are read"""
+
+    async def delete(self, product_id: str, versions: Optional[List[int]] = None) -> bool:
+        """Delete a product; raises PreconditionFailedError if it exists at another version"""
+
+class CartStore(Protocol):
+    async def insert(self, cart: dict) -> dict:
+        """Store a new cart and return it with its _id"""
+
+    async def get(self, cart_id: str) -> Optional[dict]:
+        """A copy of the stored cart document"""
+
+    async def save(self, cart: dict) -> bool:
+        """Replace an existing cart with a newer version of it; False if it is gone or not older"""
+
+    async def get_version(self, cart_id: str) -> Optional[int]:
+        """The cart's version, without reading its items"""
+
+    async def get_by_user(self, user_id: str) -> Optional[dict]:
+        """A copy of the cart owned by the user"""
+
+    async def upsert_user_cart(self, user_id: str, ops: List[dict]) -> dict:
+        """Apply item operations (see apply_item_ops) to the user's cart and return it.
+
+        A user without a cart gets one in the same write. With no operations
+        an existing cart is returned unchanged.
+        """
+
+    async def page(self, limit: int, after: Optional[str]) -> List[dict]:
+        """Carts in ID order following the given ID"""
+
+    def stream(self, after: Optional[str], limit: Optional[int]) -> AsyncIterator[dict]:
+        """Carts in ID order following the given ID, as they are read"""
+
+    async def apply_item_ops(
+        self,
+        cart_id: str,
+        ops: List[dict],
+        versions: Optional[List[int]] = None,
+        version_increment: int = 1,
+        return_document: bool = True,
+        require_lines: bool = False,
+        bump_unchanged: bool = False
+    ) -> Optional[dict]:
+        """Atomically apply item operations and return the updated cart.
+
+        Each operation is a dict with "product_id", "op" ("add", "set" or
+        "remove"), "quantity" and an optional stored "line". "add" increments
+        the quantity of an existing line and "set" overwrites it; both insert
+        "line" when the cart has no line for the product yet. The version and
+        updated_at only move when the items change, or always with
+        bump_unchanged. With require_lines the cart is left alone, and None
+        returned, unless it has a line for every operation's product.
+        """
+
+    async def update_price_snapshots(
+        self,
+        cart_id: str,
+        expected_items: List[dict],
+        items: List[dict],
+        total_amount: float,
+        priced_at: float,
+        bump_version: bool
+    ) -> bool:
+        """Replace repriced items unless they changed concurrently; True if written"""
+
+    async def clear(self, cart_id: str, versions: Optional[List[int]] = None) -> Optional[dict]:
+        """Remove all items; returns the cart's _id and new version"""
+
+    async def delete(self, cart_id: str, versions: Optional[List[int]] = None) -> bool:
+        """Delete a cart; raises PreconditionFailedError if it exists at another version"""
+
+    async def bump_versions_with_products(self, product_ids: List[str]) -> None:
+        """Increment the version of every cart holding any of the products"""
+
+    async def remove_products(self, product_ids: List[str]) -> None:
+        """Remove the lines of the products from every cart holding them, incrementing the cart versions.
+
+        updated_at is left alone, so carts do not look recently used.
+        """
+
+    def watch(self) -> AsyncIterator[dict]:
+        """Cart changes as they happen, as {"cart_id", "operation", "version"} events.
+
+        operation is "insert", "update" or "delete"; version is None for
+        deletions. Changes that leave the version as it was are not reported.
+        """
+
+class OrderStore(Protocol):
+    async def insert_pending(self, order: dict) -> bool:
+        """Insert a pending order; False if its idempotency key is already taken"""
+
+    async def find_by_idempotency_key(self, idempotency_key: str) -> Optional[dict]:
+        """The order holding the idempotency key"""
+
+    async def delete_pending(self, order_id: Any) -> None:
+        """Drop a pending order so its idempotency key can be used again"""
+
+    async def top_products(self, limit: int, recent_orders: int) -> List[str]:
+        """IDs of the products in most of the latest processed orders, most frequent first"""
+
+class AnalyticsStore(Protocol):
+    """Reports over all stored carts, valued at current product prices.
+
+    Each report is computed on request, or read from its last materialized
+    copy with materialized=True.
+    """
+
+    async def cart_products(self, limit: Optional[int], sort: str, materialized: bool = False) -> List[dict]:
+        """Per product in carts: _id, name, price, carts holding it, units and value, sort field descending"""
+
+    async def cart_ages(self, buckets: AgeBuckets, materialized: bool = False) -> List[dict]:
+        """Per age bucket holding carts: _id (the label), carts, empty_carts, units and value"""
+
+    async def materialize(self, buckets: AgeBuckets) -> datetime:
+        """Compute and keep both reports for materialized reads; returns when they were computed.
+
+        Raises RefreshInProgressError while another worker is materializing
+        them. Materialized reads see one complete run, never a mix of two.
+        """
+
+    async def materialized_at(self) -> Optional[datetime]:
+        """When the reports were last materialized, if ever"""
+
+class Storage(Protocol):
+    carts: CartStore
+    products: ProductStore
+    orders: OrderStore
+    analytics: AnalyticsStore
+
+    async def connect(self) -> None:
+        """Open connections and prepare collections"""
+
+    async def close(self) -> None:
+        """Release connections"""
+
+    async def ping(self) -> float:
+        """Round-trip latency to the backend in milliseconds"""
+
+    async def dangling_product_ids(self) -> List[str]:
+        """Product IDs in cart lines that match no stored product"""
+
+    async def checkout(
+        self,
+        cart_id: str,
+        order_id: Any,
+        build_order: BuildOrder,
+        versions: Optional[List[int]] = None
+    ) -> Optional[dict]:
+        """Delete the cart, decrement stock for its lines and persist the priced order.
+
+        Returns None if the cart does not exist. Raises InsufficientStockError
+        when a product is short or no longer exists (listed in its missing
+        attribute), leaving the cart and stock as they were.
+        """
@@ -0,0 +1,556 @@
+# app/storage/hot_tier.py
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional
+import redis.asyncio as aioredis
+from app.core.config import settings
+from app.db.versioning import VERSION_FIELD, PreconditionFailedError
+from app.storage.base import BuildOrder, CartStore, Storage
+
+logger = logging.getLogger(__name__)
+
+# Hash fields of a hot cart; each line is stored as q:<product_id> (quantity),
+# o:<product_id> (position) and l:<product_id> (JSON of any other line fields).
+# Only complete copies loaded from the durable store carry _id.
+_ID = "_id"
+_QUANTITY = "q:"
+_POSITION = "o:"
+_LINE = "l:"
+_UPDATED_AT = "updated_at"
+_PRICED_AT = "priced_at"
+_USER_ID = "user_id"
+
+def redis_client() -> "aioredis.Redis":
+    """Client for settings.redis_url; "fakeredis://" gives an in-process stand-in"""
+    if settings.redis_url.startswith("fakeredis://"):
+        from fakeredis import FakeAsyncRedis
+        return FakeAsyncRedis(decode_responses=True)
+    return aioredis.from_url(settings.redis_url, decode_responses=True)
+
+def _line_fields(line: dict) -> Dict[str, Any]:
+    return {k: v for k, v in line.items() if k not in ("product_id", "quantity")}
+
+def _encode(cart: dict) -> Dict[str, Any]:
+    """Flatten a cart document into hash fields"""
+    fields: Dict[str, Any] = {_ID: str(cart["_id"]), VERSION_FIELD: cart.get(VERSION_FIELD, 0)}
+    updated_at = cart.get(_UPDATED_AT)
+    fields[_UPDATED_AT] = updated_at.timestamp() if updated_at else time.time()
+    if cart.get(_PRICED_AT) is not None:
+        fields[_PRICED_AT] = cart[_PRICED_AT]
+    if cart.get(_USER_ID) is not None:
+        fields[_USER_ID] = cart[_USER_ID]
+    quantities: Dict[str, int] = {}
+    for position, item in enumerate(cart.get("items", [])):
+        pid = item["product_id"]
+        # A hash holds one line per product, so duplicate lines are merged
+        quantities[pid] = quantities.get(pid, 0) + item["quantity"]
+        fields.setdefault(_POSITION + pid, position)
+        line = _line_fields(item)
+        if line:
+            fields[_LINE + pid] = json.dumps(line)
+    for pid, quantity in quantities.items():
+        fields[_QUANTITY + pid] = quantity
+    return fields
+
+def _decode(cart_id: str, fields: Dict[str, str]) -> Optional[dict]:
+    """Rebuild the cart document from hash fields; None unless the hash is a complete cart"""
+    if _ID not in fields:
+        return None
+    lines = []
+    for field, value in fields.items():
+        if field.startswith(_QUANTITY):
+            pid = field[len(_QUANTITY):]
+            line = {"product_id": pid, "quantity": int(value)}
+            if _LINE + pid in fields:
+                line.update(json.loads(fields[_LINE + pid]))
+            lines.append((int(fields.get(_POSITION + pid, 0)), line))
+    lines.sort(key=lambda entry: entry[0])
+    cart = {
+        "_id": cart_id,
+        "items": [line for _, line in lines],
+        VERSION_FIELD: int(fields[VERSION_FIELD]),
+        _UPDATED_AT: datetime.fromtimestamp(float(fields[_UPDATED_AT]), timezone.utc)
+    }
+    if _PRICED_AT in fields:
+        cart[_PRICED_AT] = float(fields[_PRICED_AT])
+    if _USER_ID in fields:
+        cart[_USER_ID] = fields[_USER_ID]
+    if settings.cart_price_snapshots:
+        cart["total_amount"] = sum(line.get("price", 0.0) * line["quantity"] for line in cart["items"])
+    return cart
+
+def _check_version(cart: dict, versions: Optional[List[int]]) -> None:
+    if versions is not None and cart[VERSION_FIELD] not in versions:
+        raise PreconditionFailedError("Document was modified; refetch it and retry")
+
+class _Retry(Exception):
+    """The hot copy disappeared during an update; load it again and retry"""
+
+class HotCartStore:
+    """Keeps active carts in Redis hashes in front of a durable cart store.
+
+    Carts are loaded on first access and expire after cart_hot_tier_ttl_seconds
+    without access. Changes mark the cart dirty; persist_dirty() copies dirty
+    carts to the durable store, guarded by version so an older copy never
+    replaces a newer one. Adding items is a single MULTI of HINCRBYs.
+    """
+
+    def __init__(self, cold: CartStore, client: "aioredis.Redis"):
+        self.cold = cold
+        self.client = client
+        self.loads = 0
+        self.persisted = 0
+        self.failures = 0
+
+    def _key(self, cart_id: str) -> str:
+        return f"{settings.redis_key_prefix}cart:{cart_id}"
+
+    @property
+    def _dirty_key(self) -> str:
+        return f"{settings.redis_key_prefix}carts:dirty"
+
+    def _taken_key(self, cart_id: str) -> str:
+        return f"{settings.redis_key_prefix}taken:{cart_id}"
+
+    def _product_key(self, product_id: str) -> str:
+        return f"{settings.redis_key_prefix}product:{product_id}"
+
+    def _index(self, pipe, cart_id: str, product_ids: Iterable[str]) -> None:
+        """Queue listing the cart under its products, for as long as the cart itself lives"""
+        for product_id in product_ids:
+            pipe.sadd(self._product_key(product_id), cart_id)
+            pipe.expire(self._product_key(product_id), settings.cart_hot_tier_ttl_seconds)
+
+    def _unindex(self, pipe, cart_id: str, product_ids: Iterable[str]) -> None:
+        for product_id in product_ids:
+            pipe.srem(self._product_key(product_id), cart_id)
+
+    def _touch(self, pipe, cart_id: str, product_ids: Iterable[str]) -> None:
+        """Queue the bookkeeping of a change: updated_at, fresh TTLs and the dirty mark.
+
+        product_ids are all the products the cart holds after the change, so
+        their sets live as long as the cart.
+        """
+        pipe.hset(self._key(cart_id), _UPDATED_AT, time.time())
+        pipe.expire(self._key(cart_id), settings.cart_hot_tier_ttl_seconds)
+        self._index(pipe, cart_id, product_ids)
+        pipe.sadd(self._dirty_key, cart_id)
+
+    async def _store(self, cart: dict) -> None:
+        """Write a cart loaded from the durable store unless a complete hot copy exists or it was taken"""
+        key = self._key(str(cart["_id"]))
+        taken_key = self._taken_key(str(cart["_id"]))
+
+        async def load(pipe) -> None:
+            if await pipe.hexists(key, _ID) or await pipe.exists(taken_key):
+                return
+            pipe.multi()
+            pipe.delete(key)
+            pipe.hset(key, mapping=_encode(cart))
+            pipe.expire(key, settings.cart_hot_tier_ttl_seconds)
+            self._index(pipe, str(cart["_id"]), {item["product_id"] for item in cart.get("items", [])})
+
+        await self.client.transaction(load, key, taken_key)
+
+    async def _hot(self, cart_id: str) -> Optional[dict]:
+        """The hot copy of a cart, loading it from the durable store on a miss"""
+        cart = _decode(cart_id, await self.client.hgetall(self._key(cart_id)))
+        if cart is not None:
+            return cart
+        cart = await self.cold.get(cart_id)
+        if cart is None:
+            return None
+        self.loads += 1
+        await self._store(cart)
+        return _decode(cart_id, await self.client.hgetall(self._key(cart_id)))
+
+    async def _update(self, cart_id: str, update) -> Any:
+        """Run update(pipe, cart) in a WATCH transaction on the hot copy"""
+        key = self._key(cart_id)
+        for _ in range(3):
+            if await self._hot(cart_id) is None:
+                return None
+
+            async def run(pipe) -> Any:
+                cart = _decode(cart_id, await pipe.hgetall(key))
+                if cart is None:
+                    raise _Retry()
+                pipe.multi()
+                return update(pipe, cart)
+
+            try:
+                return await self.client.transaction(run, key, value_from_callable=True)
+            except _Retry:
+                continue
+        raise RuntimeError(f"Cart {cart_id} keeps expiring from the hot tier")
+
+    async def insert(self, cart: dict) -> dict:
+        cart = await self.cold.insert(cart)
+        # New carts are about to be used
+        await self._store(cart)
+        return cart
+
+    async def get(self, cart_id: str) -> Optional[dict]:
+        return await self._hot(cart_id)
+
+    async def save(self, cart: dict) -> bool:
+        return await self.cold.save(cart)
+
+    async def get_version(self, cart_id: str) -> Optional[int]:
+        loaded, version = await self.client.hmget(self._key(cart_id), _ID, VERSION_FIELD)
+        if loaded is not None:
+            return int(version)
+        return await self.cold.get_version(cart_id)
+
+    async def get_by_user(self, user_id: str) -> Optional[dict]:
+        cart = await self.cold.get_by_user(user_id)
+        if cart is None:
+            return None
+        # The owner is about to use it, so serve and keep the hot copy
+        return await self._hot(str(cart["_id"]))
+
+    async def upsert_user_cart(self, user_id: str, ops: List[dict]) -> dict:
+        cart = await self.cold.get_by_user(user_id)
+        if cart is not None:
+            cart_id = str(cart["_id"])
+            hot = await self.apply_item_ops(cart_id, ops) if ops else await self._hot(cart_id)
+            if hot is not None:
+                return hot
+        # The durable store creates the cart, so two workers cannot both create one
+        cart = await self.cold.upsert_user_cart(user_id, ops)
+        await self._store(cart)
+        return cart
+
+    async def _overlay(self, carts: List[dict]) -> List[dict]:
+        """Replace durable copies with hot ones, which may hold unpersisted changes"""
+        if not carts:
+            return carts
+        async with self.client.pipeline(transaction=False) as pipe:
+            for cart in carts:
+                pipe.hgetall(self._key(str(cart["_id"])))
+            hot = await pipe.execute()
+        return [_decode(str(cart["_id"]), fields) or cart for cart, fields in zip(carts, hot)]
+
+    async def page(self, limit: int, after: Optional[str]) -> List[dict]:
+        return await self._overlay(await self.cold.page(limit, after))
+
+    async def stream(self, after: Optional[str], limit: Optional[int]) -> AsyncIterator[dict]:
+        batch = []
+        async for cart in self.cold.stream(after, limit):
+            batch.append(cart)
+            if len(batch) >= settings.cursor_batch_size:
+                for hot_cart in await self._overlay(batch):
+                    yield hot_cart
+                batch = []
+        for hot_cart in await self._overlay(batch):
+            yield hot_cart
+
+    async def _add_items(
+        self,
+        cart_id: str,
+        ops: List[dict],
+        version_increment: int,
+        return_document: bool
+    ) -> Optional[dict]:
+        """Apply "add" operations in one MULTI without watching the cart"""
+        key = self._key(cart_id)
+        for _ in range(3):
+            cart = await self._hot(cart_id)
+            if cart is None:
+                return None
+            product_ids = {item["product_id"] for item in cart["items"]} | {op["product_id"] for op in ops}
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.hexists(key, _ID)
+                for op in ops:
+                    pid = op["product_id"]
+                    pipe.hincrby(key, _QUANTITY + pid, op["quantity"])
+                    pipe.hsetnx(key, _POSITION + pid, time.time_ns())
+                    line = _line_fields(op.get("line") or {})
+                    if line:
+                        pipe.hset(key, _LINE + pid, json.dumps(line))
+                pipe.hincrby(key, VERSION_FIELD, version_increment)
+                self._touch(pipe, cart_id, product_ids)
+                pipe.hgetall(key)
+                results = await pipe.execute()
+            if results[0]:
+                return _decode(cart_id, results[-1]) if return_document else None
+            # The cart expired after it was loaded, leaving a partial hash; drop it and reload
+            await self.client.delete(key)
+        raise RuntimeError(f"Cart {cart_id} keeps expiring from the hot tier")
+
+    async def apply_item_ops(
+        self,
+        cart_id: str,
+        ops: List[dict],
+        versions: Optional[List[int]] = None,
+        version_increment: int = 1,
+        return_document: bool = True,
+        require_lines: bool = False,
+        bump_unchanged: bool = False
+    ) -> Optional[dict]:
+        if versions is None and not require_lines and all(op["op"] == "add" for op in ops):
+            return await self._add_items(cart_id, ops, version_increment, return_document)
+
+        def update(pipe, cart: dict) -> Optional[dict]:
+            _check_version(cart, versions)
+            key = self._key(cart_id)
+            present = {item["product_id"]: item for item in cart["items"]}
+            if require_lines and any(op["product_id"] not in present for op in ops):
+                return None
+            changed = False
+            product_ids = set(present)
+            for op in ops:
+                pid = op["product_id"]
+                current = present.get(pid)
+                if op["op"] == "remove":
+                    if current is not None:
+                        pipe.hdel(key, _QUANTITY + pid, _POSITION + pid, _LINE + pid)
+                        self._unindex(pipe, cart_id, [pid])
+                        product_ids.discard(pid)
+                        changed = True
+                    continue
+                if current is None and not op.get("line"):
+                    # Like the durable stores, a missing line is only set when the operation carries one
+                    continue
+                line = _line_fields(op.get("line") or {})
+                quantity = current["quantity"] + op["quantity"] if current and op["op"] == "add" else op["quantity"]
+                if current is not None and current["quantity"] == quantity and all(
+                    current.get(field) == value for field, value in line.items()
+                ):
+                    continue
+                changed = True
+                if op["op"] == "add":
+                    pipe.hincrby(key, _QUANTITY + pid, op["quantity"])
+                else:
+                    pipe.hset(key, _QUANTITY + pid, op["quantity"])
+                pipe.hsetnx(key, _POSITION + pid, time.time_ns())
+                if line:
+                    pipe.hset(key, _LINE + pid, json.dumps(line))
+                product_ids.add(pid)
+            if changed or bump_unchanged:
+                # Like the durable stores, operations that change nothing leave the version alone
+                pipe.hincrby(key, VERSION_FIELD, version_increment)
+                self._touch(pipe, cart_id, product_ids)
+            return cart
+
+        if await self._update(cart_id, update) is None:
+            return None
+        if return_document:
+            return await self._hot(cart_id)
+        return None
+
+    async def update_price_snapshots(
+        self,
+        cart_id: str,
+        expected_items: List[dict],
+        items: List[dict],
+        total_amount: float,
+        priced_at: float,
+        bump_version: bool
+    ) -> bool:
+        def update(pipe, cart: dict) -> bool:
+            if cart["items"] != expected_items:
+                return False
+            key = self._key(cart_id)
+            for item in items:
+                pipe.hset(key, _LINE + item["product_id"], json.dumps(_line_fields(item)))
+            pipe.hset(key, _PRICED_AT, priced_at)
+            if bump_version:
+                pipe.hincrby(key, VERSION_FIELD, 1)
+            self._touch(pipe, cart_id, {item["product_id"] for item in cart["items"]})
+            return True
+
+        return bool(await self._update(cart_id, update))
+
+    async def clear(self, cart_id: str, versions: Optional[List[int]] = None) -> Optional[dict]:
+        def update(pipe, cart: dict) -> dict:
+            _check_version(cart, versions)
+            key = self._key(cart_id)
+            fields = [prefix + item["product_id"] for item in cart["items"] for prefix in (_QUANTITY, _POSITION, _LINE)]
+            if fields:
+                pipe.hdel(key, *fields)
+            self._unindex(pipe, cart_id, {item["product_id"] for item in cart["items"]})
+            pipe.hincrby(key, VERSION_FIELD, 1)
+            self._touch(pipe, cart_id, [])
+            return {"_id": cart_id, VERSION_FIELD: cart[VERSION_FIELD] + 1}
+
+        return await self._update(cart_id, update)
+
+    async def take(self, cart_id: str) -> Optional[dict]:
+        """Remove the hot copy and return it, e.g. before the durable store processes the cart.
+
+        For cart_hot_tier_take_hold_seconds, or until release(), the cart is
+        not loaded again, so a change arriving meanwhile cannot bring back a
+        cart that the durable store is about to check out or has deleted.
+        """
+        key = self._key(cart_id)
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key)
+            pipe.srem(self._dirty_key, cart_id)
+            pipe.set(self._taken_key(cart_id), 1, ex=settings.cart_hot_tier_take_hold_seconds)
+            fields, _, _, _ = await pipe.execute()
+        product_ids = [field[len(_QUANTITY):] for field in fields if field.startswith(_QUANTITY)]
+        if product_ids:
+            async with self.client.pipeline(transaction=False) as pipe:
+                self._unindex(pipe, cart_id, product_ids)
+                await pipe.execute()
+        return _decode(cart_id, fields)
+
+    async def release(self, cart_id: str) -> None:
+        """Let a taken cart that the durable store kept be loaded again"""
+        await self.client.delete(self._taken_key(cart_id))
+
+    async def delete(self, cart_id: str, versions: Optional[List[int]] = None) -> bool:
+        if versions is not None:
+            cart = _decode(cart_id, await self.client.hgetall(self._key(cart_id)))
+            if cart is not None:
+                _check_version(cart, versions)
+                versions = None
+        # Delete durably first so a concurrent persist cannot bring the cart back
+        deleted = await self.cold.delete(cart_id, versions)
+        hot = await self.take(cart_id)
+        return deleted or hot is not None
+
+    async def bump_versions_with_products(self, product_ids: List[str]) -> None:
+        await self.cold.bump_versions_with_products(product_ids)
+        for product_id in product_ids:
+            await self._bump_versions_with_product(product_id)
+
+    async def _bump_versions_with_product(self, product_id: str) -> None:
+        product_key = self._product_key(product_id)
+        for cart_id in await self.client.smembers(product_key):
+            key = self._key(cart_id)
+
+            async def bump(pipe) -> None:
+                if not await pipe.hexists(key, _ID) or not await pipe.hexists(key, _QUANTITY + product_id):
+                    pipe.multi()
+                    pipe.srem(product_key, cart_id)
+                    return
+                pipe.multi()
+                pipe.hincrby(key, VERSION_FIELD, 1)
+                pipe.sadd(self._dirty_key, cart_id)
+
+            await self.client.transaction(bump, key)
+
+    async def remove_products(self, product_ids: List[str]) -> None:
+        await self.cold.remove_products(product_ids)
+        for product_id in product_ids:
+            product_key = self._product_key(product_id)
+            for cart_id in await self.client.smembers(product_key):
+                key = self._key(cart_id)
+
+                async def remove(pipe) -> None:
+                    present = await pipe.hexists(key, _ID) and await pipe.hexists(key, _QUANTITY + product_id)
+                    pipe.multi()
+                    if present:
+                        pipe.hdel(key, _QUANTITY + product_id, _POSITION + product_id, _LINE + product_id)
+                        pipe.hincrby(key, VERSION_FIELD, 1)
+                        pipe.sadd(self._dirty_key, cart_id)
+                    pipe.srem(product_key, cart_id)
+
+                await self.client.transaction(remove, key)
+
+    def watch(self) -> AsyncIterator[dict]:
+        # Changes reach the durable store, and so its watchers, when they are persisted
+        return self.cold.watch()
+
+    async def persist_dirty(self, batch_size: int = 500) -> int:
+        """Copy dirty carts to the durable store; returns how many were written"""
+        written = 0
+        while True:
+            cart_ids = await self.client.spop(self._dirty_key, batch_size)
+            if not cart_ids:
+                return written
+            try:
+                async with self.client.pipeline(transaction=False) as pipe:
+                    for cart_id in cart_ids:
+                        pipe.hgetall(self._key(cart_id))
+                    hot = await pipe.execute()
+                for cart_id, fields in zip(cart_ids, hot):
+                    cart = _decode(cart_id, fields)
+                    if cart is not None and await self.cold.save(cart):
+                        written += 1
+                        self.persisted += 1
+            except Exception:
+                self.failures += 1
+                # Try again on the next round; saving a cart twice is harmless
+                await self.client.sadd(self._dirty_key, *cart_ids)
+                raise
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "loads": self.loads,
+            "persisted": self.persisted,
+            "persist_failures": self.failures,
+            "ttl_seconds": settings.cart_hot_tier_ttl_seconds,
+        }
+
+class TieredStorage:
+    """A storage engine whose carts are served from the Redis hot tier"""
+
+    def __init__(self, cold: Storage, client: Optional["aioredis.Redis"] = None):
+        self.cold = cold
+        self.carts = HotCartStore(cold.carts, client or redis_client())
+        self.products = cold.products
+        self.orders = cold.orders
+        # Reports cover carts as last persisted from the hot tier
+        self.analytics = cold.analytics
+        self._persister: Optional[asyncio.Task] = None
+
+    async def _persist_forever(self) -> None:
+        while True:
+            await asyncio.sleep(settings.cart_hot_tier_persist_interval_seconds)
+            try:
+                await self.carts.persist_dirty()
+            except Exception:
+                logger.exception("Failed to persist hot carts")
+
+    async def connect(self) -> None:
+        await self.cold.connect()
+        await self.carts.client.ping()
+        self._persister = asyncio.create_task(self._persist_forever())
+
+    async def close(self) -> None:
+        if self._persister is not None:
+            self._persister.cancel()
+            await asyncio.gather(self._persister, return_exceptions=True)
+            self._persister = None
+        await self.carts.persist_dirty()
+        await self.carts.client.aclose()
+        await self.cold.close()
+
+    async def dangling_product_ids(self) -> List[str]:
+        # Hot carts reach the durable store within a persist interval
+        return await self.cold.dangling_product_ids()
+
+    async def ping(self) -> float:
+        started = time.perf_counter()
+        await self.carts.client.ping()
+        redis_ms = (time.perf_counter() - started) * 1000
+        return max(redis_ms, await self.cold.ping())
+
+    async def checkout(
+        self,
+        cart_id: str,
+        order_id: Any,
+        build_order: BuildOrder,
+        versions: Optional[List[int]] = None
+    ) -> Optional[dict]:
+        # Hand the latest state to the durable store, which checks out atomically
+        cart = await self.carts.take(cart_id)
+        try:
+            if cart is not None:
+                await self.cold.carts.save(cart)
+            order = await self.cold.checkout(cart_id, order_id, build_order, versions)
+        except BaseException:
+            # The durable store kept the cart, e.g. for a shortage, so it may be served again
+            await self.carts.release(cart_id)
+            raise
+        if order is None:
+            await self.carts.release(cart_id)
+        return order
@@ -0,0 +1,671 @@
+# app/storage/memory.py
+
+import asyncio
+import bisect
+import re
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from bson import ObjectId
+from app.core.config import settings
+from app.db.pagination import check_cursor, decode_cursor
+from app.db.versioning import PreconditionFailedError
+from app.schemas.product import ProductQuery
+from app.storage.base import (
+    ORDER_PENDING, ORDER_PROCESSED, AgeBuckets, BuildOrder, DuplicateSkuError, InsufficientStockError, SkuUpsertResult,
+    age_bucket, order_lines, product_changed
+)
+
+# Optional snapshot fields stored on cart lines in price snapshot mode
+_LINE_SNAPSHOT_FIELDS = ("product_name", "price", "priced_at")
+
+def _version_matches(version: int, versions: Optional[List[int]]) -> bool:
+    return versions is None or version in versions
+
+class _ProductRecord:
+    __slots__ = ("id", "sku", "name", "description", "price", "in_stock", "version")
+
+    def __init__(
+        self,
+        id: str,
+        sku: Optional[str],
+        name: str,
+        description: Optional[str],
+        price: float,
+        in_stock: int,
+        version: int
+    ):
+        self.id = id
+        self.sku = sku
+        self.name = name
+        self.description = description
+        self.price = price
+        self.in_stock = in_stock
+        self.version = version
+
+    def to_dict(self) -> dict:
+        return {
+            "_id": self.id,
+            "sku": self.sku,
+            "name": self.name,
+            "description": self.description,
+            "price": self.price,
+            "in_stock": self.in_stock,
+            "version": self.version
+        }
+
+class _CartLine:
+    __slots__ = ("product_id", "quantity", "product_name", "price", "priced_at")
+
+    def __init__(self, line: dict):
+        self.product_id = line["product_id"]
+        self.quantity = line["quantity"]
+        self.product_name = line.get("product_name")
+        self.price = line.get("price")
+        self.priced_at = line.get("priced_at")
+
+    def update(self, line: dict) -> None:
+        for field in _LINE_SNAPSHOT_FIELDS:
+            if field in line:
+                setattr(self, field, line[field])
+
+    def to_dict(self) -> dict:
+        line = {"product_id": self.product_id, "quantity": self.quantity}
+        for field in _LINE_SNAPSHOT_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                line[field] = value
+        return line
+
+class _CartRecord:
+    __slots__ = ("id", "user_id", "items", "version", "updated_at", "total_amount", "priced_at")
+
+    def __init__(self, cart: dict):
+        self.id = cart["_id"]
+        self.user_id = cart.get("user_id")
+        self.items = [_CartLine(item) for item in cart.get("items", [])]
+        self.version = cart.get("version", 0)
+        self.updated_at = cart.get("updated_at")
+        self.total_amount = cart.get("total_amount")
+        self.priced_at = cart.get("priced_at")
+
+    def product_ids(self) -> Set[str]:
+        return {line.product_id for line in self.items}
+
+    def to_dict(self) -> dict:
+        cart = {
+            "_id": self.id,
+            "items": [line.to_dict() for line in self.items],
+            "version": self.version,
+            "updated_at": self.updated_at
+        }
+        if self.user_id is not None:
+            cart["user_id"] = self.user_id
+        if self.total_amount is not None:
+            cart["total_amount"] = self.total_amount
+        if self.priced_at is not None:
+            cart["priced_at"] = self.priced_at
+        return cart
+
+class _OrderedIds:
+    """Sorted document IDs for keyset pagination; ObjectId hex strings sort like ObjectIds"""
+
+    def __init__(self):
+        self._ids: List[str] = []
+
+    def add(self, document_id: str) -> None:
+        if not self._ids or document_id > self._ids[-1]:
+            self._ids.append(document_id)
+        else:
+            bisect.insort(self._ids, document_id)
+
+    def remove(self, document_id: str) -> None:
+        index = bisect.bisect_left(self._ids, document_id)
+        if index < len(self._ids) and self._ids[index] == document_id:
+            del self._ids[index]
+
+    def after(self, after: Optional[str], limit: Optional[int]) -> List[str]:
+        start = bisect.bisect_right(self._ids, after) if after is not None else 0
+        end = start + limit if limit else len(self._ids)
+        return self._ids[start:end]
+
+_WORD = re.compile(r"\w+")
+
+def _words(text: Optional[str]) -> Set[str]:
+    return set(_WORD.findall(text.casefold())) if text else set()
+
+def _product_matches(record: _ProductRecord, query: ProductQuery) -> bool:
+    # Like a MongoDB text search without stemming: any of the words, ignoring case
+    if query.q and not _words(query.q) & (_words(record.name) | _words(record.description)):
+        return False
+    if query.name_prefix and not record.name.casefold().startswith(query.name_prefix.casefold()):
+        return False
+    if query.min_price is not None and record.price < query.min_price:
+        return False
+    if query.max_price is not None and record.price > query.max_price:
+        return False
+    return not (query.in_stock_only and record.in_stock <= 0)
+
+def _sort_key(value: Any, product_id: str) -> Tuple[Any, str]:
+    # Names compare case-insensitively, like the collated name index
+    return (value.casefold() if isinstance(value, str) else value, product_id)
+
+class MemoryProductStore:
+    def __init__(self):
+        self.records: Dict[str, _ProductRecord] = {}
+        self.ids = _OrderedIds()
+        # Product ID per SKU, like the unique sku index
+        self.by_sku: Dict[str, str] = {}
+
+    async def get_many(self, product_ids: List[str], session: Any = None) -> Dict[str, dict]:
+        products = {}
+        for pid in product_ids:
+            record = self.records.get(pid)
+            if record is not None:
+                products[pid] = record.to_dict()
+        return products
+
+    async def insert(self, product: dict) -> dict:
+        sku = product.get("sku")
+        if sku is not None and sku in self.by_sku:
+            raise DuplicateSkuError(sku)
+        product_id = str(ObjectId())
+        self.records[product_id] = _ProductRecord(
+            product_id,
+            sku,
+            product["name"],
+            product.get("description"),
+            product["price"],
+            product["in_stock"],
+            product.get("version", 0)
+        )
+        self.ids.add(product_id)
+        if sku is not None:
+            self.by_sku[sku] = product_id
+        product["_id"] = product_id
+        return product
+
+    async def upsert_by_sku(self, products: List[dict]) -> SkuUpsertResult:
+        result: SkuUpsertResult = {"inserted": [], "updated": [], "unchanged": 0, "failed": {}}
+        for product in products:
+            product_id = self.by_sku.get(product["sku"])
+            if product_id is None:
+                inserted = await self.insert({**product, "version": 1})
+                result["inserted"].append(inserted["_id"])
+                continue
+            record = self.records[product_id]
+            if not product_changed(record.to_dict(), product):
+                result["unchanged"] += 1
+                continue
+            for field, value in product.items():
+                setattr(record, field, value)
+            record.version += 1
+            result["updated"].append(product_id)
+        return result
+
+    def _matching(self, after: Optional[str], limit: Optional[int], query: Optional[ProductQuery]) -> List[str]:
+        """IDs of the products a listing returns, in its order"""
+        if query is None or (query.sort == "id" and not query.filtered):
+            check_cursor(after)
+            return self.ids.after(after, limit)
+        field = query.sort_field
+        if field == "_id":
+            check_cursor(after)
+            start = (after, after) if after is not None else None
+        else:
+            start = _sort_key(*decode_cursor(after)) if after is not None else None
+        keyed = []
+        for record in self.records.values():
+            if not _product_matches(record, query):
+                continue
+            key = _sort_key(record.id if field == "_id" else getattr(record, field), record.id)
+            if start is None or (key < start if query.descending else key > start):
+                keyed.append((key, record.id))
+        keyed.sort(reverse=query.descending)
+        product_ids = [pid for _, pid in keyed]
+        return product_ids[:limit] if limit else product_ids
+
+    async def page(self, limit: int, after: Optional[str], query: Optional[ProductQuery] = None) -> List[dict]:
+        return [self.records[pid].to_dict() for pid in self._matching(after, limit, query)]
+
+    async def stream(
+        self,
+        after: Optional[str],
+        limit: Optional[int],
+        query: Optional[ProductQuery] = None
+    ) -> AsyncIterator[dict]:
+        for pid in self._matching(after, limit, query):
+            record = self.records.get(pid)
+            if record is not None:
+                yield record.to_dict()
+
+    async def delete(self, product_id: str, versions: Optional[List[int]] = None) -> bool:
+        record = self.records.get(product_id)
+        if record is None:
+            return False
+        if not _version_matches(record.version, versions):
+            raise PreconditionFailedError("Document was modified; refetch it and retry")
+        del self.records[product_id]
+        self.ids.remove(product_id)
+        if record.sku is not None:
+            del self.by_sku[record.sku]
+        return True
+
+class _CartLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # Holders and waiters; the lock is dropped when the last one leaves
+        self.users = 0
+
+class MemoryCartStore:
+    def __init__(self):
+        self.records: Dict[str, _CartRecord] = {}
+        self.ids = _OrderedIds()
+        # Cart IDs per product ID, like the items.product_id index
+        self.by_product: Dict[str, Set[str]] = defaultdict(set)
+        # Cart ID per owning user, like the unique user_id index
+        self.by_user: Dict[str, str] = {}
+        self._locks: Dict[str, _CartLock] = {}
+        self._watchers: Set["asyncio.Queue[dict]"] = set()
+
+    def _publish(self, cart_id: str, operation: str, version: Optional[int]) -> None:
+        event = {"cart_id": cart_id, "operation": operation, "version": version}
+        for queue in self._watchers:
+            queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def lock(self, cart_id: str) -> AsyncIterator[None]:
+        """Hold the lock serializing changes to one cart; it only exists while in use"""
+        entry = self._locks.get(cart_id)
+        if entry is None:
+            entry = self._locks[cart_id] = _CartLock()
+        entry.users += 1
+        try:
+            async with entry.lock:
+                yield
+        finally:
+            entry.users -= 1
+            if not entry.users:
+                del self._locks[cart_id]
+
+    def _index(self, record: _CartRecord, previous: Set[str]) -> None:
+        current = record.product_ids()
+        for pid in previous - current:
+            carts = self.by_product.get(pid)
+            if carts is not None:
+                carts.discard(record.id)
+                if not carts:
+                    del self.by_product[pid]
+        for pid in current - previous:
+            self.by_product[pid].add(record.id)
+
+    def check_version(self, cart_id: str, versions: Optional[List[int]]) -> Optional[_CartRecord]:
+        record = self.records.get(cart_id)
+        if record is not None and not _version_matches(record.version, versions):
+            raise PreconditionFailedError("Document was modified; refetch it and retry")
+        return record
+
+    def put(self, cart: dict) -> None:
+        """Store a cart document under its existing _id"""
+        record = _CartRecord(cart)
+        self.records[record.id] = record
+        self.ids.add(record.id)
+        if record.user_id is not None:
+            self.by_user[record.user_id] = record.id
+        self._index(record, set())
+        self._publish(record.id, "insert", record.version)
+
+    def pop(self, cart_id: str) -> Optional[dict]:
+        """Remove a cart and return its document"""
+        record = self.records.pop(cart_id, None)
+        if record is None:
+            return None
+        self.ids.remove(cart_id)
+        if record.user_id is not None:
+            self.by_user.pop(record.user_id, None)
+        for pid in record.product_ids():
+            carts = self.by_product.get(pid)
+            if carts is not None:
+                carts.discard(cart_id)
+                if not carts:
+                    del self.by_product[pid]
+        self._publish(cart_id, "delete", None)
+        return record.to_dict()
+
+    async def insert(self, cart: dict) -> dict:
+        cart["_id"] = str(ObjectId())
+        self.put(cart)
+        return cart
+
+    async def get(self, cart_id: str) -> Optional[dict]:
+        record = self.records.get(cart_id)
+        return record.to_dict() if record is not None else None
+
+    async def save(self, cart: dict) -> bool:
+        async with self.lock(cart["_id"]):
+            record = self.records.get(cart["_id"])
+            if record is None or record.version >= cart["version"]:
+                return False
+            previous = record.product_ids()
+            saved = _CartRecord(cart)
+            self.records[saved.id] = saved
+            self._index(saved, previous)
+            self._publish(saved.id, "update", saved.version)
+            return True
+
+    async def get_version(self, cart_id: str) -> Optional[int]:
+        record = self.records.get(cart_id)
+        return record.version if record is not None else None
+
+    async def get_by_user(self, user_id: str) -> Optional[dict]:
+        cart_id = self.by_user.get(user_id)
+        return await self.get(cart_id) if cart_id is not None else None
+
+    async def upsert_user_cart(self, user_id: str, ops: List[dict]) -> dict:
+        while True:
+            cart_id = self.by_user.get(user_id)
+            if cart_id is None:
+                cart_id = str(ObjectId())
+                new_cart = {
+                    "_id": cart_id,
+                    "user_id": user_id,
+                    "items": [],
+                    # Applying the operations below brings a new cart to version 1
+                    "version": 0 if ops else 1,
+                    "updated_at": datetime.now(timezone.utc)
+                }
+                if settings.cart_price_snapshots:
+                    new_cart["total_amount"] = 0.0
+                self.put(new_cart)
+            if not ops:
+                return self.records[cart_id].to_dict()
+            cart = await self.apply_item_ops(cart_id, ops)
+            # None if the cart was checked out or deleted while waiting for its lock
+            if cart is not None:
+                return cart
+
+    async def page(self, limit: int, after: Optional[str]) -> List[dict]:
+        check_cursor(after)
+        return [self.records[cid].to_dict() for cid in self.ids.after(after, limit)]
+
+    async def stream(self, after: Optional[str], limit: Optional[int]) -> AsyncIterator[dict]:
+        check_cursor(after)
+        for cid in self.ids.after(after, limit):
+            record = self.records.get(cid)
+            if record is not None:
+                yield record.to_dict()
+
+    async def apply_item_ops(
+        self,
+        cart_id: str,
+        ops: List[dict],
+        versions: Optional[List[int]] = None,
+        version_increment: int = 1,
+        return_document: bool = True,
+        require_lines: bool = False,
+        bump_unchanged: bool = False
+    ) -> Optional[dict]:
+        async with self.lock(cart_id):
+            record = self.check_version(cart_id, versions)
+            if record is None:
+                return None
+            previous = record.product_ids()
+            if require_lines and any(op["product_id"] not in previous for op in ops):
+                return None
+            previous_items = [line.to_dict() for line in record.items]
+
+            removed = {op["product_id"] for op in ops if op["op"] == "remove"}
+            lines = [line for line in record.items if line.product_id not in removed]
+            changes = {op["product_id"]: op for op in ops if op["op"] != "remove"}
+            for line in lines:
+                op = changes.get(line.product_id)
+                if op is None:
+                    continue
+                if op.get("line"):
+                    line.update(op["line"])
+                line.quantity = line.quantity + op["quantity"] if op["op"] == "add" else op["quantity"]
+            present = {line.product_id for line in lines}
+            for op in changes.values():
+                if op.get("line") and op["product_id"] not in present:
+                    lines.append(_CartLine(op["line"]))
+
+            record.items = lines
+            if bump_unchanged or [line.to_dict() for line in lines] != previous_items:
+                record.updated_at = datetime.now(timezone.utc)
+                record.version += version_increment
+                if settings.cart_price_snapshots:
+                    record.total_amount = sum((line.price or 0.0) * line.quantity for line in lines)
+                self._index(record, previous)
+                self._publish(cart_id, "update", record.version)
+            return record.to_dict() if return_document else None
+
+    async def update_price_snapshots(
+        self,
+        cart_id: str,
+        expected_items: List[dict],
+        items: List[dict],
+        total_amount: float,
+        priced_at: float,
+        bump_version: bool
+    ) -> bool:
+        record = self.records.get(cart_id)
+        if record is None or [line.to_dict() for line in record.items] != expected_items:
+            return False
+        record.items = [_CartLine(item) for item in items]
+        record.total_amount = total_amount
+        record.priced_at = priced_at
+        if bump_version:
+            record.version += 1
+            self._publish(cart_id, "update", record.version)
+        return True
+
+    async def clear(self, cart_id: str, versions: Optional[List[int]] = None) -> Optional[dict]:
+        async with self.lock(cart_id):
+            record = self.check_version(cart_id, versions)
+            if record is None:
+                return None
+            previous = record.product_ids()
+            record.items = []
+            record.updated_at = datetime.now(timezone.utc)
+            record.version += 1
+            if settings.cart_price_snapshots:
+                record.total_amount = 0.0
+            self._index(record, previous)
+            self._publish(cart_id, "update", record.version)
+            return {"_id": record.id, "version": record.version}
+
+    async def delete(self, cart_id: str, versions: Optional[List[int]] = None) -> bool:
+        async with self.lock(cart_id):
+            if self.check_version(cart_id, versions) is None:
+                return False
+            self.pop(cart_id)
+            return True
+
+    async def remove_products(self, product_ids: List[str]) -> None:
+        removed = set(product_ids)
+        for cart_id in set().union(*(self.by_product.get(pid, ()) for pid in product_ids)):
+            async with self.lock(cart_id):
+                record = self.records.get(cart_id)
+                if record is None:
+                    continue
+                previous = record.product_ids()
+                record.items = [line for line in record.items if line.product_id not in removed]
+                if record.total_amount is not None:
+                    record.total_amount = sum((line.price or 0.0) * line.quantity for line in record.items)
+                record.version += 1
+                self._index(record, previous)
+                self._publish(cart_id, "update", record.version)
+
+    async def bump_versions_with_products(self, product_ids: List[str]) -> None:
+        cart_ids = set()
+        for product_id in product_ids:
+            cart_ids.update(self.by_product.get(product_id, ()))
+        for cart_id in cart_ids:
+            self.records[cart_id].version += 1
+            self._publish(cart_id, "update", self.records[cart_id].version)
+
+    async def watch(self) -> AsyncIterator[dict]:
+        # Changes are published as they are made, without a change log
+        queue: "asyncio.Queue[dict]" = asyncio.Queue()
+        self._watchers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._watchers.discard(queue)
+
+class MemoryOrderStore:
+    def __init__(self):
+        self.records: Dict[Any, dict] = {}
+        self.by_idempotency_key: Dict[str, Any] = {}
+
+    def put(self, order: dict) -> None:
+        self.records[order["_id"]] = order
+        if order.get("idempotency_key"):
+            self.by_idempotency_key[order["idempotency_key"]] = order["_id"]
+
+    async def insert_pending(self, order: dict) -> bool:
+        if order["idempotency_key"] in self.by_idempotency_key:
+            return False
+        self.put(order)
+        return True
+
+    async def find_by_idempotency_key(self, idempotency_key: str) -> Optional[dict]:
+        order_id = self.by_idempotency_key.get(idempotency_key)
+        return self.records.get(order_id) if order_id is not None else None
+
+    async def delete_pending(self, order_id: Any) -> None:
+        order = self.records.get(order_id)
+        if order is not None and order["status"] == ORDER_PENDING:
+            del self.records[order_id]
+            if order.get("idempotency_key"):
+                self.by_idempotency_key.pop(order["idempotency_key"], None)
+
+    async def top_products(self, limit: int, recent_orders: int) -> List[str]:
+        processed = [order for order in self.records.values() if order["status"] == ORDER_PROCESSED]
+        processed.sort(key=lambda order: order["_id"], reverse=True)
+        counts: Dict[str, int] = defaultdict(int)
+        for order in processed[:recent_orders]:
+            for item in order["items"]:
+                counts[item["product_id"]] += 1
+        return sorted(counts, key=lambda pid: (-counts[pid], pid))[:limit]
+
+class MemoryAnalyticsStore:
+    """Cart reports computed over the records; materializing keeps a copy"""
+
+    def __init__(self, carts: MemoryCartStore, products: MemoryProductStore):
+        self.carts = carts
+        self.products = products
+        self._products: List[dict] = []
+        self._ages: List[dict] = []
+        self._materialized_at: Optional[datetime] = None
+
+    def _price(self, product_id: str) -> float:
+        product = self.products.records.get(product_id)
+        return product.price if product is not None else 0.0
+
+    def _all_products(self) -> List[dict]:
+        units: Dict[str, int] = defaultdict(int)
+        carts: Dict[str, int] = defaultdict(int)
+        for record in self.carts.records.values():
+            for line in record.items:
+                units[line.product_id] += line.quantity
+            for pid in record.product_ids():
+                carts[pid] += 1
+        stats = []
+        for pid, count in units.items():
+            product = self.products.records.get(pid)
+            stats.append({
+                "_id": pid,
+                "name": product.name if product is not None else None,
+                "price": self._price(pid),
+                "carts": carts[pid],
+                "units": count,
+                "value": count * self._price(pid)
+            })
+        return stats
+
+    async def cart_products(self, limit: Optional[int], sort: str, materialized: bool = False) -> List[dict]:
+        stats = [dict(s) for s in self._products] if materialized else self._all_products()
+        stats.sort(key=lambda s: (-s[sort], s["_id"]))
+        return stats[:limit] if limit else stats
+
+    async def cart_ages(self, buckets: AgeBuckets, materialized: bool = False) -> List[dict]:
+        if materialized:
+            return [dict(s) for s in self._ages]
+        now = datetime.now(timezone.utc)
+        stats: Dict[str, dict] = {}
+        for record in self.carts.records.values():
+            label = age_bucket(record.updated_at, now, buckets)
+            bucket = stats.setdefault(label, {"_id": label, "carts": 0, "empty_carts": 0, "units": 0, "value": 0.0})
+            bucket["carts"] += 1
+            bucket["empty_carts"] += 0 if record.items else 1
+            for line in record.items:
+                bucket["units"] += line.quantity
+                bucket["value"] += line.quantity * self._price(line.product_id)
+        return list(stats.values())
+
+    async def materialize(self, buckets: AgeBuckets) -> datetime:
+        self._products = self._all_products()
+        self._ages = await self.cart_ages(buckets)
+        self._materialized_at = datetime.now(timezone.utc)
+        return self._materialized_at
+
+    async def materialized_at(self) -> Optional[datetime]:
+        return self._materialized_at
+
+class MemoryStorage:
+    """Process-local storage for benchmarks and tests; nothing is persisted.
+
+    Records are plain __slots__ objects in dicts, copied out as documents on
+    read. Changes to a cart are serialized by a per-cart asyncio lock, and
+    checkout is all-or-nothing without compensation. Cart TTLs are not
+    enforced.
+    """
+
+    def __init__(self):
+        self.carts = MemoryCartStore()
+        self.products = MemoryProductStore()
+        self.orders = MemoryOrderStore()
+        self.analytics = MemoryAnalyticsStore(self.carts, self.products)
+
+    async def connect(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    async def ping(self) -> float:
+        return 0.0
+
+    async def dangling_product_ids(self) -> List[str]:
+        return [pid for pid in self.carts.by_product if pid not in self.products.records]
+
+    async def checkout(
+        self,
+        cart_id: str,
+        order_id: Any,
+        build_order: BuildOrder,
+        versions: Optional[List[int]] = None
+    ) -> Optional[dict]:
+        async with self.carts.lock(cart_id):
+            record = self.carts.check_version(cart_id, versions)
+            if record is None:
+                return None
+            cart = record.to_dict()
+            # Price first: nothing below awaits, so the stock check and decrements cannot interleave
+            order = await build_order(cart, None)
+            lines = order_lines(cart)
+            products = self.products.records
+            missing = [pid for pid in lines if pid not in products]
+            if missing or any(products[pid].in_stock < quantity for pid, quantity in lines.items()):
+                raise InsufficientStockError((), missing)
+            for pid, quantity in lines.items():
+                products[pid].in_stock -= quantity
+                products[pid].version += 1
+            self.carts.pop(cart_id)
+            self.orders.put(order)
+            return order
@@ -0,0 +1,754 @@
+# app/storage/mongo.py
+
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.core.config import settings
+from app.db import mongo
+from app.db.indexes import (
+    ANALYTICS_RUNS_COLLECTION, CART_AGE_STATS_COLLECTION, CART_COLLECTION, CART_PRODUCT_STATS_COLLECTION,
+    NAME_COLLATION, ORDER_COLLECTION, PRODUCT_COLLECTION, ensure_indexes
+)
+from app.db.pagination import keyset_filter, sorted_keyset_filter
+from app.db.versioning import VERSION_FIELD, next_version_expression, raise_if_exists, version_filter
+from app.schemas.product import ProductQuery
+from app.storage.base import (
+    ORDER_PENDING, ORDER_PROCESSED, UNKNOWN_AGE, AgeBuckets, BuildOrder, DuplicateSkuError, InsufficientStockError,
+    RefreshInProgressError, SkuUpsertResult, order_lines, product_changed
+)
+
+# Change stream stages: only the fields needed for cart events
+CART_CHANGES_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}},
+    {"$project": {
+        "operationType": 1,
+        "documentKey": 1,
+        f"fullDocument.{VERSION_FIELD}": 1,
+        f"updateDescription.updatedFields.{VERSION_FIELD}": 1
+    }}
+]
+
+def _with_str_id(document: dict) -> dict:
+    document["_id"] = str(document["_id"])
+    return document
+
+# Recomputes the stored total from price snapshots after the items changed
+SNAPSHOT_TOTAL_STAGE = {"$set": {"total_amount": {"$sum": {"$map": {
+    "input": "$items",
+    "in": {"$multiply": ["$$this.price", "$$this.quantity"]}
+}}}}}
+
+def item_ops_pipeline(ops: List[dict], version_increment: int = 1, bump_unchanged: bool = False) -> List[dict]:
+    """Build an update pipeline applying item operations to a cart atomically.
+
+    Product IDs come from clients, so they are wrapped in $literal; a string
+    starting with "$" would otherwise be read as a field path or variable.
+    """
+    items = {"$ifNull": ["$items", []]}
+
+    removed = [op["product_id"] for op in ops if op["op"] == "remove"]
+    if removed:
+        items = {"$filter": {"input": items, "cond": {"$not": [{"$in": ["$$this.product_id", {"$literal": removed}]}]}}}
+
+    branches = []
+    for op in ops:
+        if op["op"] == "remove":
+            continue
+        if op["op"] == "add":
+            quantity = {"$add": ["$$this.quantity", op["quantity"]]}
+        else:
+            quantity = op["quantity"]
+        changes = ["$$this"]
+        # Refresh stored snapshot fields of existing lines
+        snapshot = {k: v for k, v in (op.get("line") or {}).items() if k not in ("product_id", "quantity")}
+        if snapshot:
+            changes.append({"$literal": snapshot})
+        changes.append({"quantity": quantity})
+        branches.append({
+            "case": {"$eq": ["$$this.product_id", {"$literal": op["product_id"]}]},
+            "then": {"$mergeObjects": changes}
+        })
+    if branches:
+        items = {"$map": {"input": items, "in": {"$switch": {"branches": branches, "default": "$$this"}}}}
+
+    # The previous items tell whether the operations changed anything
+    pipeline = [{"$set": {"previous_items": {"$ifNull": ["$items", []]}, "items": items}}]
+
+    inserts = [
+        {"$cond": [{"$in": [{"$literal": op["product_id"]}, "$items.product_id"]}, [], [{"$literal": op["line"]}]]}
+        for op in ops if op["op"] != "remove" and op.get("line")
+    ]
+    if inserts:
+        pipeline.append({"$set": {"items": {"$concatArrays": ["$items", *inserts]}}})
+
+    if settings.cart_price_snapshots:
+        pipeline.append(SNAPSHOT_TOTAL_STAGE)
+
+    # updated_at drives the abandoned-cart TTL index; like the version, only a real change moves it
+    changed = True if bump_unchanged else {"$ne": ["$items", "$previous_items"]}
+    pipeline.append({"$set": {
+        "updated_at": {"$cond": [changed, "$$NOW", "$updated_at"]},
+        VERSION_FIELD: {"$cond": [
+            changed, next_version_expression(version_increment), {"$ifNull": [f"${VERSION_FIELD}", 0]}
+        ]}
+    }})
+    pipeline.append({"$unset": "previous_items"})
+    return pipeline
+
+# Upper bound of a prefix range; U+FFFF sorts after every character under a collation
+_PREFIX_END = "\uffff"
+
+def _product_filter(query: ProductQuery) -> dict:
+    conditions = {}
+    if query.q:
+        conditions["$text"] = {"$search": query.q}
+    if query.name_prefix:
+        conditions["name"] = {"$gte": query.name_prefix, "$lt": query.name_prefix + _PREFIX_END}
+    price = {}
+    if query.min_price is not None:
+        price["$gte"] = query.min_price
+    if query.max_price is not None:
+        price["$lte"] = query.max_price
+    if price:
+        conditions["price"] = price
+    if query.in_stock_only:
+        conditions["in_stock"] = {"$gt": 0}
+    return conditions
+
+class MongoProductStore:
+    @property
+    def _collection(self):
+        return mongo.get_db()[PRODUCT_COLLECTION]
+
+    async def get_many(self, product_ids: List[str], session: Any = None) -> Dict[str, dict]:
+        object_ids = [ObjectId(pid) for pid in product_ids if ObjectId.is_valid(pid)]
+        if not object_ids:
+            return {}
+        products = {}
+        async for product in self._collection.find({"_id": {"$in": object_ids}}, session=session):
+            products[str(product["_id"])] = _with_str_id(product)
+        return products
+
+    async def insert(self, product: dict) -> dict:
+        # insert_one sets the generated _id on product, so no re-read is needed
+        try:
+            await self._collection.insert_one(product)
+        except DuplicateKeyError:
+            if product.get("sku") is None:
+                raise
+            raise DuplicateSkuError(product["sku"])
+        return _with_str_id(product)
+
+    async def upsert_by_sku(self, products: List[dict]) -> SkuUpsertResult:
+        result: SkuUpsertResult = {"inserted": [], "updated": [], "unchanged": 0, "failed": {}}
+        # One read finds the products that exist, so only real changes are written
+        existing = {}
+        async for current in self._collection.find({"sku": {"$in": [p["sku"] for p in products]}}):
+            existing[current["sku"]] = current
+        requests = []
+        # Batch position and existing product ID (None for new SKUs) of each request
+        targets = []
+        for position, product in enumerate(products):
+            current = existing.get(product["sku"])
+            if current is not None and not product_changed(current, product):
+                result["unchanged"] += 1
+                continue
+            update = {"$set": product, "$inc": {VERSION_FIELD: 1}}
+            if current is None:
+                # Upsert on the SKU, so a concurrent import of the same SKU updates instead of failing
+                requests.append(UpdateOne({"sku": product["sku"]}, update, upsert=True))
+                targets.append((position, None))
+            else:
+                requests.append(UpdateOne({"_id": current["_id"]}, update))
+                targets.append((position, str(current["_id"])))
+        if not requests:
+            return result
+        try:
+            details = (await self._collection.bulk_write(requests, ordered=False)).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+        errors = {error["index"]: error["errmsg"] for error in details.get("writeErrors", [])}
+        upserted = {upsert["index"]: str(upsert["_id"]) for upsert in details.get("upserted", [])}
+        for index, (position, product_id) in enumerate(targets):
+            if index in errors:
+                result["failed"][position] = errors[index]
+            elif product_id is not None:
+                result["updated"].append(product_id)
+            elif index in upserted:
+                result["inserted"].append(upserted[index])
+            else:
+                # The SKU was inserted by someone else after the read above
+                current = await self._collection.find_one({"sku": products[position]["sku"]}, {"_id": 1})
+                if current is not None:
+                    result["updated"].append(str(current["_id"]))
+        return result
+
+    def _find(self, after: Optional[str], query: Optional[ProductQuery]):
+        query = query or ProductQuery()
+        field = query.sort_field
+        direction = -1 if query.descending else 1
+        options = {}
+        if query.fields is not None:
+            options["projection"] = dict.fromkeys([*query.fields, field], 1)
+        if query.name_prefix or field == "name":
+            # Matches the name index, for case-insensitive prefixes and order
+            options["collation"] = NAME_COLLATION
+        conditions = {**_product_filter(query), **sorted_keyset_filter(field, after, query.descending)}
+        products_cursor = self._collection.find(conditions, **options)
+        if field == "_id":
+            return products_cursor.sort("_id", direction)
+        return products_cursor.sort([(field, direction), ("_id", direction)])
+
+    async def page(self, limit: int, after: Optional[str], query: Optional[ProductQuery] = None) -> List[dict]:
+        products_cursor = self._find(after, query).limit(limit)
+        return [_with_str_id(product) async for product in products_cursor]
+
+    async def stream(
+        self,
+        after: Optional[str],
+        limit: Optional[int],
+        query: Optional[ProductQuery] = None
+    ) -> AsyncIterator[dict]:
+        products_cursor = self._find(after, query).batch_size(settings.cursor_batch_size)
+        if limit:
+            products_cursor = products_cursor.limit(limit)
+        async for product in products_cursor:
+            yield _with_str_id(product)
+
+    async def delete(self, product_id: str, versions: Optional[List[int]] = None) -> bool:
+        if not ObjectId.is_valid(product_id):
+            return False
+        result = await self._collection.delete_one({"_id": ObjectId(product_id), **version_filter(versions)})
+        if result.deleted_count == 0 and versions is not None:
+            await raise_if_exists(self._collection, ObjectId(product_id))
+        return result.deleted_count > 0
+
+def _cart_event(change: dict) -> Optional[dict]:
+    """Shape a change stream document as a cart event"""
+    operation = change["operationType"]
+    if operation == "delete":
+        version = None
+    elif operation == "update":
+        version = change.get("updateDescription", {}).get("updatedFields", {}).get(VERSION_FIELD)
+        if version is None:
+            return None
+    else:
+        operation = "insert" if operation == "insert" else "update"
+        version = change.get("fullDocument", {}).get(VERSION_FIELD, 0)
+    return {"cart_id": str(change["documentKey"]["_id"]), "operation": operation, "version": version}
+
+class MongoCartStore:
+    def __init__(self):
+        # Where a restarted change stream picks up
+        self._resume_token = None
+
+    @property
+    def _collection(self):
+        return mongo.get_db()[CART_COLLECTION]
+
+    async def insert(self, cart: dict) -> dict:
+        # insert_one sets the generated _id on cart, so no re-read is needed
+        await self._collection.insert_one(cart)
+        return cart
+
+    async def get(self, cart_id: str) -> Optional[dict]:
+        return await self._collection.find_one({"_id": ObjectId(cart_id)})
+
+    async def save(self, cart: dict) -> bool:
+        cart = {**cart, "_id": ObjectId(cart["_id"])}
+        # Never upsert, so a cart deleted meanwhile stays deleted
+        result = await self._collection.replace_one(
+            {"_id": cart["_id"], VERSION_FIELD: {"$not": {"$gte": cart[VERSION_FIELD]}}}, cart
+        )
+        return result.modified_count > 0
+
+    async def get_version(self, cart_id: str) -> Optional[int]:
+        cart = await self._collection.find_one({"_id": ObjectId(cart_id)}, {VERSION_FIELD: 1})
+        if cart:
+            return cart.get(VERSION_FIELD, 0)
+        return None
+
+    async def get_by_user(self, user_id: str) -> Optional[dict]:
+        return await self._collection.find_one({"user_id": user_id})
+
+    async def upsert_user_cart(self, user_id: str, ops: List[dict]) -> dict:
+        if ops:
+            # On insert the pipeline starts from {"user_id": user_id}, so the new cart gets version 1
+            update = item_ops_pipeline(ops)
+        else:
+            new_cart = {"items": [], "updated_at": datetime.now(timezone.utc), VERSION_FIELD: 1}
+            if settings.cart_price_snapshots:
+                new_cart["total_amount"] = 0.0
+            update = {"$setOnInsert": new_cart}
+        try:
+            return await self._upsert_user_cart(user_id, update)
+        except DuplicateKeyError:
+            # Another request created the user's cart first; servers before 4.2 do not retry this themselves
+            return await self._upsert_user_cart(user_id, update)
+
+    async def _upsert_user_cart(self, user_id: str, update: Any) -> dict:
+        return await self._collection.find_one_and_update(
+            {"user_id": user_id}, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+
+    async def page(self, limit: int, after: Optional[str]) -> List[dict]:
+        carts_cursor = self._collection.find(keyset_filter(after)).sort("_id", 1).limit(limit)
+        return await carts_cursor.to_list(length=limit)
+
+    async def stream(self, after: Optional[str], limit: Optional[int]) -> AsyncIterator[dict]:
+        carts_cursor = self._collection.find(keyset_filter(after)).sort("_id", 1)
+        carts_cursor = carts_cursor.batch_size(settings.cursor_batch_size)
+        if limit:
+            carts_cursor = carts_cursor.limit(limit)
+        async for cart in carts_cursor:
+            yield cart
+
+    async def apply_item_ops(
+        self,
+        cart_id: str,
+        ops: List[dict],
+        versions: Optional[List[int]] = None,
+        version_increment: int = 1,
+        return_document: bool = True,
+        require_lines: bool = False,
+        bump_unchanged: bool = False
+    ) -> Optional[dict]:
+        query = {"_id": ObjectId(cart_id), **version_filter(versions)}
+        if require_lines:
+            query["items.product_id"] = {"$all": [op["product_id"] for op in ops]}
+        pipeline = item_ops_pipeline(ops, version_increment, bump_unchanged)
+        if not return_document:
+            await self._collection.update_one(query, pipeline)
+            return None
+        # Apply and read back the cart in a single round trip
+        updated_cart = await self._collection.find_one_and_update(
+            query, pipeline, return_document=ReturnDocument.AFTER
+        )
+        if updated_cart is None and versions is not None:
+            # A cart still at an expected version only lacked a line
+            if not require_lines or not await self._collection.find_one(
+                {"_id": ObjectId(cart_id), **version_filter(versions)}, {"_id": 1}
+            ):
+                await raise_if_exists(self._collection, ObjectId(cart_id))
+        return updated_cart
+
+    async def update_price_snapshots(
+        self,
+        cart_id: str,
+        expected_items: List[dict],
+        items: List[dict],
+        total_amount: float,
+        priced_at: float,
+        bump_version: bool
+    ) -> bool:
+        update = {"$set": {"items": items, "total_amount": total_amount, "priced_at": priced_at}}
+        if bump_version:
+            update["$inc"] = {VERSION_FIELD: 1}
+        # Only persist if the items were not changed concurrently
+        result = await self._collection.update_one({"_id": ObjectId(cart_id), "items": expected_items}, update)
+        return result.modified_count > 0
+
+    async def clear(self, cart_id: str, versions: Optional[List[int]] = None) -> Optional[dict]:
+        update = {"$set": {"items": []}, "$currentDate": {"updated_at": True}, "$inc": {VERSION_FIELD: 1}}
+        if settings.cart_price_snapshots:
+            update["$set"]["total_amount"] = 0.0
+        updated_cart = await self._collection.find_one_and_update(
+            {"_id": ObjectId(cart_id), **version_filter(versions)},
+            update,
+            projection={"_id": 1, VERSION_FIELD: 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated_cart is None and versions is not None:
+            await raise_if_exists(self._collection, ObjectId(cart_id))
+        return updated_cart
+
+    async def delete(self, cart_id: str, versions: Optional[List[int]] = None) -> bool:
+        result = await self._collection.delete_one({"_id": ObjectId(cart_id), **version_filter(versions)})
+        if result.deleted_count == 0 and versions is not None:
+            await raise_if_exists(self._collection, ObjectId(cart_id))
+        return result.deleted_count > 0
+
+    async def bump_versions_with_products(self, product_ids: List[str]) -> None:
+        await self._collection.update_many({"items.product_id": {"$in": product_ids}}, {"$inc": {VERSION_FIELD: 1}})
+
+    async def remove_products(self, product_ids: List[str]) -> None:
+        # One multikey index scan finds every cart; a pipeline update keeps snapshot totals right
+        pipeline = [{"$set": {
+            "items": {"$filter": {
+                "input": "$items",
+                "cond": {"$not": [{"$in": ["$$this.product_id", {"$literal": product_ids}]}]}
+            }},
+            VERSION_FIELD: next_version_expression()
+        }}]
+        if settings.cart_price_snapshots:
+            pipeline.append(SNAPSHOT_TOTAL_STAGE)
+        await self._collection.update_many({"items.product_id": {"$in": product_ids}}, pipeline)
+
+    async def watch(self) -> AsyncIterator[dict]:
+        # Change streams need a replica set or sharded cluster
+        async with self._collection.watch(CART_CHANGES_PIPELINE, resume_after=self._resume_token) as stream:
+            async for change in stream:
+                self._resume_token = stream.resume_token
+                event = _cart_event(change)
+                if event is not None:
+                    yield event
+
+class MongoOrderStore:
+    @property
+    def _collection(self):
+        return mongo.get_db()[ORDER_COLLECTION]
+
+    async def insert_pending(self, order: dict) -> bool:
+        try:
+            await self._collection.insert_one(order)
+            return True
+        except DuplicateKeyError:
+            return False
+
+    async def find_by_idempotency_key(self, idempotency_key: str) -> Optional[dict]:
+        return await self._collection.find_one({"idempotency_key": idempotency_key})
+
+    async def delete_pending(self, order_id: Any) -> None:
+        await self._collection.delete_one({"_id": order_id, "status": ORDER_PENDING})
+
+    async def top_products(self, limit: int, recent_orders: int) -> List[str]:
+        pipeline = [
+            # Order IDs are ObjectIds, so the _id index yields the latest orders first
+            {"$sort": {"_id": -1}},
+            {"$match": {"status": ORDER_PROCESSED}},
+            {"$limit": recent_orders},
+            {"$unwind": "$items"},
+            {"$group": {"_id": "$items.product_id", "orders": {"$sum": 1}}},
+            {"$sort": {"orders": -1, "_id": 1}},
+            {"$limit": limit}
+        ]
+        return [line["_id"] async for line in self._collection.aggregate(pipeline)]
+
+def _product_lookup_stages(product_field: str) -> List[dict]:
+    """Look up the product whose ID string is at product_field into a product array, empty if there is none"""
+    return [
+        {"$set": {"product_oid": {"$convert": {
+            "input": f"${product_field}", "to": "objectId", "onError": None, "onNull": None
+        }}}},
+        {"$lookup": {"from": PRODUCT_COLLECTION, "localField": "product_oid", "foreignField": "_id", "as": "product"}},
+    ]
+
+def _pricing_stages(product_field: str) -> List[dict]:
+    """Look up the product at product_field once per document and set its name and current price"""
+    return [
+        *_product_lookup_stages(product_field),
+        # Lines of deleted products are worth nothing, as in the cart API
+        {"$set": {
+            "name": {"$arrayElemAt": ["$product.name", 0]},
+            "price": {"$ifNull": [{"$arrayElemAt": ["$product.price", 0]}, 0]}
+        }},
+        {"$project": {"product_oid": 0, "product": 0}},
+    ]
+
+def cart_products_pipeline(limit: Optional[int] = None, sort: str = "units") -> List[dict]:
+    """Aggregate carts into one document per product with the carts holding it, units and value"""
+    pipeline = [
+        {"$unwind": "$items"},
+        # Count every cart once per product, however many lines it has for it
+        {"$group": {"_id": {"product": "$items.product_id", "cart": "$_id"}, "units": {"$sum": "$items.quantity"}}},
+        {"$group": {"_id": "$_id.product", "carts": {"$sum": 1}, "units": {"$sum": "$units"}}},
+    ]
+    order = [{"$sort": {sort: -1, "_id": 1}}] + ([{"$limit": limit}] if limit else [])
+    if sort != "value":
+        # Price only the products that make the cut
+        pipeline += order
+    pipeline += _pricing_stages("_id")
+    pipeline.append({"$set": {"value": {"$multiply": ["$units", "$price"]}}})
+    if sort == "value":
+        pipeline += order
+    return pipeline
+
+def cart_ages_pipeline(buckets: AgeBuckets) -> List[dict]:
+    """Aggregate carts into one document per age bucket with carts, empty carts, units and value"""
+    age_ms = {"$subtract": ["$$NOW", "$updated_at"]}
+    branches = [{"case": {"$eq": [{"$ifNull": ["$updated_at", None]}, None]}, "then": UNKNOWN_AGE}]
+    branches += [
+        {"case": {"$lt": [age_ms, upper * 3600 * 1000]}, "then": label}
+        for label, _, upper in buckets if upper is not None
+    ]
+    # -1 for carts without items, so each cart is counted on its first line or its only document
+    line = {"$ifNull": ["$line", -1]}
+    return [
+        {"$project": {"items": 1, "bucket": {"$switch": {"branches": branches, "default": buckets[-1][0]}}}},
+        {"$unwind": {"path": "$items", "includeArrayIndex": "line", "preserveNullAndEmptyArrays": True}},
+        # Group by product within each bucket first, so each product is looked up once per bucket
+        {"$group": {
+            "_id": {"bucket": "$bucket", "product": "$items.product_id"},
+            "units": {"$sum": {"$ifNull": ["$items.quantity", 0]}},
+            "carts": {"$sum": {"$cond": [{"$lte": [line, 0]}, 1, 0]}},
+            "empty_carts": {"$sum": {"$cond": [{"$eq": [line, -1]}, 1, 0]}},
+        }},
+        *_pricing_stages("_id.product"),
+        {"$group": {
+            "_id": "$_id.bucket",
+            "carts": {"$sum": "$carts"},
+            "empty_carts": {"$sum": "$empty_carts"},
+            "units": {"$sum": "$units"},
+            "value": {"$sum": {"$multiply": ["$units", "$price"]}},
+        }},
+    ]
+
+class MongoAnalyticsStore:
+    """Cart reports as aggregation pipelines, materialized into summary collections with $merge.
+
+    Each materialization is a run keyed by a new ObjectId. Its documents are
+    merged next to those of earlier runs, and the run ID recorded in
+    analytics_runs tells materialized reads which documents to use. A lease
+    on that record lets one worker at a time materialize.
+    """
+
+    @property
+    def _runs(self):
+        return mongo.get_db()[ANALYTICS_RUNS_COLLECTION]
+
+    async def _aggregate(self, pipeline: List[dict]) -> List[dict]:
+        # Groups over every cart can outgrow the 100 MB in-memory stage limit
+        cursor = mongo.get_db()[CART_COLLECTION].aggregate(pipeline, allowDiskUse=True)
+        return await cursor.to_list(length=None)
+
+    async def _materialized(
+        self,
+        collection: str,
+        sort: Optional[List[Tuple[str, int]]] = None,
+        limit: Optional[int] = None
+    ) -> List[dict]:
+        """The documents of the recorded run, with their report _id back in place"""
+        latest = await self._runs.find_one({"_id": CART_COLLECTION}, {"run": 1})
+        if latest is None or "run" not in latest:
+            return []
+        stats_cursor = mongo.get_db()[collection].find({"run": latest["run"]}, {"run": 0, "computed_at": 0})
+        if sort:
+            stats_cursor = stats_cursor.sort(sort)
+        if limit:
+            stats_cursor = stats_cursor.limit(limit)
+        return [{**stats, "_id": stats["_id"]["key"]} async for stats in stats_cursor]
+
+    async def cart_products(self, limit: Optional[int], sort: str, materialized: bool = False) -> List[dict]:
+        if materialized:
+            return await self._materialized(CART_PRODUCT_STATS_COLLECTION, [(sort, -1), ("_id.key", 1)], limit)
+        return await self._aggregate(cart_products_pipeline(limit, sort))
+
+    async def cart_ages(self, buckets: AgeBuckets, materialized: bool = False) -> List[dict]:
+        if materialized:
+            return await self._materialized(CART_AGE_STATS_COLLECTION)
+        return await self._aggregate(cart_ages_pipeline(buckets))
+
+    async def _merge(self, pipeline: List[dict], collection: str, run: ObjectId) -> None:
+        """Write a report's documents for the run, keyed by run and report _id"""
+        await self._aggregate([
+            *pipeline,
+            {"$set": {"_id": {"run": run, "key": "$_id"}, "run": run, "computed_at": "$$NOW"}},
+            {"$merge": {"into": collection, "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+        ])
+
+    async def _lease(self, run: ObjectId) -> None:
+        """Take the lease on materializing for the run; raises RefreshInProgressError if another holds it"""
+        now = datetime.now(timezone.utc)
+        try:
+            # An unexpired lease makes the filter miss and the upsert collide with the record
+            await self._runs.find_one_and_update(
+                {"_id": CART_COLLECTION, "leased_until": {"$not": {"$gt": now}}},
+                {"$set": {
+                    "leased_by": run,
+                    "leased_until": now + timedelta(seconds=settings.analytics_refresh_lease_seconds)
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            raise RefreshInProgressError("Cart analytics are being materialized by another worker")
+
+    async def materialize(self, buckets: AgeBuckets) -> datetime:
+        run = ObjectId()
+        await self._lease(run)
+        try:
+            await self._merge(cart_products_pipeline(), CART_PRODUCT_STATS_COLLECTION, run)
+            await self._merge(cart_ages_pipeline(buckets), CART_AGE_STATS_COLLECTION, run)
+        except BaseException:
+            await self._runs.update_one(
+                {"_id": CART_COLLECTION, "leased_by": run}, {"$unset": {"leased_by": "", "leased_until": ""}}
+            )
+            raise
+        computed_at = datetime.now(timezone.utc)
+        previous = await self._runs.find_one_and_update(
+            {"_id": CART_COLLECTION, "leased_by": run},
+            {"$set": {"run": run, "computed_at": computed_at}, "$unset": {"leased_by": "", "leased_until": ""}}
+        )
+        if previous is None:
+            # The lease expired and another worker took over; its run replaces this one
+            raise RefreshInProgressError("Cart analytics are being materialized by another worker")
+        if previous.get("run") is not None:
+            # The run just replaced stays, so reads that started on it can finish
+            for collection in (CART_PRODUCT_STATS_COLLECTION, CART_AGE_STATS_COLLECTION):
+                await mongo.get_db()[collection].delete_many({"run": {"$lt": previous["run"]}})
+        return computed_at
+
+    async def materialized_at(self) -> Optional[datetime]:
+        latest = await self._runs.find_one({"_id": CART_COLLECTION})
+        if latest is None or "computed_at" not in latest:
+            return None
+        # Motor returns naive UTC datetimes unless the client is tz_aware
+        return latest["computed_at"].replace(tzinfo=timezone.utc)
+
+class MongoStorage:
+    """Storage on MongoDB through the shared Motor client"""
+
+    def __init__(self):
+        self.carts = MongoCartStore()
+        self.products = MongoProductStore()
+        self.orders = MongoOrderStore()
+        self.analytics = MongoAnalyticsStore()
+
+    async def connect(self) -> None:
+        await mongo.connect_to_mongo()
+        if settings.ensure_indexes_on_startup:
+            await ensure_indexes(dry_run=settings.index_dry_run)
+        # Serve the first requests on open connections rather than handshakes
+        await mongo.warm_pool(settings.mongo_min_pool_size, settings.warmup_pool_timeout_seconds)
+
+    async def close(self) -> None:
+        await mongo.close_mongo_connection()
+
+    async def ping(self) -> float:
+        return await mongo.ping()
+
+    async def dangling_product_ids(self) -> List[str]:
+        pipeline = [
+            {"$unwind": "$items"},
+            {"$group": {"_id": "$items.product_id"}},
+            *_product_lookup_stages("_id"),
+            {"$match": {"product": {"$size": 0}}},
+            {"$project": {"_id": 1}},
+        ]
+        cursor = mongo.get_db()[CART_COLLECTION].aggregate(pipeline, allowDiskUse=True)
+        return [line["_id"] async for line in cursor]
+
+    async def _missing_products(self, product_ids: Iterable[str], session: Any = None) -> List[str]:
+        """Which of the products no longer exist"""
+        product_ids = list(product_ids)
+        existing = await mongo.get_db()[PRODUCT_COLLECTION].distinct(
+            "_id", {"_id": {"$in": [ObjectId(pid) for pid in product_ids]}}, session=session
+        )
+        existing = {str(pid) for pid in existing}
+        return [pid for pid in product_ids if pid not in existing]
+
+    async def _release_reservations(self, cart: dict, lines: Dict[str, int], marker: str) -> None:
+        """Return the stock reserved under marker and put the deleted cart back"""
+        db = mongo.get_db()
+        if lines:
+            await db[PRODUCT_COLLECTION].bulk_write([
+                UpdateOne(
+                    {"_id": ObjectId(pid), marker: {"$exists": True}},
+                    {"$inc": {"in_stock": quantity, VERSION_FIELD: 1}, "$unset": {marker: ""}}
+                )
+                for pid, quantity in lines.items()
+            ], ordered=False)
+        await db[CART_COLLECTION].insert_one(cart)
+
+    async def checkout(
+        self,
+        cart_id: str,
+        order_id: Any,
+        build_order: BuildOrder,
+        versions: Optional[List[int]] = None
+    ) -> Optional[dict]:
+        if settings.checkout_use_transactions:
+            return await self._checkout_in_transaction(cart_id, order_id, build_order, versions)
+        return await self._checkout_with_compensation(cart_id, order_id, build_order, versions)
+
+    async def _checkout_in_transaction(
+        self,
+        cart_id: str,
+        order_id: Any,
+        build_order: BuildOrder,
+        versions: Optional[List[int]]
+    ) -> Optional[dict]:
+        """Delete the cart, decrement stock and persist the order in one transaction"""
+        db = mongo.get_db()
+
+        async def run(session) -> Optional[dict]:
+            cart = await db[CART_COLLECTION].find_one_and_delete(
+                {"_id": ObjectId(cart_id), **version_filter(versions)}, session=session
+            )
+            if not cart:
+                if versions is not None:
+                    await raise_if_exists(db[CART_COLLECTION], ObjectId(cart_id), session=session)
+                return None
+            lines = order_lines(cart)
+            if lines:
+                result = await db[PRODUCT_COLLECTION].bulk_write([
+                    UpdateOne(
+                        {"_id": ObjectId(pid), "in_stock": {"$gte": quantity}},
+                        {"$inc": {"in_stock": -quantity, VERSION_FIELD: 1}}
+                    )
+                    for pid, quantity in lines.items()
+                ], ordered=False, session=session)
+                if result.matched_count < len(lines):
+                    # Raising aborts the transaction, undoing the deletion and any decrements
+                    raise InsufficientStockError(lines, await self._missing_products(lines, session))
+            order = await build_order(cart, session)
+            await db[ORDER_COLLECTION].replace_one({"_id": order_id}, order, upsert=True, session=session)
+            return order
+
+        async with await mongo.get_client().start_session() as session:
+            return await session.with_transaction(run)
+
+    async def _checkout_with_compensation(
+        self,
+        cart_id: str,
+        order_id: Any,
+        build_order: BuildOrder,
+        versions: Optional[List[int]]
+    ) -> Optional[dict]:
+        """Checkout without transactions, undoing partial stock reservations on shortage or error.
+
+        Deleting the cart first makes concurrent checkouts of the same cart
+        race-free; each decrement leaves a per-order marker so that exactly the
+        reserved quantities can be returned if another product is short or the
+        order cannot be built or stored.
+        """
+        db = mongo.get_db()
+        cart = await db[CART_COLLECTION].find_one_and_delete({"_id": ObjectId(cart_id), **version_filter(versions)})
+        if not cart:
+            if versions is not None:
+                await raise_if_exists(db[CART_COLLECTION], ObjectId(cart_id))
+            return None
+
+        lines = order_lines(cart)
+        marker = f"reservations.{order_id}"
+        order = None
+        try:
+            if lines:
+                result = await db[PRODUCT_COLLECTION].bulk_write([
+                    UpdateOne(
+                        {"_id": ObjectId(pid), "in_stock": {"$gte": quantity}},
+                        {"$inc": {"in_stock": -quantity, VERSION_FIELD: 1}, "$set": {marker: quantity}}
+                    )
+                    for pid, quantity in lines.items()
+                ], ordered=False)
+                if result.matched_count < len(lines):
+                    raise InsufficientStockError(lines, await self._missing_products(lines))
+            order = await build_order(cart, None)
+            await db[ORDER_COLLECTION].replace_one({"_id": order_id}, order, upsert=True)
+        except BaseException:
+            # A write that failed on the way back still placed the order, which now owns the stock
+            if order is None or not await db[ORDER_COLLECTION].count_documents(
+                {"_id": order_id, "status": ORDER_PROCESSED}, limit=1
+            ):
+                # Also after errors that leave unknown which decrements applied, e.g. a dropped connection
+                await self._release_reservations(cart, lines, marker)
+            raise
+
+        if lines:
+            # Reservations are only needed until the order is persisted
+            await db[PRODUCT_COLLECTION].update_many(
+                {"_id": {"$in": [ObjectId(pid) for pid in lines]}},
+                {"$unset": {marker: ""}}
+            )
+        return order
@@ -0,0 +1,83 @@
+# benchmarks/common.py
+
+import random
+from typing import Dict, List, Sequence, Tuple
+from bson import ObjectId
+from app.core.config import settings
+from app.db import mongo
+from app.storage import get_storage
+
+def add_backend_arguments(parser) -> None:
+    parser.add_argument("--mongo-uri", default=settings.mongo_uri, help="MongoDB to benchmark against")
+    parser.add_argument("--db", default="cartdb_bench", help="scratch database, dropped afterwards")
+    parser.add_argument("--storage", choices=["mongo", "memory"], default=settings.storage_backend,
+                        help="storage engine; memory needs no database")
+
+def configure(args) -> None:
+    """Point the app settings at the benchmark database before it connects"""
+    settings.mongo_uri = args.mongo_uri
+    settings.mongo_db = args.db
+    settings.storage_backend = args.storage
+
+async def use_mongomock() -> None:
+    """Replace the Motor client with an in-process mongomock-motor stand-in"""
+    from mongomock_motor import AsyncMongoMockClient
+    mongo.mongo_client = AsyncMongoMockClient()
+    mongo._db = mongo.mongo_client[settings.mongo_db]
+
+async def drop_database() -> None:
+    if settings.storage_backend == "memory":
+        # Nothing outlives the process
+        return
+    await mongo.mongo_client.drop_database(settings.mongo_db)
+
+async def seed(products: int, carts: int, cart_sizes: Sequence[int]) -> Tuple[List[str], List[str]]:
+    """Insert products and carts of the given sizes directly; returns their IDs"""
+    product_docs = [
+        {
+            "_id": ObjectId(),
+            "name": f"Product {i}",
+            "description": f"Benchmark product {i}",
+            "price": round(random.uniform(1, 500), 2),
+            "in_stock": 1_000_000,
+        }
+        for i in range(products)
+    ]
+    if settings.storage_backend == "memory":
+        # The memory engine assigns its own string IDs
+        product_docs = [await get_storage().products.insert(doc) for doc in product_docs]
+    elif product_docs:
+        await mongo.get_db()["products"].insert_many(product_docs)
+    product_ids = [str(doc["_id"]) for doc in product_docs]
+
+    cart_docs = []
+    for i in range(carts):
+        size = min(cart_sizes[i % len(cart_sizes)], len(product_ids))
+        items = [{"product_id": pid, "quantity": random.randint(1, 5)} for pid in random.sample(product_ids, size)]
+        cart_docs.append({"_id": ObjectId(), "items": items})
+    if settings.storage_backend == "memory":
+        cart_docs = [await get_storage().carts.insert(doc) for doc in cart_docs]
+    elif cart_docs:
+        await mongo.get_db()["carts"].insert_many(cart_docs)
+    return product_ids, [str(doc["_id"]) for doc in cart_docs]
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+def latency_summary(samples: Dict[str, List[float]]) -> Dict[str, dict]:
+    """Count and p50/p95/p99/max latency in milliseconds per operation"""
+    summary = {}
+    for name, values in samples.items():
+        ordered = sorted(values)
+        summary[name] = {
+            "count": len(ordered),
+            "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+            "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+            "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3) if ordered else 0.0,
+        }
+    return summary
@@ -0,0 +1,108 @@
+# benchmarks/load.py
+"""Drive the cart lifecycle against app.main:app with concurrent async clients.
+
+Requires a local mongod (e.g. `docker-compose up -d mongo`); mongomock cannot
+run the pipeline updates used by cart mutations. --storage memory runs against
+the in-process engine instead, isolating API overhead from the database.
+
+    python -m benchmarks.load --concurrency 32 --iterations 50
+    python -m benchmarks.load --storage memory --concurrency 32 --iterations 50
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+from app.core.metrics import http_request_mongo_commands
+from benchmarks.common import add_backend_arguments, configure, drop_database, latency_summary, seed
+
+async def _timed(samples: Dict[str, List[float]], name: str, request) -> httpx.Response:
+    started = time.perf_counter()
+    response = await request
+    samples[name].append(time.perf_counter() - started)
+    response.raise_for_status()
+    return response
+
+async def _worker(
+    client: httpx.AsyncClient,
+    samples: Dict[str, List[float]],
+    args,
+    product_ids: List[str],
+    seeded_cart_ids: List[str],
+    cart_size: int
+) -> None:
+    for _ in range(args.iterations):
+        response = await _timed(samples, "create_cart", client.post("/api/v1/carts/", json={"items": []}))
+        cart_id = response.json()["_id"]
+        chosen = random.sample(product_ids, min(cart_size, len(product_ids)))
+        for product_id in chosen:
+            await _timed(samples, "add_item", client.post(
+                f"/api/v1/carts/{cart_id}/items", json={"productId": product_id, "quantity": 1}
+            ))
+        await _timed(samples, "update_item", client.put(
+            f"/api/v1/carts/{cart_id}/items/{chosen[0]}", json={"quantity": 3}
+        ))
+        await _timed(samples, "get_cart", client.get(f"/api/v1/carts/{cart_id}"))
+        if seeded_cart_ids:
+            await _timed(samples, "get_seeded_cart", client.get(f"/api/v1/carts/{random.choice(seeded_cart_ids)}"))
+        await _timed(samples, "checkout", client.post(f"/api/v1/carts/{cart_id}/checkout", json={}))
+
+def _mongo_commands_per_request() -> Dict[str, float]:
+    return {
+        f"{method} {route}": round(total / count, 2)
+        for (method, route), (count, total) in sorted(http_request_mongo_commands.snapshot().items())
+        if count
+    }
+
+async def run(args) -> dict:
+    configure(args)
+    # Imported after configure() so the app picks up the benchmark database
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        try:
+            product_ids, seeded_cart_ids = await seed(args.products, args.carts, args.cart_sizes)
+            samples: Dict[str, List[float]] = defaultdict(list)
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                started = time.perf_counter()
+                await asyncio.gather(*(
+                    _worker(client, samples, args, product_ids, seeded_cart_ids,
+                            args.cart_sizes[i % len(args.cart_sizes)])
+                    for i in range(args.concurrency)
+                ))
+                elapsed = time.perf_counter() - started
+        finally:
+            if not args.keep_data:
+                await drop_database()
+
+    total_requests = sum(len(values) for values in samples.values())
+    return {
+        "concurrency": args.concurrency,
+        "requests": total_requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total_requests / elapsed, 1) if elapsed else 0.0,
+        "latency": latency_summary(samples),
+        "mongo_commands_per_request": _mongo_commands_per_request(),
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_backend_arguments(parser)
+    parser.add_argument("--products", type=int, default=1000, help="products to seed")
+    parser.add_argument("--carts", type=int, default=200, help="pre-existing carts to seed for reads")
+    parser.add_argument("--cart-sizes", type=lambda v: [int(x) for x in v.split(",")], default=[1, 5, 20, 40],
+                        help="comma-separated line-item counts, assigned round-robin to carts and clients")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--iterations", type=int, default=20, help="cart lifecycles per client")
+    parser.add_argument("--keep-data", action="store_true", help="do not drop the benchmark database")
+    print(json.dumps(asyncio.run(run(parser.parse_args())), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/micro.py
+"""Micro-benchmarks of cart enrichment, Pydantic model construction and orjson serialization.
+
+    python -m benchmarks.micro --mongomock --save baseline.json
+    python -m benchmarks.micro --mongomock --baseline baseline.json --tolerance 20
+
+With --baseline the run exits non-zero when any benchmark is slower than the
+baseline by more than the tolerance (in percent).
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Awaitable, Callable, Dict
+
+import orjson
+
+from app.models.cart import CartModel
+from app.repositories.cart import enrich_cart_items
+from app.repositories.product import product_cache
+from app.schemas.cart import CartItemWithDetails, CartResponse
+from benchmarks.common import add_backend_arguments, configure, drop_database, seed, use_mongomock
+
+async def _measure(fn: Callable[[], Awaitable[None]], min_time: float) -> float:
+    """Mean seconds per call, repeating until min_time has elapsed"""
+    await fn()  # warm-up
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        await fn()
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            return elapsed / calls
+
+def _item_details(size: int) -> list:
+    return [
+        {"product_id": f"{i:024x}", "product_name": f"Product {i}", "quantity": 2, "price": 9.99, "total_price": 19.98}
+        for i in range(size)
+    ]
+
+async def run(args) -> Dict[str, float]:
+    configure(args)
+    if args.mongomock:
+        await use_mongomock()
+    else:
+        from app.storage import get_storage
+        await get_storage().connect()
+
+    results: Dict[str, float] = {}
+    try:
+        product_ids, _ = await seed(max(args.sizes), 0, [])
+        for size in args.sizes:
+            items = [{"product_id": pid, "quantity": 2} for pid in product_ids[:size]]
+
+            async def enrich_warm():
+                await enrich_cart_items(items)
+
+            async def enrich_cold():
+                product_cache.clear()
+                await enrich_cart_items(items)
+
+            results[f"enrich_cart_items[{size}] warm cache"] = await _measure(enrich_warm, args.min_time)
+            results[f"enrich_cart_items[{size}] cold cache"] = await _measure(enrich_cold, args.min_time)
+
+            details = _item_details(size)
+
+            async def build_items():
+                [CartItemWithDetails(**item) for item in details]
+
+            async def build_cart_and_response():
+                cart = CartModel(id="0" * 24, items=[CartItemWithDetails(**item) for item in details], total_amount=1.0)
+                CartResponse.model_validate(cart.model_dump(by_alias=True)).model_dump_json(by_alias=True)
+
+            async def serialize_plain_cart():
+                orjson.dumps({"_id": "0" * 24, "items": details, "total_amount": 1.0})
+
+            results[f"CartItemWithDetails x{size}"] = await _measure(build_items, args.min_time)
+            results[f"CartModel + CartResponse[{size}]"] = await _measure(build_cart_and_response, args.min_time)
+            results[f"orjson CartDict[{size}]"] = await _measure(serialize_plain_cart, args.min_time)
+    finally:
+        await drop_database()
+    return results
+
+def _compare(results: Dict[str, float], baseline: Dict[str, float], tolerance: float) -> bool:
+    ok = True
+    for name, seconds in results.items():
+        if name not in baseline:
+            continue
+        change = (seconds / baseline[name] - 1) * 100
+        flag = ""
+        if change > tolerance:
+            ok = False
+            flag = "  REGRESSION"
+        print(f"{name:45s} {seconds * 1e6:12.1f} us  ({change:+.1f}% vs baseline){flag}")
+    return ok
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_backend_arguments(parser)
+    parser.add_argument("--mongomock", action="store_true", help="use the in-process mongomock-motor stand-in")
+    parser.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")], default=[1, 10, 40, 200],
+                        help="comma-separated cart sizes")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend per benchmark")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=15.0, help="allowed slowdown in percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not _compare(results, baseline, args.tolerance):
+            sys.exit(1)
+    else:
+        for name, seconds in results.items():
+            print(f"{name:45s} {seconds * 1e6:12.1f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# tests/test_events.py
+
+import asyncio
+from app.core.events import CartEventHub
+
+def test_watcher_stops_with_the_last_subscriber():
+    async def run():
+        watching = []
+
+        async def source():
+            watching.append(True)
+            try:
+                await asyncio.Event().wait()
+                yield {}
+            finally:
+                watching.pop()
+
+        hub = CartEventHub(source, queue_size=10, max_subscribers=10)
+        first, second = hub.subscribe("cart"), hub.subscribe()
+        await asyncio.sleep(0)
+        assert watching == [True]
+
+        hub.unsubscribe(first)
+        await asyncio.sleep(0)
+        assert watching == [True]
+        hub.unsubscribe(second)
+        await asyncio.sleep(0)
+        assert watching == []
+
+        hub.subscribe()
+        await asyncio.sleep(0)
+        assert watching == [True]
+        await hub.close()
+        assert watching == []
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+# tests/test_hot_tier.py
+
+import asyncio
+from datetime import datetime, timezone
+import pytest
+from app.storage.base import InsufficientStockError
+from app.storage.hot_tier import TieredStorage
+from app.storage.memory import MemoryStorage
+
+fakeredis = pytest.importorskip("fakeredis")
+
+async def _storage_with_cart(in_stock: int):
+    storage = TieredStorage(MemoryStorage(), fakeredis.FakeAsyncRedis(decode_responses=True))
+    product = await storage.products.insert({"name": "Widget", "price": 2.0, "in_stock": in_stock})
+    line = {"product_id": product["_id"], "quantity": 1}
+    cart = await storage.carts.insert({"items": [line], "version": 1, "updated_at": datetime.now(timezone.utc)})
+    return storage, cart["_id"], line
+
+async def _build_order(cart: dict, session) -> dict:
+    return {"_id": "order", "cart_id": cart["_id"], "items": cart["items"], "status": "processed"}
+
+def test_change_during_checkout_does_not_revive_the_cart():
+    async def run():
+        storage, cart_id, line = await _storage_with_cart(in_stock=10)
+        durable_checkout = storage.cold.checkout
+        changes = []
+
+        async def checkout_with_concurrent_changes(*args, **kwargs):
+            # The hot copy is gone and the durable store still holds the cart
+            changes.append(await storage.carts.apply_item_ops(cart_id, [{**line, "op": "add", "line": line}]))
+            changes.append(await storage.carts.apply_item_ops(cart_id, [{**line, "op": "set", "quantity": 3}]))
+            changes.append(await storage.carts.get(cart_id))
+            return await durable_checkout(*args, **kwargs)
+
+        storage.cold.checkout = checkout_with_concurrent_changes
+        assert await storage.checkout(cart_id, "order", _build_order) is not None
+        assert changes == [None, None, None]
+        assert await storage.carts.get(cart_id) is None
+        assert not await storage.carts.client.exists(storage.carts._key(cart_id))
+
+    asyncio.run(run())
+
+def test_failed_checkout_leaves_the_cart_usable():
+    async def run():
+        storage, cart_id, line = await _storage_with_cart(in_stock=0)
+        with pytest.raises(InsufficientStockError):
+            await storage.checkout(cart_id, "order", _build_order)
+        cart = await storage.carts.apply_item_ops(cart_id, [{**line, "op": "set", "quantity": 2}])
+        assert cart["items"][0]["quantity"] == 2
+        assert await storage.carts.client.exists(storage.carts._key(cart_id))
+
+    asyncio.run(run())
+
+def test_product_sets_follow_the_carts():
+    async def run():
+        storage, cart_id, line = await _storage_with_cart(in_stock=10)
+        client, carts = storage.carts.client, storage.carts
+        product_key = carts._product_key(line["product_id"])
+        assert await client.smembers(product_key) == {cart_id}
+        assert 0 < await client.ttl(product_key) <= await client.ttl(carts._key(cart_id))
+
+        await carts.apply_item_ops(cart_id, [{**line, "op": "remove"}])
+        assert not await client.exists(product_key)
+        await carts.apply_item_ops(cart_id, [{**line, "op": "add", "line": line}])
+        await carts.clear(cart_id)
+        assert not await client.exists(product_key)
+
+        for _ in range(3):
+            other = await carts.insert({"items": [line], "version": 1, "updated_at": datetime.now(timezone.utc)})
+            await storage.checkout(other["_id"], "order", _build_order)
+        await carts.apply_item_ops(cart_id, [{**line, "op": "add", "line": line}])
+        await carts.delete(cart_id)
+        assert not await client.exists(product_key)
+
+    asyncio.run(run())
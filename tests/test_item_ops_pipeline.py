@@ -0,0 +1,18 @@
+# tests/test_item_ops_pipeline.py
+
+from app.storage.mongo import item_ops_pipeline
+
+def _unescaped(value, target: str) -> bool:
+    """Whether target appears in the expression outside a $literal"""
+    if isinstance(value, dict):
+        return any(key != "$literal" and _unescaped(inner, target) for key, inner in value.items())
+    if isinstance(value, list):
+        return any(_unescaped(inner, target) for inner in value)
+    return value == target
+
+def test_product_ids_are_never_read_as_expressions():
+    product_id = "$$ROOT.items.product_id"
+    line = {"product_id": product_id, "quantity": 1}
+    for op in ("add", "set", "remove"):
+        pipeline = item_ops_pipeline([{"product_id": product_id, "op": op, "quantity": 1, "line": line}])
+        assert not _unescaped(pipeline, product_id), op
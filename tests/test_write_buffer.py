@@ -0,0 +1,35 @@
+# tests/test_write_buffer.py
+
+import asyncio
+from datetime import datetime, timezone
+from app.core.write_buffer import CartWriteBuffer
+from app.repositories import cart as cart_repository
+from app.storage.memory import MemoryStorage
+
+def test_cancelled_changes_do_not_reuse_reported_versions(monkeypatch):
+    async def run():
+        storage = MemoryStorage()
+        monkeypatch.setattr(cart_repository, "get_storage", lambda: storage)
+        buffer = CartWriteBuffer(
+            window_ms=60_000,
+            max_carts=10,
+            load=storage.carts.get,
+            write=cart_repository._write_item_quantities
+        )
+        line = {"product_id": "p1", "quantity": 1}
+        cart = await storage.carts.insert({"items": [line], "version": 1, "updated_at": datetime.now(timezone.utc)})
+        cart_id = cart["_id"]
+
+        reported = {}
+        for quantity in (2, 1):
+            buffered = await buffer.set_quantity(cart_id, "p1", quantity)
+            reported[buffered["version"]] = quantity
+        assert reported == {2: 2, 3: 1}
+        await buffer.flush(cart_id)
+        assert await storage.carts.get_version(cart_id) == 3
+
+        changed = await storage.carts.apply_item_ops(cart_id, [{**line, "op": "add", "quantity": 4}])
+        assert changed["version"] not in reported
+        assert changed["items"][0]["quantity"] == 5
+
+    asyncio.run(run())